@@ -0,0 +1,478 @@
+"""ASGI entry point: the chat endpoints as coroutines, every other route served by the Flask app.
+
+Run it with any ASGI server from the project root, e.g.
+
+    uvicorn --app-dir api asgi:app --workers 2
+
+In the Flask app each chat holds a worker thread for the whole model call,
+so a process serves as many chats at once as it has threads. Here a chat
+waiting on the model is a suspended coroutine, so one process can keep
+hundreds in flight:
+
+- Retrieval (query embedding and FAISS search) and the response cache
+  lookup run in a thread pool while the event loop formats the graph state,
+  so the turn waits for the slower of them rather than their sum.
+- Model calls go through the SDK's async client, which keeps one pooled
+  connection per process, with a deadline (MODEL_TIMEOUT_SECONDS) and a
+  hedged second request when the first is slow (MODEL_HEDGE_MS).
+- Identical model calls in flight at the same time (same assembled context)
+  share one upstream call, as in the Flask routes.
+- Uploads, stats, metrics and the page go to the Flask app through a small
+  WSGI bridge that runs it in the same thread pool.
+"""
+import asyncio
+import io
+import json
+import os
+import sys
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+import index
+from async_calls import hedged, holding, run_blocking
+from conversation import estimate_tokens
+from metrics import StageTimer
+from response_parser import StreamingResponseParser
+from single_flight import AsyncSingleFlight
+from upstream_scheduler import UpstreamBusy
+
+# Threads for the blocking parts of async requests (retrieval, SQLite, the Flask routes); chats
+# waiting on the model do not hold one
+ASYNC_BLOCKING_THREADS = int(os.environ.get('ASYNC_BLOCKING_THREADS', '32'))
+blocking = ThreadPoolExecutor(max_workers=ASYNC_BLOCKING_THREADS, thread_name_prefix='asgi-blocking')
+
+chat_calls = AsyncSingleFlight('chat', index.COALESCED_CALLS, enabled=index.COALESCE_CALLS)
+chat_streams = AsyncSingleFlight('chat_stream', index.COALESCED_CALLS, enabled=index.COALESCE_CALLS)
+
+
+async def read_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    return bytes(body)
+
+
+async def send_json(send, body, status=200, endpoint=None, headers=()):
+    payload = json.dumps(body).encode('utf-8')
+    if endpoint:
+        index.HTTP_BYTES.inc(len(payload), endpoint=endpoint, direction='out')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode())] + list(headers)
+    })
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+class NDJSONStream:
+    """Streamed application/x-ndjson response, started when the first line is sent"""
+
+    def __init__(self, send, endpoint):
+        self.send = send
+        self.endpoint = endpoint
+        self.started = False
+
+    async def write(self, line):
+        if not self.started:
+            self.started = True
+            await self.send({'type': 'http.response.start', 'status': 200,
+                             'headers': [(b'content-type', b'application/x-ndjson')]})
+        payload = line.encode('utf-8')
+        index.HTTP_BYTES.inc(len(payload), endpoint=self.endpoint, direction='out')
+        await self.send({'type': 'http.response.body', 'body': payload, 'more_body': True})
+
+    async def line(self, event):
+        await self.write(json.dumps(event) + '\n')
+
+    async def close(self):
+        await self.send({'type': 'http.response.body', 'body': b''})
+
+
+async def send_model_message(turn, stream=False):
+    """Send a turn to the model, sharing an identical call already in flight"""
+    key = index.model_call_key(turn)
+    if stream:
+        response, shared = await chat_streams.stream(key, lambda: call_model(turn, stream=True))
+    else:
+        response, shared = await chat_calls.do(key, lambda: call_model(turn, stream=False))
+    if shared:
+        print(f"Shared an identical model {'stream' if stream else 'call'} already in flight")
+    return response
+
+
+async def call_model(turn, stream):
+    """Call the model through the async client, hedged and with a deadline"""
+    def attempt(number):
+        chat_session = index.get_chat_model().start_chat(history=turn.history)
+        send = lambda: chat_session.send_message_async(turn.message, stream=stream)
+        # A hedge only goes out if it is admitted at once; queueing it would add load where there is too much
+        max_wait = 0 if number else None
+        if stream:
+            return index.upstream.astream('generate', 'interactive', send, max_wait)
+        return index.upstream.acall('generate', 'interactive', send, max_wait)
+
+    try:
+        response, number = await hedged(attempt, index.MODEL_TIMEOUT, index.MODEL_HEDGE_AFTER,
+                                        on_hedge=lambda reason: index.MODEL_HEDGES.inc(reason=reason))
+    except UpstreamBusy:
+        index.MODEL_CALLS.inc(result='shed')
+        raise
+    except asyncio.TimeoutError:
+        index.MODEL_CALLS.inc(result='timeout')
+        raise
+    except Exception:
+        index.MODEL_CALLS.inc(result='error')
+        raise
+    index.MODEL_CALLS.inc(result='hedge' if number else 'first')
+    if number:
+        print("Model call answered by the hedged request")
+    return response
+
+
+async def record_local_turn(conversation, user_message, current_expressions, response):
+    """record_local_turn without blocking the event loop on the conversation lock"""
+    async with holding(conversation.lock):
+        turn = conversation.prepare(user_message, current_expressions, index.format_graph_state(current_expressions))
+        conversation.commit(turn, json.dumps(response))
+
+
+async def start_chat_turn(body, endpoint):
+    """Shared start of both chat endpoints.
+
+    Returns ('reply', status, body, outcome) for requests answered without
+    the model, or ('model', turn inputs) once retrieval, the cache lookup and
+    the graph state are ready.
+    """
+    if not index.MODEL_CONFIGURED:
+        return 'reply', 500, {
+            'chatResponse': 'Error: Gemini API key not configured. Please set GEMINI_API_KEY environment variable.',
+            'graphCommands': []
+        }, 'error'
+
+    index.HTTP_BYTES.inc(len(body), endpoint=endpoint, direction='in')
+    with index.stage('read_request'):
+        user_message, session_id, history, current_expressions, graph, reply_count = index.parse_chat_request(json.loads(body))
+
+    if not user_message:
+        return 'reply', 400, {'chatResponse': 'Please provide a message.', 'graphCommands': []}, 'invalid'
+    if current_expressions is None:
+        return 'reply', 409, index.GRAPH_RESYNC_BODY, 'resync'
+
+    conversation = index.open_conversation(session_id, history, user_message, reply_count)
+
+    with index.stage('fast_path'):
+        local_response = index.parse_local_command(user_message, current_expressions) if index.FAST_PATH_ENABLED else None
+    if local_response:
+        print("Handled by local fast path")
+        await record_local_turn(conversation, user_message, current_expressions, local_response)
+        return 'reply', 200, dict(index.apply_graph_commands(graph, local_response), fastPath=True), 'fast_path'
+
+    # Retrieval and the cache lookup run in threads while the graph state is formatted here. A cache
+    # hit wastes little retrieval work, since a repeated question finds its query embedding cached
+    retrieval = asyncio.ensure_future(run_blocking(blocking, index.get_rag_context, session_id, user_message))
+    lookup = asyncio.ensure_future(run_blocking(
+        blocking, index.lookup_cached_response, user_message, session_id, history, current_expressions
+    ))
+    try:
+        with index.stage('graph_format'):
+            graph_text = index.format_graph_state(current_expressions)
+        with index.stage('cache_lookup'):
+            cache_key, cached_response = await lookup
+        if cached_response:
+            print("Response cache hit")
+            await record_local_turn(conversation, user_message, current_expressions, cached_response)
+            return 'reply', 200, dict(index.apply_graph_commands(graph, cached_response), cached=True), 'cached'
+
+        with index.stage('retrieval_wait'):
+            rag_chunks = await retrieval
+    finally:
+        retrieval.cancel()
+        lookup.cancel()
+
+    return 'model', dict(user_message=user_message, session_id=session_id, history=history,
+                         current_expressions=current_expressions, graph=graph, conversation=conversation,
+                         cache_key=cache_key, rag_chunks=rag_chunks, graph_text=graph_text)
+
+
+def prepare_model_turn(inputs):
+    with index.stage('context'):
+        return index.prepare_turn(inputs['conversation'], inputs['user_message'], inputs['session_id'],
+                                  inputs['history'], inputs['current_expressions'],
+                                  rag_chunks=inputs['rag_chunks'], graph_text=inputs['graph_text'])
+
+
+async def chat(scope, receive, send):
+    """Async /api/chat: the same request and response as the Flask route"""
+    timer = StageTimer('chat')
+    index.request_timer.set(timer)
+    outcome = 'error'
+    try:
+        started = await start_chat_turn(await read_body(receive), 'chat')
+        if started[0] == 'reply':
+            _, status, body, outcome = started
+            return await send_json(send, body, status, 'chat')
+        inputs = started[1]
+        conversation, graph = inputs['conversation'], inputs['graph']
+
+        # One turn at a time per session, so the stored history stays in order
+        async with holding(conversation.lock):
+            turn = prepare_model_turn(inputs)
+            try:
+                with index.stage('model'):
+                    response = await send_model_message(turn)
+            except UpstreamBusy as busy:
+                outcome = 'shed'
+                body, retry_after = index.busy_body(busy)
+                return await send_json(send, body, 503, 'chat', [(b'retry-after', str(retry_after).encode())])
+            except Exception as api_error:
+                print(f"ERROR calling Gemini API: {api_error!r}")
+                outcome = 'model_error'
+                return await send_json(send, {
+                    'chatResponse': f"Sorry, there was an error communicating with the AI: {str(api_error) or 'timed out'}",
+                    'graphCommands': []
+                }, endpoint='chat')
+
+            response_text = response.text.strip() if response and response.text else ""
+            if response_text:
+                conversation.commit(turn, response_text)
+
+        index.MODEL_TOKENS.inc(estimate_tokens(response_text), direction='output')
+        if not response_text:
+            print("ERROR: AI returned empty response!")
+            outcome = 'empty'
+            return await send_json(send, {
+                'chatResponse': "I apologize, but I didn't generate a proper response. Please try rephrasing your question.",
+                'graphCommands': []
+            }, endpoint='chat')
+
+        with index.stage('parse'):
+            chat_response, graph_commands, parsed = index.parse_ai_response(response_text)
+        graph_commands = index.validate_graph_commands(graph_commands)
+        result = index.apply_graph_commands(graph, {'chatResponse': chat_response, 'graphCommands': graph_commands})
+
+        if parsed and inputs['cache_key']:
+            with index.stage('cache_store'):
+                await run_blocking(blocking, index.response_cache.put, inputs['cache_key'], {
+                    'chatResponse': chat_response,
+                    'graphCommands': result['graphCommands']
+                })
+
+        outcome = 'model' if parsed else 'unparsed'
+        await send_json(send, result, endpoint='chat')
+
+    except Exception as e:
+        print(f"Error in chat endpoint: {e}")
+        traceback.print_exc()
+        await send_json(send, {'chatResponse': f'An error occurred: {str(e)}', 'graphCommands': []}, 500, 'chat')
+    finally:
+        index.finish_timing(timer, outcome)
+
+
+async def chat_stream(scope, receive, send):
+    """Async /api/chat/stream: NDJSON events, each graph command sent as soon as it is complete"""
+    timer = StageTimer('chat_stream')
+    index.request_timer.set(timer)
+    outcome = 'error'
+    stream = NDJSONStream(send, 'chat_stream')
+    try:
+        started = await start_chat_turn(await read_body(receive), 'chat_stream')
+        if started[0] == 'reply':
+            _, status, body, outcome = started
+            if status != 200:
+                return await send_json(send, body, status, 'chat_stream')
+            done_fields = {key: True for key in ('fastPath', 'cached') if body.pop(key, False)}
+            for line in index.replay_response(body, **done_fields):
+                await stream.write(line)
+            return await stream.close()
+        inputs = started[1]
+        conversation, graph = inputs['conversation'], inputs['graph']
+        parser = StreamingResponseParser()
+        commands_sent = []
+
+        # Held until the stream finishes so the turn is committed before the next one starts
+        async with holding(conversation.lock):
+            turn = prepare_model_turn(inputs)
+            response = None
+            try:
+                with index.stage('model_first_chunk'):
+                    response = await send_model_message(turn, stream=True)
+                chunks = aiter(response)
+                deadline = asyncio.get_running_loop().time() + index.MODEL_TIMEOUT
+                while True:
+                    # Only time spent waiting on the model counts, not time spent sending to the client
+                    with index.stage('model_stream'):
+                        try:
+                            chunk = await asyncio.wait_for(anext(chunks), deadline - asyncio.get_running_loop().time())
+                        except StopAsyncIteration:
+                            break
+                    try:
+                        text = chunk.text
+                    except ValueError:
+                        # Chunks without text parts (e.g. safety metadata only)
+                        continue
+                    for event in parser.feed(text):
+                        if event['type'] == 'graphCommand':
+                            commands = index.validate_graph_commands([event['graphCommand']])
+                            if not commands:
+                                continue
+                            event = dict(event, graphCommand=commands[0])
+                            # Streamed commands go out as soon as they close, so they are applied but not compacted
+                            graph.apply(commands)
+                            commands_sent.append(commands[0])
+                        await stream.line(event)
+            except UpstreamBusy as busy:
+                outcome = 'shed'
+                body, retry_after = index.busy_body(busy)
+                # Nothing has been sent yet unless the stream was cut off after it started
+                if not stream.started:
+                    return await send_json(send, body, 503, 'chat_stream', [(b'retry-after', str(retry_after).encode())])
+                await stream.line({'type': 'error', 'error': body['chatResponse'], 'retryAfter': retry_after})
+                return await stream.close()
+            except Exception as api_error:
+                print(f"ERROR streaming from Gemini API: {api_error!r}")
+                outcome = 'model_error'
+                await stream.line({
+                    'type': 'error',
+                    'error': f"Sorry, there was an error communicating with the AI: {str(api_error) or 'timed out'}"
+                })
+                return await stream.close()
+            finally:
+                # A timed-out or disconnected reader stops here; the last reader closes the model stream
+                if response is not None:
+                    await response.aclose()
+
+            response_text = parser.buffer.strip()
+            if response_text:
+                conversation.commit(turn, response_text)
+
+        index.MODEL_TOKENS.inc(estimate_tokens(response_text), direction='output')
+        outcome = 'model'
+        if not response_text:
+            print("ERROR: AI returned empty response!")
+            outcome = 'empty'
+            await stream.line({
+                'type': 'chatResponse',
+                'chatResponse': "I apologize, but I didn't generate a proper response. Please try rephrasing your question."
+            })
+        elif parser.chat_response is None:
+            # The stream never produced a well-formed chatResponse - fall back to the full parser
+            with index.stage('parse'):
+                chat_response, graph_commands, _ = index.parse_ai_response(response_text)
+            outcome = 'unparsed'
+            await stream.line({'type': 'chatResponse', 'chatResponse': chat_response})
+            if not commands_sent:
+                graph_commands = index.validate_graph_commands(graph_commands)
+                graph_commands = index.apply_graph_commands(graph, {'graphCommands': graph_commands})['graphCommands']
+                for command in graph_commands:
+                    await stream.line({'type': 'graphCommand', 'graphCommand': command})
+        elif parser.complete and inputs['cache_key']:
+            with index.stage('cache_store'):
+                await run_blocking(blocking, index.response_cache.put, inputs['cache_key'], {
+                    'chatResponse': parser.chat_response,
+                    'graphCommands': commands_sent
+                })
+
+        await stream.line(dict({'type': 'done'}, **graph.sync_fields()))
+        await stream.close()
+
+    except Exception as e:
+        print(f"Error in chat stream endpoint: {e}")
+        traceback.print_exc()
+        if stream.started:
+            await stream.line({'type': 'error', 'error': f'An error occurred: {str(e)}'})
+            await stream.close()
+        else:
+            await send_json(send, {'chatResponse': f'An error occurred: {str(e)}', 'graphCommands': []}, 500, 'chat_stream')
+    finally:
+        index.finish_timing(timer, outcome)
+
+
+def wsgi_environ(scope, body):
+    """PEP 3333 environ for an ASGI HTTP request"""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        environ[name] = f"{environ[name]},{value}" if name in environ else value
+    return environ
+
+
+async def flask_route(scope, receive, send):
+    """Serve a request with the Flask app on the blocking pool, streaming its response body"""
+    environ = wsgi_environ(scope, await read_body(receive))
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+    body = await run_blocking(blocking, index.app, environ, start_response)
+    try:
+        await send({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+        chunks = iter(body)
+        while True:
+            chunk = await run_blocking(blocking, next, chunks, None)
+            if chunk is None:
+                break
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(body, 'close'):
+            await run_blocking(blocking, body.close)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            if index.MODEL_CONFIGURED:
+                # Import the SDK and build the model now, not on the event loop during the first chat
+                await run_blocking(blocking, index.get_chat_model)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            blocking.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+ASYNC_ROUTES = {
+    '/api/chat': chat,
+    '/api/chat/stream': chat_stream
+}
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+    route = ASYNC_ROUTES.get(scope['path'])
+    if route and scope['method'] == 'POST':
+        return await route(scope, receive, send)
+    return await flask_route(scope, receive, send)
@@ -0,0 +1,85 @@
+"""asyncio helpers for the async chat pipeline: hedged calls with a deadline, and sync code off the event loop"""
+import asyncio
+import contextvars
+import functools
+from contextlib import asynccontextmanager
+
+
+async def hedged(attempt, timeout, hedge_after=None, on_hedge=None):
+    """(result, attempt number) of the first of up to two attempts to succeed within timeout seconds.
+
+    attempt(number) returns an awaitable; attempt(0) starts right away and
+    attempt(1) once the first has taken hedge_after seconds or failed, after
+    calling on_hedge('slow' or 'error'). The attempt still running when the
+    other wins is cancelled, and a result that loses is closed (aclose()) if
+    it can be, so a stream it opened gives back its upstream slot. Raises asyncio.TimeoutError at the deadline, or
+    the last attempt's error if every attempt failed.
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    deadline = started + timeout
+    pending = {asyncio.ensure_future(attempt(0))}
+    numbers = {next(iter(pending)): 0}
+    can_hedge = hedge_after is not None
+    error = None
+    winner = None
+    try:
+        while True:
+            now = loop.time()
+            if now >= deadline:
+                raise asyncio.TimeoutError(f"no reply within {timeout:.1f} s")
+            wait = deadline - now
+            if can_hedge:
+                wait = min(wait, max(started + hedge_after - now, 0))
+            done, pending = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    winner = task
+                    return task.result(), numbers[task]
+                error = task.exception()
+            if can_hedge and (done or loop.time() >= started + hedge_after):
+                can_hedge = False
+                if on_hedge:
+                    on_hedge('error' if done else 'slow')
+                task = asyncio.ensure_future(attempt(1))
+                numbers[task] = 1
+                pending.add(task)
+            elif not pending:
+                raise error
+    finally:
+        for task in numbers:
+            if task is not winner:
+                task.cancel()
+                task.add_done_callback(discard)
+
+
+def discard(task):
+    """Close the result of an attempt nobody will read; one finishing as it is cancelled still gets here"""
+    if task.cancelled() or task.exception() is not None:
+        return
+    close = getattr(task.result(), 'aclose', None)
+    if close:
+        asyncio.ensure_future(close())
+
+
+@asynccontextmanager
+async def holding(lock):
+    """Hold a threading lock without blocking the event loop; only a contended acquire waits in a thread"""
+    if not lock.acquire(blocking=False):
+        waiter = asyncio.ensure_future(asyncio.to_thread(lock.acquire))
+        try:
+            await asyncio.shield(waiter)
+        except asyncio.CancelledError:
+            # The thread still takes the lock eventually; give it back as soon as it does
+            waiter.add_done_callback(lambda _: lock.release())
+            raise
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+async def run_blocking(executor, func, *args):
+    """Run func(*args) on executor, keeping the caller's context variables (e.g. the request's stage timer)"""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(context.run, func, *args))
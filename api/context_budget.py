@@ -0,0 +1,192 @@
+"""Token-budgeted assembly of the model input for one chat turn.
+
+Segments are filled in priority order: the system prompt and the user's
+message, then the graph state, retrieved PDF chunks and finally the stored
+conversation history. Each segment is shortened before it is dropped: long
+expressions are abbreviated and long expression lists sampled (newest
+kept, the rest named by ID), the last chunk that does not fit is cut
+rather than left out, and long history messages are shortened before the
+oldest exchanges go. The graph and document shares only cap a segment
+while later ones need the room; whatever is left over is offered back.
+"""
+import re
+
+from conversation import estimate_tokens, contents_tokens
+
+# Share of the budget the graph state and the PDF context may take before history is served
+GRAPH_SHARE = 0.35
+DOCUMENT_SHARE = 0.3
+# The user's message is shortened beyond this share of the budget
+MESSAGE_SHARE = 0.25
+
+# Graph lines longer than this are abbreviated once the full list does not fit
+ITEM_MAX_CHARS = 160
+# A chunk is cut to the room that is left only if at least this many tokens remain
+MIN_CHUNK_TOKENS = 60
+# History messages are shortened to this before the oldest exchanges are dropped
+HISTORY_MESSAGE_TOKENS = 400
+# Trimmed history is cut to this fraction of its allowance, so the next turns can append to
+# an unchanged prefix for a while instead of trimming (and changing it) on every turn
+HISTORY_TRIM_TARGET = 0.5
+
+GRAPH_ITEM = re.compile(r"^- ID: '([^']*)'")
+DOCUMENT_HEADER = "Context from uploaded PDF:\n\n"
+ELLIPSIS = ' … '
+
+
+def shorten(text, max_tokens):
+    """text cut to about max_tokens, keeping its start and end; '' if there is no room for either"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    keep = max_tokens * 4 - len(ELLIPSIS)
+    if keep < 20:
+        return ''
+    head = keep * 2 // 3
+    return text[:head] + ELLIPSIS + text[len(text) - (keep - head):]
+
+
+def graph_levels(text):
+    """(level, text) renderings of a graph description, from full to smallest"""
+    yield 'full', text
+    lines = text.split('\n')
+    items = [i for i, line in enumerate(lines) if GRAPH_ITEM.match(line)]
+    if not items:
+        return
+    item_set = set(items)
+    lines = [line[:ITEM_MAX_CHARS] + '…' if i in item_set and len(line) > ITEM_MAX_CHARS + 1 else line
+             for i, line in enumerate(lines)]
+    yield 'abbreviated', '\n'.join(lines)
+
+    def sample(keep, name_ids):
+        # The newest expressions (end of the list) are the likeliest targets of a follow-up
+        omitted = set(items[:len(items) - keep])
+        kept = [line for i, line in enumerate(lines) if i not in omitted]
+        ids = ', '.join(GRAPH_ITEM.match(lines[i]).group(1) for i in sorted(omitted))
+        note = (f"({len(omitted)} more expressions not listed to save space; their IDs: {ids})" if name_ids
+                else f"({len(omitted)} more expressions not listed to save space)")
+        return '\n'.join(kept + [note])
+
+    keep = len(items) // 2
+    while keep:
+        yield 'sampled', sample(keep, True)
+        keep //= 2
+    yield 'ids', sample(0, True)
+    yield 'summarized', sample(0, False)
+
+
+def fit_graph(text, allowance):
+    """(text, level) of the fullest graph rendering within allowance; the smallest one if none fits"""
+    for level, rendered in graph_levels(text):
+        if estimate_tokens(rendered) <= allowance:
+            return rendered, level
+    return rendered, level
+
+
+def fit_documents(chunks, allowance):
+    """(text, chunks sent, chunks shortened) of the best-ranked chunks that fit in allowance"""
+    room = allowance - estimate_tokens(DOCUMENT_HEADER)
+    sent = []
+    shortened = 0
+    for chunk in chunks:
+        cost = estimate_tokens(chunk) + 1
+        if cost <= room:
+            sent.append(chunk)
+            room -= cost
+            continue
+        if room >= MIN_CHUNK_TOKENS:
+            sent.append(shorten(chunk, room - 1))
+            shortened = 1
+        break
+    return (DOCUMENT_HEADER + '\n\n'.join(sent) if sent else ''), len(sent), shortened
+
+
+def fit_history(turns, allowance):
+    """(turns, shortened messages) fitting allowance: turns itself if it fits, else a trimmed copy.
+
+    Long messages are shortened first; then the oldest exchanges are dropped
+    until the history is within HISTORY_TRIM_TARGET of the allowance.
+    """
+    if contents_tokens(turns) <= allowance:
+        return turns, 0
+    shortened = 0
+    trimmed = []
+    for content in turns:
+        parts = [shorten(part, HISTORY_MESSAGE_TOKENS) for part in content['parts']]
+        shortened += parts != content['parts']
+        trimmed.append(dict(content, parts=parts))
+    target = allowance if contents_tokens(trimmed) <= allowance else allowance * HISTORY_TRIM_TARGET
+    # Drop whole exchanges (user message and reply) so the history still alternates roles
+    while trimmed and contents_tokens(trimmed) > target:
+        trimmed = trimmed[2:]
+    return trimmed, shortened
+
+
+def reduction(shortened, dropped):
+    """Level of a list segment: 'dropped' if items were left out, else 'shortened' or 'full'"""
+    return 'dropped' if dropped else 'shortened' if shortened else 'full'
+
+
+class AssembledContext:
+    """The segments chosen for one turn and how the token budget was spent on them"""
+
+    def __init__(self, message, graph_text, document_text, turns, report):
+        self.message = message
+        self.graph_text = graph_text
+        self.document_text = document_text
+        self.turns = turns
+        self.report = report
+
+
+class ContextBudget:
+    """Fills a per-turn token budget with the prompt segments by priority"""
+
+    def __init__(self, total_tokens, graph_share=GRAPH_SHARE, document_share=DOCUMENT_SHARE,
+                 message_share=MESSAGE_SHARE):
+        self.total_tokens = total_tokens
+        self.graph_share = graph_share
+        self.document_share = document_share
+        self.message_share = message_share
+
+    def assemble(self, fixed_tokens, user_message, graph_text, chunks, turns):
+        """Choose what to send this turn; fixed_tokens covers the system prompt, sent whole"""
+        total = self.total_tokens
+        message = shorten(user_message, int(total * self.message_share))
+        remaining = total - fixed_tokens - estimate_tokens(message)
+
+        graph, graph_level = fit_graph(graph_text, min(remaining, int(total * self.graph_share)))
+        remaining -= estimate_tokens(graph)
+        documents, sent, cut = fit_documents(chunks, min(remaining, int(total * self.document_share)))
+        remaining -= estimate_tokens(documents)
+        history, shortened = fit_history(turns, max(remaining, 0))
+        remaining -= contents_tokens(history)
+
+        # Shares only hold back the graph and documents while history needs the room
+        if remaining > 0 and graph_level != 'full':
+            remaining += estimate_tokens(graph)
+            graph, graph_level = fit_graph(graph_text, remaining)
+            remaining -= estimate_tokens(graph)
+        if remaining > 0 and (sent < len(chunks) or cut):
+            remaining += estimate_tokens(documents)
+            documents, sent, cut = fit_documents(chunks, remaining)
+            remaining -= estimate_tokens(documents)
+
+        report = {
+            'budgetTokens': total,
+            'usedTokens': total - remaining,
+            'segments': {
+                'system': {'tokens': fixed_tokens},
+                'message': {'tokens': estimate_tokens(message), 'fullTokens': estimate_tokens(user_message),
+                            'level': 'full' if message == user_message else 'shortened'},
+                'graph': {'tokens': estimate_tokens(graph), 'fullTokens': estimate_tokens(graph_text),
+                          'level': graph_level},
+                'documents': {'tokens': estimate_tokens(documents),
+                              'fullTokens': estimate_tokens(DOCUMENT_HEADER + '\n\n'.join(chunks)) if chunks else 0,
+                              'level': reduction(cut, len(chunks) - sent),
+                              'chunks': sent, 'shortenedChunks': cut, 'droppedChunks': len(chunks) - sent},
+                'history': {'tokens': contents_tokens(history), 'fullTokens': contents_tokens(turns),
+                            'level': reduction(shortened, len(turns) - len(history)),
+                            'messages': len(history), 'shortenedMessages': shortened,
+                            'droppedMessages': len(turns) - len(history)}
+            }
+        }
+        return AssembledContext(message, graph, documents, history, report)
@@ -0,0 +1,216 @@
+"""Server-side per-session conversation state with graph-state deltas"""
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token) for reporting, without an API call"""
+    return (len(text) + 3) // 4
+
+
+def contents_tokens(contents):
+    return sum(estimate_tokens(part) for content in contents for part in content['parts'])
+
+
+SUMMARY_HEADER = "SUMMARY of our conversation before the messages that follow:\n"
+SUMMARY_ACK = 'Understood. I will keep this earlier conversation in mind.'
+
+
+def graph_snapshot(current_expressions):
+    return {str(expr.get('id')): expr.get('latex', '') for expr in current_expressions}
+
+
+def describe_graph_diff(previous, current):
+    """Describe how the graph changed since the model last saw it, or '' if it did not"""
+    added = [f"- ID: '{expr_id}', Expression: {latex}" for expr_id, latex in current.items() if expr_id not in previous]
+    changed = [
+        f"- ID: '{expr_id}', Expression: {latex} (was {previous[expr_id]})"
+        for expr_id, latex in current.items() if expr_id in previous and previous[expr_id] != latex
+    ]
+    removed = [f"- ID: '{expr_id}'" for expr_id in previous if expr_id not in current]
+    if not (added or changed or removed):
+        return ''
+
+    lines = ["GRAPH UPDATE since my last message:"]
+    if added:
+        lines += ["Added:"] + added
+    if changed:
+        lines += ["Changed:"] + changed
+    if removed:
+        lines += ["Removed:"] + removed
+    if not current:
+        lines.append("The graph is now empty.")
+    return "\n".join(lines)
+
+
+class PreparedTurn:
+    """What to send to the model for one turn, and what to keep in history afterwards"""
+
+    def __init__(self, history, message, stored_message, snapshot, context=None, trimmed=None):
+        self.history = history
+        self.message = message
+        self.stored_message = stored_message
+        self.snapshot = snapshot
+        self.context = context  # how the token budget was spent, if there is one
+        # (stored history, its length, trimmed copy) when the budget cut the history; commit() keeps the copy
+        self.trimmed = trimmed
+
+
+class Conversation:
+    """Append-only chat history for one session.
+
+    The history only grows between compactions, so consecutive requests share
+    a long identical prefix that the model service can reuse, and each turn
+    adds just the new message plus a diff of the graph since the last turn.
+    With a summarizer, messages older than the last keep_messages are folded
+    into a rolling summary sent ahead of the history instead of being dropped.
+    """
+
+    def __init__(self, preamble, seed_turns=None, max_messages=24, keep_messages=6, budget=None, system_tokens=0,
+                 summarizer=None, replies=0):
+        self.preamble = preamble
+        self.turns = list(seed_turns or [])
+        # Replies the client has seen in this conversation, counting the ones before it was seeded;
+        # a client reporting a different count was answered by another worker meanwhile
+        self.replies = replies
+        self.max_messages = max_messages
+        self.keep_messages = keep_messages
+        # Optional ContextBudget; system_tokens is the system instruction sent outside the history
+        self.budget = budget
+        self.system_tokens = system_tokens
+        # Optional RollingSummarizer, and the summary of the messages it has folded so far
+        self.summarizer = summarizer
+        self.summary = ''
+        self.summarized_messages = 0
+        self.summarizing = False
+        self.graph = None  # graph the model last saw; None means send the full state
+        self.lock = threading.Lock()
+        self.last_access = time.time()
+        self.turn_stats = deque(maxlen=50)
+
+    def prepare(self, user_message, current_expressions, full_graph_text, rag_chunks=()):
+        """Build the history and message for a new turn, within the token budget if there is one.
+
+        Leaves the conversation unchanged, so a turn whose model call fails costs no history.
+        """
+        snapshot = graph_snapshot(current_expressions)
+        graph_text = full_graph_text if self.graph is None else describe_graph_diff(self.graph, snapshot)
+        rag_chunks = list(rag_chunks)
+        document_text = "Context from uploaded PDF:\n\n" + "\n\n".join(rag_chunks) if rag_chunks else ''
+        turns, report, trimmed = self.turns, None, None
+
+        preamble = self.preamble + self.summary_contents()
+        if self.budget:
+            fixed_tokens = self.system_tokens + contents_tokens(preamble)
+            context = self.budget.assemble(fixed_tokens, user_message, graph_text, rag_chunks, self.turns)
+            if context.turns is not self.turns:
+                if self.graph is not None:
+                    # The dropped messages may hold the graph state the diff builds on, so restate it in full
+                    context = self.budget.assemble(fixed_tokens, user_message, full_graph_text, rag_chunks, self.turns)
+                turns = context.turns
+                trimmed = (self.turns, len(self.turns), turns)
+            user_message, graph_text, document_text = context.message, context.graph_text, context.document_text
+            report = context.report
+
+        stored_message = "\n\n".join(part for part in (graph_text, user_message) if part)
+        # Retrieved PDF context is only relevant to this turn, so it is never stored in history
+        message = "\n\n".join(part for part in (graph_text, document_text, user_message) if part)
+        return PreparedTurn(preamble + turns, message, stored_message, snapshot, report, trimmed)
+
+    def commit(self, turn, model_reply):
+        """Append a completed turn to the history"""
+        if turn.trimmed:
+            stored, length, turns = turn.trimmed
+            # Kept trimmed, so the next turns append to this history instead of trimming it again;
+            # unless a fold changed the history since prepare(), and the next turn trims what is left
+            if self.turns is stored and len(stored) == length:
+                self.turns = list(turns)
+        self.turns.append({'role': 'user', 'parts': [turn.stored_message]})
+        self.turns.append({'role': 'model', 'parts': [model_reply]})
+        self.graph = turn.snapshot
+        self.replies += 1
+        self.last_access = time.time()
+
+        # Compact rarely and in one step, so most turns keep the previous prefix intact; a pending
+        # fold will shorten the history anyway, and dropping messages now would discard its work
+        if len(self.turns) > self.max_messages and not self.summarizing:
+            self.turns = self.turns[-self.keep_messages:]
+            self.graph = None
+        if self.summarizer:
+            self.summarizer.schedule(self)
+
+    def summary_contents(self):
+        """The rolling summary as an exchange to send ahead of the stored history, if there is one"""
+        if not self.summary:
+            return []
+        return [{'role': 'user', 'parts': [SUMMARY_HEADER + self.summary]}, {'role': 'model', 'parts': [SUMMARY_ACK]}]
+
+    def take_fold(self, batch_messages):
+        """(summary so far, messages to fold into it) once batch_messages have built up past the recent window"""
+        count = len(self.turns) - self.keep_messages
+        # The kept history must still open with a user message
+        while count > 0 and self.turns[count]['role'] != 'user':
+            count -= 1
+        if self.summarizing or count < batch_messages:
+            return None
+        # One fold at a time; the summarizer clears this when it is done
+        self.summarizing = True
+        return self.summary, self.turns[:count]
+
+    def apply_summary(self, folded, summary):
+        """Replace the folded messages with the new summary; False if the history changed meanwhile"""
+        if len(self.turns) < len(folded) or any(kept is not old for kept, old in zip(self.turns, folded)):
+            return False
+        self.turns = self.turns[len(folded):]
+        self.summary = summary
+        self.summarized_messages += len(folded)
+        # The folded messages held the graph state the next diff would build on, so restate it in full
+        self.graph = None
+        return True
+
+    def record_stats(self, turn, rebuild_tokens):
+        """Record estimated input tokens for a turn against the old rebuild-every-turn context"""
+        # The system instruction is sent on every turn, as it is in the rebuilt context
+        sent = self.system_tokens + contents_tokens(turn.history) + estimate_tokens(turn.message)
+        stats = {
+            'turn': len(self.turn_stats) + 1,
+            'sentTokens': sent,
+            'newTokens': estimate_tokens(turn.message),
+            'rebuildTokens': rebuild_tokens,
+            'savedTokens': rebuild_tokens - sent
+        }
+        if turn.context:
+            stats['context'] = turn.context
+        self.turn_stats.append(stats)
+        return stats
+
+
+class ConversationStore:
+    """LRU + TTL map of session ID to Conversation"""
+
+    def __init__(self, max_sessions=1000, ttl=3600):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._conversations = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_create(self, session_id, factory, stale=None):
+        """The session's conversation, replaced by factory() if it expired or stale(conversation) is true"""
+        now = time.time()
+        with self._lock:
+            conversation = self._conversations.get(session_id)
+            if conversation is not None and (now - conversation.last_access > self.ttl or (stale and stale(conversation))):
+                conversation = None
+            if conversation is None:
+                conversation = factory()
+                self._conversations[session_id] = conversation
+            conversation.last_access = now
+            self._conversations.move_to_end(session_id)
+            while len(self._conversations) > self.max_sessions:
+                self._conversations.popitem(last=False)
+            return conversation
+
+    def get(self, session_id):
+        with self._lock:
+            return self._conversations.get(session_id)
@@ -0,0 +1,103 @@
+"""Rolling per-session conversation summaries, written off the request path.
+
+A Conversation keeps a small window of recent messages verbatim. Once the
+history has grown a batch of messages past that window, RollingSummarizer
+folds everything older into the session's summary on a background thread:
+one model call turns the previous summary plus the folded messages into a
+new summary, and later turns send it in place of those messages. Folding a
+batch at a time keeps the stored history an unchanged prefix between
+folds, and the summary is capped, so the prompt stays about the same size
+however long the session runs.
+"""
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from conversation import estimate_tokens
+from context_budget import shorten
+from response_parser import extract_json
+
+SUMMARY_PROMPT = """You keep a running summary of a tutoring conversation between a student and Axiom Canvas, a math assistant that explains concepts and plots them on a Desmos graph.
+
+You are given the summary so far and the next part of the conversation. Reply with the updated summary only, as plain text (no JSON, no code fences), in at most {max_words} words.
+
+Keep what the student will refer back to: what they are studying and why, definitions, results and values worked out, where they struggled, and which expressions are on the graph (with their IDs and latex). Drop greetings, repetition and explanations that are finished."""
+
+# Each folded message is cut to this before it goes to the summarizer
+MESSAGE_TOKENS = 400
+
+
+def reply_text(text):
+    """A stored model reply as its chatResponse plus the expressions it plotted"""
+    parsed, _ = extract_json(text)
+    if not isinstance(parsed, dict):
+        return text
+    plotted = [
+        f"{params.get('id')}: {params.get('latex')}"
+        for command in parsed.get('graphCommands') or [] if isinstance(command, dict)
+        for params in [command.get('params') or {}] if params.get('latex')
+    ]
+    answer = str(parsed.get('chatResponse', ''))
+    return f"{answer} [plotted {'; '.join(plotted)}]" if plotted else answer
+
+
+def summary_request(previous_summary, messages):
+    """The message asking the summarizer to fold messages into previous_summary"""
+    lines = []
+    for content in messages:
+        text = '\n'.join(content['parts'])
+        if content['role'] == 'user':
+            lines.append(f"Student: {shorten(text, MESSAGE_TOKENS)}")
+        else:
+            lines.append(f"Tutor: {shorten(reply_text(text), MESSAGE_TOKENS)}")
+    return (f"SUMMARY SO FAR:\n{previous_summary or '(none yet)'}\n\n"
+            f"NEXT PART OF THE CONVERSATION:\n" + '\n'.join(lines))
+
+
+class RollingSummarizer:
+    """Folds the old messages of conversations into their summaries on a background thread pool"""
+
+    def __init__(self, summarize, batch_messages=6, max_tokens=300, max_workers=2, counter=None):
+        # summarize(previous summary, messages) -> new summary text; called on a worker thread
+        self.summarize = summarize
+        self.batch_messages = batch_messages
+        self.max_tokens = max_tokens
+        # Counter with a result label: 'folded', 'stale' (history changed meanwhile) or 'error'
+        self.counter = counter
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='summarize')
+
+    @property
+    def prompt(self):
+        # Words run about 1.3 tokens each
+        return SUMMARY_PROMPT.format(max_words=int(self.max_tokens / 1.3))
+
+    def schedule(self, conversation):
+        """Queue a fold if one is due; called after each turn with the conversation's lock held"""
+        fold = conversation.take_fold(self.batch_messages)
+        if fold:
+            self._executor.submit(self._fold, conversation, *fold)
+
+    def _fold(self, conversation, previous_summary, messages):
+        started = time.perf_counter()
+        summary = None
+        try:
+            summary = shorten(self.summarize(previous_summary, messages).strip(), self.max_tokens) or None
+            if summary is None:
+                print("Conversation summary failed: the summarizer returned nothing")
+        except Exception as e:
+            print(f"Conversation summary failed: {e}")
+
+        with conversation.lock:
+            conversation.summarizing = False
+            folded = summary is not None and conversation.apply_summary(messages, summary)
+        result = 'folded' if folded else 'error' if summary is None else 'stale'
+        if self.counter:
+            self.counter.inc(result=result)
+        record = {
+            'result': result,
+            'foldedMessages': len(messages),
+            'foldedTokens': sum(estimate_tokens(part) for content in messages for part in content['parts']),
+            'summaryTokens': estimate_tokens(summary or ''),
+            'ms': round((time.perf_counter() - started) * 1000, 1)
+        }
+        print(f"conversation_summary {json.dumps(record)}")
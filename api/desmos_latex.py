@@ -0,0 +1,242 @@
+"""Server-side check and repair of the latex in graphCommands against the Desmos rules in SYSTEM_PROMPT.
+
+The prompt tells the model not to use arrows, \\vec, named points or bare
+expressions, but nothing enforced it: a bad command reached
+calculator.setExpression in the browser, showed an error there, and the
+user asked again at the cost of another model round trip. LatexValidator
+applies each rule in order with precompiled patterns and rewrites the
+common violations deterministically:
+
+    A=(2,3)                      -> (2,3)
+    x^2                          -> y=x^2
+    f(x)=x^2                     -> y=x^2
+    A \\to (2,3)                  -> (2,3)
+    \\vec{A}=2\\vec{i}+3\\vec{j}     -> (2,3)
+    $y=x^2$, y ≤ 2x              -> y=x^2, y \\le 2x
+
+Latex with unbalanced brackets cannot be repaired and its command is
+dropped. Results are cached per latex string, since the same expressions
+come back turn after turn, and every rule's hits are counted so the rates
+show which ones the prompt fails to prevent.
+"""
+import re
+import threading
+from collections import OrderedDict
+
+RULES = ('delimiters', 'unicode', 'arrow', 'vector', 'named_point', 'function_notation', 'bare_expression', 'unbalanced')
+
+MATH_DELIMITERS = re.compile(r'^\s*(?:\$\$?(?P<dollar>.*?)\$\$?|\\\((?P<paren>.*?)\\\)|\\\[(?P<bracket>.*?)\\\])\s*$', re.DOTALL)
+UNICODE_SYMBOLS = {
+    '≤': '\\le', '≥': '\\ge', '≠': '\\ne', '−': '-', '×': '\\cdot', '·': '\\cdot', '÷': '/',
+    'π': '\\pi', 'θ': '\\theta', '²': '^2', '³': '^3', '∞': '\\infty'
+}
+# The lookahead catches a following letter, which must not run into a command name ("πx" -> "\pi x")
+UNICODE_PATTERN = re.compile('(' + '|'.join(map(re.escape, UNICODE_SYMBOLS)) + ')(?=([A-Za-z])?)')
+ARROW = re.compile(r'->|→|\\(?:to|rightarrow|Rightarrow|longrightarrow|mapsto)(?![a-zA-Z])')
+UNIT_VECTOR = r'\\(?:vec|hat|mathbf)\{{?\s*{}\s*\}}?'
+# 2\vec{i}+3\vec{j}, optionally named (\vec{A}=...); unit vectors may also be \hat or \mathbf
+COMPONENT_VECTOR = re.compile(
+    r'^(?:\\vec\{\w+\}\s*=\s*)?(?P<a>[+-]?\s*[\d.]*)\s*' + UNIT_VECTOR.format('i') +
+    r'\s*(?P<sign>[+-])\s*(?P<b>[\d.]*)\s*' + UNIT_VECTOR.format('j') + r'$'
+)
+VECTOR_MARKUP = re.compile(r'\\(?:vec|overrightarrow|overline|mathbf)\{([^{}]*)\}')
+NAMED = r'[A-Za-z](?:_\{?\w+\}?)?'
+NAMED_ASSIGNMENT = re.compile(rf'^\s*{NAMED}\s*=\s*(?P<value>.+)$', re.DOTALL)
+FUNCTION_NOTATION = re.compile(rf'^\s*{NAMED}\s*\(\s*(?P<var>[xy])\s*\)\s*=\s*(?P<body>.+)$', re.DOTALL)
+RELATION = re.compile(r'=|<|>|~|\\(?:le|ge|leq|geq|lt|gt|ne|sim)(?![a-zA-Z])')
+LATEX_COMMAND = re.compile(r'\\[a-zA-Z]+')
+RESTRICTION = re.compile(r'^\s*(?:\\left\\\{.*\\right\\\}|\\\{.*\\\})\s*$', re.DOTALL)
+OPENERS = {'(': ')', '[': ']', '{': '}'}
+CLOSERS = {')', ']', '}'}
+
+
+def top_level(latex):
+    """latex with everything inside brackets blanked out, or None if the brackets do not balance"""
+    depth = 0
+    kept = []
+    for char in latex:
+        if char in OPENERS:
+            depth += 1
+        elif char in CLOSERS:
+            depth -= 1
+            if depth < 0:
+                return None
+        kept.append(char if depth == 0 and char not in CLOSERS else ' ')
+    return ''.join(kept) if depth == 0 else None
+
+
+def is_point(latex):
+    """(a, b) or (f(t), g(t)), optionally followed by a restriction like \\left\\{0\\le t\\le1\\right\\}"""
+    latex = latex.strip()
+    if not latex.startswith('('):
+        return False
+    depth = 0
+    for end, char in enumerate(latex):
+        depth += char in OPENERS
+        depth -= char in CLOSERS
+        if depth == 0:
+            break
+    inner = top_level(latex[1:end])
+    rest = latex[end + 1:]
+    return inner is not None and ',' in inner and (not rest.strip() or bool(RESTRICTION.match(rest)))
+
+
+def variables(latex):
+    """The plot variables (x and y) an expression uses, ignoring letters inside commands like \\exp"""
+    names = LATEX_COMMAND.sub(' ', latex)
+    return {name for name in ('x', 'y') if name in names}
+
+
+def check_latex(latex):
+    """Return (repaired latex or None to drop the command, rules the original broke)"""
+    hits = []
+
+    match = MATH_DELIMITERS.match(latex)
+    if match:
+        hits.append('delimiters')
+        latex = next(group for group in match.groups() if group is not None)
+
+    if UNICODE_PATTERN.search(latex):
+        hits.append('unicode')
+        latex = UNICODE_PATTERN.sub(lambda m: UNICODE_SYMBOLS[m.group(1)] + (' ' if m.group(2) else ''), latex)
+
+    if ARROW.search(latex):
+        hits.append('arrow')
+        # "A \to (2,3)": what the arrow points at is what should be plotted
+        latex = ARROW.split(latex)[-1]
+
+    if '\\vec' in latex or '\\hat{i}' in latex or '\\overrightarrow' in latex:
+        hits.append('vector')
+        match = COMPONENT_VECTOR.match(latex.strip())
+        if match:
+            a = match.group('a').replace(' ', '')
+            a = a + '1' if a in ('', '+', '-') else a
+            b = match.group('b') or '1'
+            latex = f"({a.lstrip('+')},{'-' if match.group('sign') == '-' else ''}{b})"
+        else:
+            latex = VECTOR_MARKUP.sub(r'\1', latex)
+
+    match = NAMED_ASSIGNMENT.match(latex)
+    if match and is_point(match.group('value')):
+        hits.append('named_point')
+        latex = match.group('value')
+
+    match = FUNCTION_NOTATION.match(latex)
+    if match:
+        hits.append('function_notation')
+        latex = f"{'x' if match.group('var') == 'y' else 'y'}={match.group('body')}"
+
+    latex = latex.strip()
+    outer = top_level(latex)
+    if outer is None:
+        hits.append('unbalanced')
+        return None, hits
+
+    if latex and not RELATION.search(outer) and not is_point(latex) and not latex.startswith('['):
+        used = variables(latex)
+        if used:
+            hits.append('bare_expression')
+            if used == {'x'}:
+                latex = f"y={latex}"
+            elif used == {'y'}:
+                latex = f"x={latex}"
+            else:
+                # x^2+y^2-25 means the curve where it is zero
+                latex = f"{latex}=0"
+
+    return latex, hits
+
+
+class LatexValidator:
+    """Checks and repairs graphCommands latex, with an LRU of results and per-rule hit counts"""
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self.checked = 0
+        self.repaired = 0
+        self.dropped = 0
+        self.cache_hits = 0
+        self.rule_hits = dict.fromkeys(RULES, 0)
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, latex):
+        """(latex to send or None to drop the command, rules broken), cached per latex string"""
+        with self._lock:
+            result = self._results.get(latex)
+            if result is not None:
+                self._results.move_to_end(latex)
+                self.cache_hits += 1
+        if result is None:
+            result = check_latex(latex)
+            with self._lock:
+                self._results[latex] = result
+                while len(self._results) > self.max_entries:
+                    self._results.popitem(last=False)
+        repaired, hits = result
+        with self._lock:
+            self.checked += 1
+            for rule in hits:
+                self.rule_hits[rule] += 1
+            if repaired is None:
+                self.dropped += 1
+            elif hits:
+                self.repaired += 1
+        return result
+
+    def repair_commands(self, commands):
+        """Return (commands to send, report); commands are copied only when something changed.
+
+        The report counts the expressions checked, repaired and dropped, and
+        the hits of each rule broken.
+        """
+        report = {'checked': 0, 'repaired': 0, 'dropped': 0, 'rules': {}}
+        repaired = []
+        for command in commands:
+            params = command.get('params') or {}
+            if command.get('command') == 'setExpression' and isinstance(params.get('latex'), str):
+                expression = self._repair_expression(params, report)
+                if expression is None:
+                    continue
+                if expression is not params:
+                    command = dict(command, params=expression)
+            elif command.get('command') == 'setExpressions' and isinstance(params.get('expressions'), list):
+                expressions = [
+                    self._repair_expression(expression, report) if isinstance(expression, dict) else expression
+                    for expression in params['expressions']
+                ]
+                expressions = [expression for expression in expressions if expression is not None]
+                if expressions != params['expressions']:
+                    command = dict(command, params=dict(params, expressions=expressions))
+            repaired.append(command)
+        return repaired, report
+
+    def _repair_expression(self, expression, report):
+        latex = expression.get('latex')
+        if not isinstance(latex, str):
+            return expression
+        fixed, broken = self.check(latex)
+        report['checked'] += 1
+        for rule in broken:
+            report['rules'][rule] = report['rules'].get(rule, 0) + 1
+        if fixed is None:
+            report['dropped'] += 1
+            return None
+        if broken:
+            report['repaired'] += 1
+        return expression if fixed == latex else dict(expression, latex=fixed)
+
+    def stats(self):
+        with self._lock:
+            checked = self.checked
+            return {
+                'checked': checked,
+                'repaired': self.repaired,
+                'dropped': self.dropped,
+                'cacheEntries': len(self._results),
+                'cacheHits': self.cache_hits,
+                'rules': {
+                    rule: {'hits': hits, 'rate': round(hits / checked, 4) if checked else 0.0}
+                    for rule, hits in self.rule_hits.items()
+                }
+            }
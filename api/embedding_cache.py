@@ -0,0 +1,264 @@
+"""Content-addressed on-disk caches for chunk embeddings and finished PDF indexes"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+
+
+def content_hash(*parts):
+    """SHA-256 hex digest over the given str/bytes parts"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        digest.update(len(part).to_bytes(8, 'little'))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class SizeBoundedDirectory:
+    """A directory of cache entries evicted least-recently-used once it exceeds max_bytes.
+
+    Each entry is a file or a sub-directory named by its key, sharded by the
+    first two hex characters. Recency is tracked with the entry's mtime so it
+    survives restarts and is shared by every worker using the same directory.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self.total_bytes = sum(self._entry_size(path) for path in self._entries())
+
+    def path_for(self, key, suffix=''):
+        return os.path.join(self.root, key[:2], key + suffix)
+
+    def touch(self, path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def added(self, path):
+        """Account for a newly written entry and evict old entries if over budget"""
+        with self._lock:
+            self.total_bytes += self._entry_size(path)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'bytes': self.total_bytes,
+                'maxBytes': self.max_bytes
+            }
+
+    def _entries(self):
+        for shard in os.scandir(self.root):
+            if shard.is_dir():
+                for entry in os.scandir(shard.path):
+                    if not entry.name.startswith('.tmp'):
+                        yield entry.path
+
+    def _entry_size(self, path):
+        if os.path.isdir(path):
+            return sum(entry.stat().st_size for entry in os.scandir(path))
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    def _mtime(self, path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return 0
+
+    def _evict(self):
+        # Drop the least recently used entries until we are back under 90% of the budget
+        entries = sorted(self._entries(), key=self._mtime)
+        target = self.max_bytes * 0.9
+        for path in entries:
+            if self.total_bytes <= target:
+                break
+            size = self._entry_size(path)
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.unlink(path)
+            except OSError:
+                continue
+            self.total_bytes -= size
+            self.evictions += 1
+
+
+class EmbeddingCache:
+    """Maps hash(model, task_type, text) to a float32 vector, stored a document at a time.
+
+    Each entry is a directory holding the document's vectors as one contiguous
+    float32 array (vectors.npy) and its chunk hashes sorted in the same row
+    order (keys.npy), both memory-mapped on read. Which entry holds a chunk is
+    kept in memory, read from the keys.npy files on first use and again when
+    a lookup misses, to pick up documents other workers stored meanwhile.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.store = SizeBoundedDirectory(root, max_bytes)
+        self._entries = {}  # entry path -> chunk hashes it holds
+        self._locations = {}  # chunk hash -> entry path
+        self._lock = threading.Lock()
+
+    def key(self, model_name, task_type, text):
+        return content_hash(model_name, task_type, text)
+
+    def get_many(self, keys):
+        """Cached vectors for keys, None where a key is not cached"""
+        with self._lock:
+            if any(key not in self._locations for key in keys):
+                self._scan()
+            by_entry = {}
+            for key in set(keys):
+                if key in self._locations:
+                    by_entry.setdefault(self._locations[key], []).append(key)
+
+        found = {}
+        for path, entry_keys in by_entry.items():
+            try:
+                vectors = np.load(os.path.join(path, 'vectors.npy'), mmap_mode='r')
+                stored = np.load(os.path.join(path, 'keys.npy'), mmap_mode='r')
+            except (OSError, ValueError):
+                # Evicted, here or by another worker
+                self._forget(path)
+                continue
+            rows = np.searchsorted(stored, [key.encode('ascii') for key in entry_keys])
+            for key, row in zip(entry_keys, rows):
+                found[key] = vectors[row]
+            self.store.touch(path)
+
+        for key in keys:
+            self.store.record(key in found)
+        return [found.get(key) for key in keys]
+
+    def get(self, key):
+        """Return the cached vector for key, or None"""
+        return self.get_many([key])[0]
+
+    def put_many(self, keys, vectors):
+        """Store one document's vectors (rows aligned with keys) as a single entry"""
+        rows = {}
+        for key, vector in zip(keys, vectors):
+            rows.setdefault(key, vector)
+        if not rows:
+            return
+        stored = sorted(rows)
+        path = self.store.path_for(content_hash(*stored))
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written to a temp directory and renamed so concurrent readers never see a partial entry
+        tmp_path = tempfile.mkdtemp(prefix='.tmp', dir=os.path.dirname(path))
+        np.save(os.path.join(tmp_path, 'vectors.npy'), np.asarray([rows[key] for key in stored], dtype='float32'))
+        np.save(os.path.join(tmp_path, 'keys.npy'), np.array([key.encode('ascii') for key in stored], dtype='S64'))
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Another worker stored the same document first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return
+        self.store.added(path)
+        with self._lock:
+            self._remember(path, stored)
+
+    def stats(self):
+        return self.store.stats()
+
+    def _scan(self):
+        # Lists entry directories only; a new entry's keys are read once
+        for shard in os.scandir(self.store.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.startswith('.tmp') or not entry.is_dir() or entry.path in self._entries:
+                    continue
+                try:
+                    stored = np.load(os.path.join(entry.path, 'keys.npy'))
+                except (OSError, ValueError):
+                    continue
+                self._remember(entry.path, [key.decode('ascii') for key in stored])
+
+    def _remember(self, path, keys):
+        self._entries[path] = keys
+        for key in keys:
+            self._locations[key] = path
+
+    def _forget(self, path):
+        with self._lock:
+            for key in self._entries.pop(path, ()):
+                if self._locations.get(key) == path:
+                    del self._locations[key]
+
+
+class DocumentCache:
+    """Maps a PDF content hash to its finished FAISS index and chunk list"""
+
+    def __init__(self, root, max_bytes):
+        self.store = SizeBoundedDirectory(root, max_bytes)
+
+    def get(self, key):
+        """Return (index, chunks) for a previously processed document, or None"""
+        import faiss
+
+        path = self.store.path_for(key)
+        try:
+            index = faiss.read_index(os.path.join(path, 'index.faiss'), faiss.IO_FLAG_MMAP)
+            with open(os.path.join(path, 'chunks.json'), encoding='utf-8') as f:
+                chunks = json.load(f)
+        except (OSError, RuntimeError, ValueError):
+            self.store.record(False)
+            return None
+        self.store.touch(path)
+        self.store.record(True)
+        return index, chunks
+
+    def put(self, key, index, chunks):
+        import faiss
+
+        path = self.store.path_for(key)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = tempfile.mkdtemp(prefix='.tmp', dir=os.path.dirname(path))
+        faiss.write_index(index, os.path.join(tmp_path, 'index.faiss'))
+        with open(os.path.join(tmp_path, 'chunks.json'), 'w', encoding='utf-8') as f:
+            json.dump(chunks, f)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Another worker stored the same document first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return
+        self.store.added(path)
+
+    def stats(self):
+        return self.store.stats()
@@ -0,0 +1,83 @@
+"""Batched, concurrent embedding of text chunks with retry and backoff"""
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from upstream_scheduler import UpstreamBusy, is_quota_error
+
+
+def is_final(error):
+    """Errors not worth retrying here: refusals and quota errors, which the upstream scheduler already backed off on"""
+    return isinstance(error, UpstreamBusy) or is_quota_error(error)
+
+
+def call_with_retry(fn, *args, max_retries=3, base_delay=0.5, max_delay=8.0):
+    """Call fn(*args), retrying with jittered exponential backoff; re-raises the last error"""
+    for attempt in range(max_retries + 1):
+        try:
+            return fn(*args)
+        except Exception as e:
+            if attempt == max_retries or is_final(e):
+                raise
+            delay = min(max_delay, base_delay * (2 ** attempt))
+            time.sleep(delay * random.uniform(0.5, 1.0))
+
+
+def _embed_batch(embed_batch_fn, batch, max_retries, base_delay):
+    """Embed one batch; on persistent failure fall back to one chunk at a time.
+
+    Returns a list with one vector per chunk, or None where the chunk failed.
+    """
+    try:
+        vectors = call_with_retry(embed_batch_fn, batch, max_retries=max_retries, base_delay=base_delay)
+        if len(vectors) != len(batch):
+            raise ValueError(f"Expected {len(batch)} embeddings, got {len(vectors)}")
+        return list(vectors)
+    except Exception as e:
+        print(f"Error generating embeddings for batch of {len(batch)}: {e}")
+        # One call per chunk would only spend more of a quota that is already used up
+        if is_final(e):
+            return [None] * len(batch)
+
+    # Salvage what we can so a single bad chunk doesn't cost the whole batch
+    vectors = []
+    for chunk in batch:
+        try:
+            vectors.append(embed_batch_fn([chunk])[0])
+        except Exception as e:
+            print(f"Error generating embedding: {e}")
+            vectors.append(None)
+            if is_final(e):
+                break
+    return vectors + [None] * (len(batch) - len(vectors))
+
+
+def embed_in_batches(text_chunks, embed_batch_fn, batch_size=100, max_workers=4,
+                     max_retries=3, base_delay=0.5):
+    """Embed text chunks in batches with a bounded number of batches in flight.
+
+    embed_batch_fn takes a list of strings and returns a list of vectors in the
+    same order. Chunks whose embedding fails are dropped, and the returned
+    valid_chunks list stays aligned with the returned embeddings.
+    """
+    batches = [text_chunks[i:i + batch_size] for i in range(0, len(text_chunks), batch_size)]
+    if not batches:
+        return [], []
+
+    workers = max(1, min(max_workers, len(batches)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # map() preserves batch order, and the pool size bounds in-flight requests
+        results = executor.map(
+            lambda batch: _embed_batch(embed_batch_fn, batch, max_retries, base_delay),
+            batches
+        )
+
+        embeddings = []
+        valid_chunks = []
+        for batch, vectors in zip(batches, results):
+            for chunk, vector in zip(batch, vectors):
+                if vector is not None:
+                    embeddings.append(vector)
+                    valid_chunks.append(chunk)
+
+    return embeddings, valid_chunks
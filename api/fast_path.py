@@ -0,0 +1,307 @@
+"""Deterministic local handling of simple graph requests ("plot y=2x+1", "clear the graph").
+
+parse_local_command() returns a complete {'chatResponse', 'graphCommands'}
+response when the whole message matches one of the supported patterns, and
+None whenever it is not confident, so the caller can fall through to Gemini.
+"""
+import re
+
+NUMBER = r'-?\d+(?:\.\d+)?'
+
+COLORS = {
+    'blue': '#2563eb',
+    'red': '#dc2626',
+    'green': '#16a34a',
+    'purple': '#9333ea',
+    'orange': '#ea580c',
+    'black': '#000000',
+    'pink': '#db2777',
+    'yellow': '#ca8a04',
+    'gray': '#6b7280',
+    'grey': '#6b7280'
+}
+PALETTE = ['#2563eb', '#dc2626', '#16a34a', '#9333ea', '#ea580c']
+
+ZOOM_PATTERN = re.compile(
+    r'^(?:zoom(?:\s+in|\s+out)?(?:\s+on|\s+to)?|show(?:\s+me)?(?:\s+the\s+graph)?|'
+    r'set(?:\s+the)?\s+(?:view|viewport|window|bounds)(?:\s+to)?|view)\s+'
+    r'(?:the\s+(?:region|area)\s+)?(?:from\s+)?(?:x\s*(?:=|from)?\s*)?'
+    rf'(?P<left>{NUMBER})\s*(?:to|\.\.|,)\s*(?P<right>{NUMBER})'
+    rf'(?:\s*(?:,|and)?\s*y\s*(?:=|from)?\s*(?P<bottom>{NUMBER})\s*(?:to|\.\.|,)\s*(?P<top>{NUMBER}))?$'
+)
+# "clear" and "wipe" mean the canvas on their own; "remove", "delete" and "erase" need to say what
+CLEAR_OBJECT = (
+    r'(?:the\s+)?(?:whole\s+|entire\s+)?'
+    r'(?:graph|canvas|screen|everything|all(?:\s+(?:expressions|graphs|functions))?|it\s+all)'
+)
+CLEAR_PATTERN = re.compile(
+    rf'^(?:(?:clear|wipe)(?:\s+{CLEAR_OBJECT})?|(?:erase|remove|delete)\s+{CLEAR_OBJECT})$'
+)
+RESET_PATTERN = re.compile(
+    r'^(?:start\s+(?:fresh|over)|reset(?:\s+(?:the\s+)?(?:graph|calculator|canvas))?|'
+    r'new\s+graph|blank\s+(?:graph|canvas))$'
+)
+REMOVE_PATTERN = re.compile(r'^(?:remove|delete|erase|clear)\s+(?:the\s+)?(?P<target>.+)$')
+HIDE_PATTERN = re.compile(r'^hide\s+(?:the\s+)?(?P<target>.+)$')
+PLOT_PATTERN = re.compile(
+    r'^(?:plot|graph|draw|show(?:\s+me)?|add)\s+(?P<body>.+?)'
+    r'(?:\s+in\s+(?P<color>' + '|'.join(COLORS) + r'))?'
+    r'(?:\s+(?:with\s+)?(?:an?\s+)?(?P<style>dashed|dotted|solid)(?:\s+line)?)?$'
+)
+POLITENESS = re.compile(r'^(?:please\s+|can\s+you\s+|could\s+you\s+)+|\s+please$')
+LIST_SEPARATOR = re.compile(r'\s*,\s*(?:and\s+)?|\s+and\s+')
+FUNCTION_PREFIX = re.compile(r'^(?:y|f\(x\)|g\(x\)|h\(x\))\s*=\s*')
+
+# Plain-text math tokens we know how to turn into Desmos LaTeX
+TOKEN = re.compile(r'\s*(sqrt|sin|cos|tan|sec|csc|cot|abs|exp|log|ln|pi|e|x|\d+(?:\.\d+)?|[-+*/^()])')
+COMMAND_FUNCTIONS = {'sin', 'cos', 'tan', 'sec', 'csc', 'cot', 'log', 'ln'}
+BRACED_FUNCTIONS = {
+    'sqrt': '\\sqrt{{{}}}',
+    'abs': '\\left|{}\\right|',
+    'exp': 'e^{{{}}}'
+}
+
+# Named shapes users refer to when removing ("remove the parabola")
+SHAPES = {
+    'parabola': lambda latex: re.search(r'x\^\{?2\}?', latex) and 'y^' not in latex and 'y\\^' not in latex,
+    'sine': lambda latex: '\\sin' in latex,
+    'sine wave': lambda latex: '\\sin' in latex,
+    'sin': lambda latex: '\\sin' in latex,
+    'cosine': lambda latex: '\\cos' in latex,
+    'cosine wave': lambda latex: '\\cos' in latex,
+    'cos': lambda latex: '\\cos' in latex,
+    'tangent': lambda latex: '\\tan' in latex,
+    'circle': lambda latex: re.search(r'x\^\{?2\}?\+y\^\{?2\}?=', latex),
+    'line': lambda latex: re.fullmatch(r'y=-?[\d.]*x?([+-][\d.]+x?)?', latex),
+    'point': lambda latex: re.fullmatch(rf'\({NUMBER},{NUMBER}\)', latex),
+    'exponential': lambda latex: re.search(r'\d\^x|e\^', latex),
+    'logarithm': lambda latex: '\\ln' in latex or '\\log' in latex,
+}
+TARGET_SUFFIX = re.compile(r'\s+(?:graph|curve|function|plot|expression|wave)$')
+
+
+def to_desmos_latex(text):
+    """Convert a plain-text expression in x (e.g. "2x^(3)+sin(x)") to Desmos LaTeX, or None"""
+    tokens = []
+    position = 0
+    text = text.strip()
+    while position < len(text):
+        match = TOKEN.match(text, position)
+        if not match:
+            return None
+        tokens.append(match.group(1))
+        position = match.end()
+    if not tokens:
+        return None
+    try:
+        latex, end = _convert(tokens, 0, 0)
+    except (ValueError, IndexError):
+        return None
+    return latex if end == len(tokens) else None
+
+
+def _atom(token):
+    if token == 'pi':
+        return '\\pi'
+    if token in ('x', 'e') or re.fullmatch(r'\d+(?:\.\d+)?', token):
+        return token
+    raise ValueError(token)
+
+
+def _convert(tokens, i, depth):
+    """Recursive-descent conversion of one parenthesis level; returns (latex, next index)"""
+    out = []
+    while i < len(tokens):
+        token = tokens[i]
+        if token == ')':
+            if depth == 0:
+                raise ValueError('unbalanced )')
+            return ''.join(out), i + 1
+        if token == '(':
+            inner, i = _convert(tokens, i + 1, depth + 1)
+            out.append(f'({inner})')
+        elif token in BRACED_FUNCTIONS:
+            if tokens[i + 1] != '(':
+                raise ValueError(token)
+            inner, i = _convert(tokens, i + 2, depth + 1)
+            out.append(BRACED_FUNCTIONS[token].format(inner))
+        elif token in COMMAND_FUNCTIONS:
+            if tokens[i + 1] != '(':
+                raise ValueError(token)
+            out.append('\\' + token)
+            i += 1
+        elif token == '^':
+            following = tokens[i + 1]
+            if following == '(':
+                inner, i = _convert(tokens, i + 2, depth + 1)
+            elif following == '-':
+                inner = '-' + _atom(tokens[i + 2])
+                i += 3
+            else:
+                inner = _atom(following)
+                i += 2
+            out.append('^' + inner if len(inner) == 1 else '^{' + inner + '}')
+        elif token == '*':
+            out.append('\\cdot ')
+            i += 1
+        elif token in '+-/':
+            out.append(token)
+            i += 1
+        else:
+            out.append(_atom(token))
+            i += 1
+    if depth != 0:
+        raise ValueError('unbalanced (')
+    return ''.join(out), i
+
+
+def normalize_latex(latex):
+    """Canonical LaTeX for comparisons: no spaces, no \\left/\\right, no braces around single characters"""
+    latex = re.sub(r'\s+|\\left|\\right', '', latex or '')
+    return re.sub(r'\^\{(.)\}', r'^\1', latex)
+
+
+def expression_id(latex, taken):
+    """Descriptive, unused expression ID derived from the LaTeX (y=2x+1 -> graph_2xp1)"""
+    body = normalize_latex(latex).split('=', 1)[-1]
+    body = body.replace('+', 'p').replace('-', 'm').replace('/', 'd').replace('.', '_')
+    slug = re.sub(r'[^a-z0-9_]', '', body.replace('\\', '').lower())[:24] or 'expr'
+    candidate = f'graph_{slug}'
+    suffix = 2
+    while candidate in taken:
+        candidate = f'graph_{slug}_{suffix}'
+        suffix += 1
+    return candidate
+
+
+def parse_local_command(message, current_expressions):
+    """Return a full chat response for simple graph requests, or None to fall through to the model"""
+    text = POLITENESS.sub('', message.strip().lower()).rstrip('.!? ')
+    if not text or len(text) > 200:
+        return None
+
+    for handler in (_zoom, _clear, _reset, _remove, _hide, _plot):
+        response = handler(text, current_expressions)
+        if response:
+            return response
+    return None
+
+
+def _zoom(text, current_expressions):
+    match = ZOOM_PATTERN.match(text)
+    if not match:
+        return None
+    left, right = float(match.group('left')), float(match.group('right'))
+    if match.group('bottom') is not None:
+        bottom, top = float(match.group('bottom')), float(match.group('top'))
+    else:
+        bottom, top = left, right
+    if left >= right or bottom >= top:
+        return None
+    bounds = {'left': left, 'right': right, 'bottom': bottom, 'top': top}
+    return {
+        'chatResponse': f"I've set the view to x from {left:g} to {right:g} and y from {bottom:g} to {top:g}.",
+        'graphCommands': [{'command': 'setMathBounds', 'params': bounds}]
+    }
+
+
+def _clear(text, current_expressions):
+    if not CLEAR_PATTERN.match(text):
+        return None
+    return {
+        'chatResponse': "I've cleared the graph. What would you like to explore next?",
+        'graphCommands': [{'command': 'clearExpressions', 'params': {}}]
+    }
+
+
+def _reset(text, current_expressions):
+    if not RESET_PATTERN.match(text):
+        return None
+    return {
+        'chatResponse': "I've reset the calculator to a blank graph. What would you like to explore?",
+        'graphCommands': [{'command': 'setBlank', 'params': {}}]
+    }
+
+
+def _remove(text, current_expressions):
+    match = REMOVE_PATTERN.match(text)
+    if not match:
+        return None
+    expr = _target_expression(match.group('target'), current_expressions)
+    if not expr:
+        return None
+    return {
+        'chatResponse': f"I've removed {expr.get('latex')} from the graph.",
+        'graphCommands': [{'command': 'removeExpression', 'params': {'id': expr['id']}}]
+    }
+
+
+def _hide(text, current_expressions):
+    match = HIDE_PATTERN.match(text)
+    if not match:
+        return None
+    expr = _target_expression(match.group('target'), current_expressions)
+    if not expr:
+        return None
+    return {
+        'chatResponse': f"I've hidden {expr.get('latex')}; it is still on the graph.",
+        'graphCommands': [{'command': 'setExpression', 'params': {'id': expr['id'], 'hidden': True}}]
+    }
+
+
+def _target_expression(target, current_expressions):
+    """The one expression a removal or hide request names (by ID, LaTeX or shape), or None"""
+    if not current_expressions:
+        return None
+    target = TARGET_SUFFIX.sub('', target.strip())
+
+    matches = [expr for expr in current_expressions if str(expr.get('id', '')).lower() == target]
+    if not matches:
+        latex = to_desmos_latex(FUNCTION_PREFIX.sub('', target))
+        if latex:
+            wanted = {normalize_latex(latex), normalize_latex('y=' + latex)}
+            matches = [expr for expr in current_expressions if normalize_latex(expr.get('latex')) in wanted]
+    if not matches and target in SHAPES:
+        matches = [
+            expr for expr in current_expressions
+            if target.split()[0] in str(expr.get('id', '')).lower() or SHAPES[target](normalize_latex(expr.get('latex')))
+        ]
+
+    # Only act when exactly one expression is meant; anything ambiguous goes to the model
+    return matches[0] if len(matches) == 1 else None
+
+
+def _plot(text, current_expressions):
+    match = PLOT_PATTERN.match(text)
+    if not match:
+        return None
+
+    parts = [part for part in LIST_SEPARATOR.split(match.group('body')) if part]
+    if not parts or len(parts) > 6:
+        return None
+
+    existing = {normalize_latex(expr.get('latex')): expr.get('id') for expr in current_expressions}
+    taken = {expr.get('id') for expr in current_expressions}
+    commands = []
+    plotted = []
+    for part in parts:
+        body = FUNCTION_PREFIX.sub('', part.strip())
+        latex = to_desmos_latex(body)
+        if not latex or 'x' not in latex:
+            return None
+        latex = 'y=' + latex
+
+        expr_id = existing.get(normalize_latex(latex)) or expression_id(latex, taken)
+        taken.add(expr_id)
+        color = COLORS.get(match.group('color')) or PALETTE[(len(current_expressions) + len(commands)) % len(PALETTE)]
+        params = {'id': expr_id, 'latex': latex, 'color': color}
+        if match.group('style'):
+            params['lineStyle'] = match.group('style').upper()
+        commands.append({'command': 'setExpression', 'params': params})
+        plotted.append(f"y = {body}")
+
+    listed = plotted[0] if len(plotted) == 1 else ', '.join(plotted[:-1]) + ' and ' + plotted[-1]
+    return {
+        'chatResponse': f"I've plotted {listed}.",
+        'graphCommands': commands
+    }
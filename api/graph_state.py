@@ -0,0 +1,172 @@
+"""Canonical per-session graph state and compaction of model graph commands"""
+import threading
+import time
+from collections import OrderedDict
+
+FNV_OFFSET = 0x811c9dc5
+FNV_PRIME = 0x01000193
+
+RESET_COMMANDS = ('clearExpressions', 'setBlank')
+
+
+def graph_hash(expressions):
+    """Order-independent hash of id + latex, computed identically by static/main.js.
+
+    Colors are left out because Desmos picks one itself when a command has none.
+    """
+    h = FNV_OFFSET
+    for expr_id, latex in sorted((str(expr.get('id', '')), expr.get('latex') or '') for expr in expressions):
+        for ch in f"{expr_id}\x1f{latex}\x1e":
+            h = ((h ^ ord(ch)) * FNV_PRIME) & 0xffffffff
+    return f"{len(expressions)}-{h:08x}"
+
+
+class GraphState:
+    """What the server believes is plotted for one session, in Desmos expression order"""
+
+    def __init__(self):
+        self.version = 0
+        self.last_access = time.time()
+        self._expressions = OrderedDict()
+        self._hash = graph_hash([])
+        self._lock = threading.Lock()
+
+    @property
+    def hash(self):
+        with self._lock:
+            return self._hash
+
+    def ids(self):
+        with self._lock:
+            return set(self._expressions)
+
+    def expressions(self):
+        """Plotted expressions in the same shape the client sends as currentExpressions"""
+        with self._lock:
+            return [dict(expr) for expr in self._expressions.values() if expr.get('latex')]
+
+    def replace(self, expressions):
+        """Take the client's full expression list as the new canonical state"""
+        with self._lock:
+            self._expressions = OrderedDict(
+                (expr['id'], {key: expr[key] for key in ('id', 'latex', 'color') if expr.get(key) is not None})
+                for expr in expressions if expr.get('id') is not None
+            )
+            self._changed()
+
+    def apply(self, commands):
+        """Apply graph commands the way the client's Desmos calculator will"""
+        with self._lock:
+            for command in commands:
+                name = command.get('command')
+                params = command.get('params') or {}
+                if name == 'setExpression':
+                    self._set(params)
+                elif name == 'setExpressions':
+                    for expression in params.get('expressions') or []:
+                        self._set(expression)
+                elif name == 'removeExpression':
+                    self._expressions.pop(params.get('id'), None)
+                elif name in RESET_COMMANDS:
+                    self._expressions.clear()
+            self._changed()
+
+    def sync_fields(self):
+        """Fields added to chat responses so the client can skip resending the graph"""
+        with self._lock:
+            return {'graphVersion': self.version, 'graphHash': self._hash}
+
+    def _set(self, params):
+        # setExpression on an existing ID updates only the given properties
+        expr_id = params.get('id')
+        if expr_id is None:
+            return
+        expression = self._expressions.setdefault(expr_id, {'id': expr_id})
+        for key in ('latex', 'color'):
+            if params.get(key) is not None:
+                expression[key] = params[key]
+
+    def _changed(self):
+        new_hash = graph_hash([expr for expr in self._expressions.values() if expr.get('latex')])
+        if new_hash != self._hash:
+            self._hash = new_hash
+            self.version += 1
+
+
+class GraphStateStore:
+    """LRU + TTL map of session ID to GraphState"""
+
+    def __init__(self, max_sessions=1000, ttl=3600):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_create(self, session_id):
+        now = time.time()
+        with self._lock:
+            state = self._states.get(session_id)
+            if state is None or now - state.last_access > self.ttl:
+                state = GraphState()
+                self._states[session_id] = state
+            state.last_access = now
+            self._states.move_to_end(session_id)
+            while len(self._states) > self.max_sessions:
+                self._states.popitem(last=False)
+            return state
+
+
+def compact_commands(commands, existing_ids=()):
+    """Fold graph commands into the smallest list with the same end result.
+
+    - repeated setExpression on one ID becomes a single merged setExpression
+    - a set followed by a remove of the same ID becomes just the remove, or
+      nothing at all if the ID was not on the graph before these commands
+    - anything before a clearExpressions/setBlank is dropped, and the sets
+      after it are sent as one setExpressions batch
+    - only the last setMathBounds is kept
+    """
+    reset = None
+    bounds = None
+    removes = OrderedDict()
+    sets = OrderedDict()
+    others = []
+    present = set(existing_ids)
+
+    for command in commands:
+        name = command.get('command')
+        params = command.get('params') or {}
+        if name in RESET_COMMANDS:
+            # setBlank also resets the viewport, so it wins over a clear on either side
+            if name == 'setBlank':
+                bounds = None
+            if name == 'setBlank' or not reset or reset['command'] != 'setBlank':
+                reset = command
+            removes.clear()
+            sets.clear()
+            present.clear()
+        elif name == 'setExpression' and params.get('id') is not None:
+            sets[params['id']] = dict(sets.get(params['id'], {}), **params)
+        elif name == 'setExpressions':
+            for expression in params.get('expressions') or []:
+                if expression.get('id') is not None:
+                    sets[expression['id']] = dict(sets.get(expression['id'], {}), **expression)
+        elif name == 'removeExpression' and params.get('id') is not None:
+            expr_id = params['id']
+            sets.pop(expr_id, None)
+            if expr_id in present:
+                removes[expr_id] = command
+        elif name == 'setMathBounds':
+            bounds = command
+        else:
+            others.append(command)
+
+    compacted = [reset] if reset else []
+    compacted += removes.values()
+    if len(sets) > 1:
+        compacted.append({'command': 'setExpressions', 'params': {'expressions': list(sets.values())}})
+    else:
+        compacted += [{'command': 'setExpression', 'params': params} for params in sets.values()]
+    if bounds:
+        compacted.append(bounds)
+    return compacted + others
@@ -1,11 +1,21 @@
-from flask import Flask, render_template, request, jsonify, session
-import google.generativeai as genai
+import time
+
+# Taken before anything else is imported, so /api/startup_stats covers the whole module import
+IMPORT_STARTED = time.perf_counter()
+
+from flask import Flask, render_template, request, jsonify, session, Response, stream_with_context, g, has_request_context
 import os
 import sys
 import json
+import hashlib
+import math
+import importlib.util
 import tempfile
 from pathlib import Path
 import traceback
+from contextlib import nullcontext
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor
 
 # Load environment variables from .env file
 from dotenv import load_dotenv
@@ -14,20 +24,42 @@ from dotenv import load_dotenv
 parent_dir = Path(__file__).parent.parent
 load_dotenv(parent_dir / '.env')
 
+# Make sibling modules in api/ importable when Vercel loads this file from the project root
+sys.path.insert(0, str(Path(__file__).parent))
+from response_parser import StreamingResponseParser, extract_json, strip_code_fences
+from embedding_pipeline import embed_in_batches
+from session_store import SessionStore
+from shared_session_store import SQLiteSessionStore
+from ingest_jobs import IngestJobManager, SQLiteJobStore
+from response_cache import ResponseCache, response_key, depends_on_history
+from fast_path import parse_local_command
+from conversation import Conversation, ConversationStore, estimate_tokens
+from context_budget import ContextBudget
+from conversation_summary import RollingSummarizer, summary_request
+from graph_state import GraphStateStore, compact_commands
+from metrics import Registry, StageTimer
+from model_backend import GeminiBackend, FakeBackend
+from lazy import LazyModule, memoized, LOAD_TIMES
+from single_flight import SingleFlight
+from desmos_latex import LatexValidator
+from upstream_scheduler import UpstreamScheduler, UpstreamBusy
+from retrieval import QueryEmbeddingCache, EmbeddingBreaker, needs_retrieval, relevant_hits
+
+# The Gemini SDK and the PDF/RAG stack are imported on first use, so a cold
+# start that only serves the page, fast-path or cached turns never loads them
+genai = LazyModule('google.generativeai')
+
 # For PDF processing (Phase 4)
-try:
-    import fitz  # PyMuPDF
-    import numpy as np
-    PDF_SUPPORT = True
-except ImportError:
-    PDF_SUPPORT = False
+fitz = LazyModule('fitz')  # PyMuPDF
+np = LazyModule('numpy')
+pdf_chunker = LazyModule('pdf_chunker')
+embedding_store = LazyModule('embedding_cache')
+PDF_SUPPORT = all(importlib.util.find_spec(name) for name in ('fitz', 'numpy'))
 
 # For RAG (Phase 4)
-try:
-    import faiss
-    FAISS_SUPPORT = True
-except ImportError:
-    FAISS_SUPPORT = False
+faiss = LazyModule('faiss')
+vector_index = LazyModule('vector_index')
+FAISS_SUPPORT = importlib.util.find_spec('faiss') is not None
 
 # Initialize Flask with correct template and static folders
 app = Flask(__name__, 
@@ -35,31 +67,235 @@ app = Flask(__name__,
             static_folder=str(parent_dir / 'static'))
 app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'dev-secret-key-change-in-production')
 
+# Full user messages, graph states and raw model output are only printed when this is on
+VERBOSE_LOGGING = os.environ.get('VERBOSE_LOGGING', '1') != '0'
+
+# Prometheus metrics served at /metrics
+metrics = Registry()
+STAGE_SECONDS = metrics.histogram('axiom_stage_seconds', 'Time spent in each stage of a request', ['endpoint', 'stage'])
+REQUEST_SECONDS = metrics.histogram('axiom_request_seconds', 'Total request time', ['endpoint', 'outcome'])
+HTTP_BYTES = metrics.counter('axiom_http_bytes_total', 'Request and response body bytes', ['endpoint', 'direction'])
+MODEL_TOKENS = metrics.counter('axiom_model_tokens_total', 'Estimated model tokens (~4 characters per token)', ['direction'])
+EMBEDDED_CHUNKS = metrics.counter('axiom_embedded_chunks_total', 'Document chunks embedded, by where the vector came from', ['source'])
+QUERY_EMBEDDINGS = metrics.counter('axiom_query_embeddings_total', 'Retrieval query embeddings, by where the vector came from', ['source'])
+MODEL_CALLS = metrics.counter('axiom_model_calls_total', 'Async model calls, by which attempt answered or how they failed', ['result'])
+MODEL_HEDGES = metrics.counter('axiom_model_hedges_total', 'Hedged retries of async model calls, by trigger', ['reason'])
+COALESCED_CALLS = metrics.counter('axiom_coalesced_calls_total', 'Upstream model and embedding calls, by whether they started a call or shared one in flight', ['kind', 'role'])
+LATEX_EXPRESSIONS = metrics.counter('axiom_latex_expressions_total', 'graphCommands latex checked against the Desmos syntax rules, by result', ['result'])
+LATEX_RULE_HITS = metrics.counter('axiom_latex_rule_hits_total', 'graphCommands latex that broke a Desmos syntax rule, by rule', ['rule'])
+RAG_RETRIEVALS = metrics.counter('axiom_rag_retrievals_total', 'Chat turns on a session with a document, by retrieval result', ['result'])
+CONTEXT_TOKENS = metrics.histogram('axiom_context_tokens', 'Estimated input tokens per model turn, by prompt segment', ['segment'],
+                                   buckets=(50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000))
+CONVERSATION_SUMMARIES = metrics.counter('axiom_conversation_summaries_total', 'Background folds of old conversation messages into a rolling summary, by result', ['result'])
+UPSTREAM_QUEUE_DEPTH = metrics.gauge('axiom_upstream_queue_depth', 'Upstream calls waiting for admission', ['kind', 'priority'])
+UPSTREAM_WAIT = metrics.histogram('axiom_upstream_wait_seconds', 'Time upstream calls waited for admission', ['kind', 'priority'])
+UPSTREAM_SHED = metrics.counter('axiom_upstream_shed_total', 'Upstream calls refused by admission control, by reason', ['kind', 'priority', 'reason'])
+UPSTREAM_RETRIES = metrics.counter('axiom_upstream_quota_retries_total', 'Upstream calls retried after a quota (429) error', ['kind'])
+CONTEXT_REDUCTIONS = metrics.counter('axiom_context_reductions_total', 'Prompt segments shortened or sampled to fit the token budget', ['segment', 'level'])
+
 # Configure Gemini API
+GEMINI_MODEL_NAME = 'gemini-2.5-flash'
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
-if GEMINI_API_KEY:
-    print(f"✓ Gemini API key loaded (starts with: {GEMINI_API_KEY[:10]}...)")
-    genai.configure(api_key=GEMINI_API_KEY)
-    model = genai.GenerativeModel('gemini-2.5-flash')
-    print(f"✓ Gemini model initialized: gemini-2.5-flash")
+
+# MODEL_BACKEND=fake swaps Gemini for a local fake (see api/model_backend.py) for benchmarks and load tests
+MODEL_BACKEND = os.environ.get('MODEL_BACKEND', 'gemini')
+if MODEL_BACKEND == 'fake':
+    backend = FakeBackend.from_env(os.environ)
+    print(f"✓ Fake model backend selected (latency {backend.latency * 1000:.0f} ms, "
+          f"malformed rate {backend.malformed_rate:.0%})")
+else:
+    # The SDK is configured with the key when the first model or embedding call is made
+    backend = GeminiBackend(genai, GEMINI_MODEL_NAME, api_key=GEMINI_API_KEY)
+    if GEMINI_API_KEY:
+        print(f"✓ Gemini API key loaded (starts with: {GEMINI_API_KEY[:10]}...)")
+    else:
+        print("❌ WARNING: GEMINI_API_KEY not set!")
+        print(f"   Current working directory: {os.getcwd()}")
+        print(f"   .env file location: {parent_dir / '.env'}")
+        print(f"   .env file exists: {(parent_dir / '.env').exists()}")
+
+# Checked instead of building the model, which would import the SDK
+MODEL_CONFIGURED = MODEL_BACKEND == 'fake' or bool(GEMINI_API_KEY)
+
+if VERBOSE_LOGGING:
+    # Print template folder info
+    print(f"\n📁 Flask Configuration:")
+    print(f"   Template folder: {app.template_folder}")
+    print(f"   Static folder: {app.static_folder}")
+    print(f"   Template folder exists: {Path(app.template_folder).exists()}")
+    print(f"   Static folder exists: {Path(app.static_folder).exists()}")
+
+
+# Cache for /api/chat responses, shared by workers on this host through SQLite
+response_cache = ResponseCache(
+    max_entries=int(os.environ.get('RESPONSE_CACHE_SIZE', '2000')),
+    ttl=int(os.environ.get('RESPONSE_CACHE_TTL', '3600')),
+    db_path=os.environ.get('RESPONSE_CACHE_DB', str(Path(tempfile.gettempdir()) / 'axiom-canvas-responses.sqlite3')) or None
+)
+
+# Each session searches all of its documents in one index, rebuilt as HNSW or IVF only when it outgrows the previous type
+VECTOR_INDEX_FLAT_MAX = int(os.environ.get('VECTOR_INDEX_FLAT_MAX', '10000'))
+VECTOR_INDEX_HNSW_MAX = int(os.environ.get('VECTOR_INDEX_HNSW_MAX', '100000'))
+
+# Session storage for PDF embeddings, bounded by a memory budget. SESSION_BACKEND=memory keeps each
+# session in the worker that indexed it, spilling idle or least recently used ones to disk;
+# SESSION_BACKEND=sqlite shares them with every worker on the host (SQLite + memory-mapped vectors)
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'memory')
+session_store_options = dict(
+    max_bytes=int(os.environ.get('SESSION_MEMORY_MB', '512')) * 1024 * 1024,
+    ttl=int(os.environ.get('SESSION_TTL_SECONDS', '3600')),
+    index_factory=lambda: new_session_index()
+)
+if SESSION_BACKEND == 'sqlite':
+    session_store = SQLiteSessionStore(
+        os.environ.get('SESSION_DB_DIR', str(Path(tempfile.gettempdir()) / 'axiom-canvas-session-db')),
+        **session_store_options
+    )
 else:
-    model = None
-    print("❌ WARNING: GEMINI_API_KEY not set!")
-    print(f"   Current working directory: {os.getcwd()}")
-    print(f"   .env file location: {parent_dir / '.env'}")
-    print(f"   .env file exists: {(parent_dir / '.env').exists()}")
+    session_store = SessionStore(
+        os.environ.get('SESSION_SPILL_DIR', str(Path(tempfile.gettempdir()) / 'axiom-canvas-sessions')),
+        **session_store_options
+    )
+
+# Recent query embeddings, so repeated questions about a document skip the embedding API
+query_embeddings = QueryEmbeddingCache(
+    max_entries=int(os.environ.get('QUERY_EMBEDDING_CACHE_SIZE', '1000')),
+    ttl=int(os.environ.get('QUERY_EMBEDDING_CACHE_TTL', '3600'))
+)
+
+# Retrieved chunks further than this squared L2 distance from the query are not sent to the model
+# (for unit-length embeddings that is 2 - 2 * cosine similarity, so 1.0 keeps cosine >= 0.5),
+# unless they match the query's exact terms with at least this BM25 score
+RAG_MAX_DISTANCE = float(os.environ.get('RAG_MAX_DISTANCE', '1.0'))
+RAG_MIN_BM25_SCORE = float(os.environ.get('RAG_MIN_BM25_SCORE', '3.0'))
+
+# A query embedding slower than this falls back to lexical-only retrieval for the turn, and a
+# failed or slow call stops further ones for the cooldown
+RAG_EMBED_TIMEOUT = float(os.environ.get('RAG_EMBED_TIMEOUT_MS', '2000')) / 1000
+embed_breaker = EmbeddingBreaker(cooldown=float(os.environ.get('RAG_EMBED_COOLDOWN_SECONDS', '30')))
+query_embed_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='query-embed')
+
+# The async pipeline (api/asgi.py) gives up on a model call after MODEL_TIMEOUT_SECONDS, and
+# sends the same request again if the first has not answered within MODEL_HEDGE_MS (0 disables)
+MODEL_TIMEOUT = float(os.environ.get('MODEL_TIMEOUT_SECONDS', '60'))
+MODEL_HEDGE_AFTER = float(os.environ.get('MODEL_HEDGE_MS', '8000')) / 1000 or None
+
+# Identical model calls (same assembled context) and document embedding groups (same chunks) that
+# are in flight at the same time share one upstream call (set COALESCE_CALLS=0 to disable)
+COALESCE_CALLS = os.environ.get('COALESCE_CALLS', '1') != '0'
+chat_calls = SingleFlight('chat', COALESCED_CALLS, enabled=COALESCE_CALLS)
+chat_streams = SingleFlight('chat_stream', COALESCED_CALLS, enabled=COALESCE_CALLS)
+embedding_calls = SingleFlight('embed_document', COALESCED_CALLS, enabled=COALESCE_CALLS)
+
+# Every upstream call waits for admission (api/upstream_scheduler.py): at most MODEL_RPM chat and
+# EMBED_RPM embedding calls a minute (0 = no limit; the defaults are Gemini's free tier, and the
+# fake backend is unlimited), UPSTREAM_CONCURRENCY in flight with UPSTREAM_RESERVED_SLOTS of them
+# kept for interactive calls, chats before PDF embedding before summaries. A chat that would wait
+# longer than UPSTREAM_MAX_WAIT_MS, or find UPSTREAM_MAX_QUEUE calls ahead of it, gets a 503 at once,
+# and calls failing with a quota error are retried up to UPSTREAM_MAX_RETRIES times with backoff
+DEFAULT_RPM = '0' if backend.name == 'fake' else '60'
+upstream = UpstreamScheduler(
+    {'generate': int(os.environ.get('MODEL_RPM', DEFAULT_RPM)) / 60,
+     'embed': int(os.environ.get('EMBED_RPM', DEFAULT_RPM)) / 60},
+    max_in_flight=int(os.environ.get('UPSTREAM_CONCURRENCY', '16')),
+    reserved_slots=int(os.environ.get('UPSTREAM_RESERVED_SLOTS', '4')),
+    max_queue=int(os.environ.get('UPSTREAM_MAX_QUEUE', '64')),
+    max_wait={'interactive': float(os.environ.get('UPSTREAM_MAX_WAIT_MS', '10000')) / 1000},
+    max_retries=int(os.environ.get('UPSTREAM_MAX_RETRIES', '3')),
+    queue_depth=UPSTREAM_QUEUE_DEPTH, wait_seconds=UPSTREAM_WAIT, shed=UPSTREAM_SHED, retries=UPSTREAM_RETRIES
+)
+
+# Check graphCommands latex against the Desmos syntax rules of the prompt and repair common
+# violations (named points, bare expressions, arrows, \vec) before they reach the browser
+# (set LATEX_VALIDATION=0 to disable)
+LATEX_VALIDATION = os.environ.get('LATEX_VALIDATION', '1') != '0'
+latex_validator = LatexValidator(max_entries=int(os.environ.get('LATEX_CACHE_SIZE', '4096'))) if LATEX_VALIDATION else None
+
+# Answer simple graph commands locally instead of calling Gemini (set LOCAL_FAST_PATH=0 to disable)
+FAST_PATH_ENABLED = os.environ.get('LOCAL_FAST_PATH', '1') != '0'
+
+# Server-side conversation per session: stored turns plus the graph state the model last saw
+CONVERSATION_MAX_MESSAGES = int(os.environ.get('CONVERSATION_MAX_MESSAGES', '24'))
+# Messages older than the last CONVERSATION_RECENT_MESSAGES are folded into a rolling summary of at most
+# CONVERSATION_SUMMARY_TOKENS by a background model call, once that many more have built up
+# (set CONVERSATION_SUMMARY=0 to drop them at CONVERSATION_MAX_MESSAGES instead)
+CONVERSATION_RECENT_MESSAGES = int(os.environ.get('CONVERSATION_RECENT_MESSAGES', '6'))
+CONVERSATION_SUMMARY = os.environ.get('CONVERSATION_SUMMARY', '1') != '0'
+
+# Estimated input tokens per model turn, filled by priority: system prompt and message, graph
+# state, PDF chunks, then history (set CONTEXT_TOKEN_BUDGET=0 to send everything)
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', '8000'))
+context_budget = ContextBudget(CONTEXT_TOKEN_BUDGET) if CONTEXT_TOKEN_BUDGET > 0 else None
+conversations = ConversationStore(
+    max_sessions=int(os.environ.get('CONVERSATION_MAX_SESSIONS', '1000')),
+    ttl=int(os.environ.get('SESSION_TTL_SECONDS', '3600'))
+)
+
+
+
+def summarize_conversation(previous_summary, messages):
+    """Fold messages into a session's rolling summary with one model call"""
+    request_text = summary_request(previous_summary, messages)
+    if system_instruction_supported():
+        model = backend.generative_model(system_instruction=conversation_summarizer.prompt)
+    else:
+        model = backend.generative_model()
+        request_text = conversation_summarizer.prompt + "\n\n" + request_text
+    MODEL_TOKENS.inc(estimate_tokens(request_text), direction='input')
+    response = upstream.call('generate', 'background', lambda: model.start_chat(history=[]).send_message(request_text))
+    summary = strip_code_fences(response.text or '')
+    MODEL_TOKENS.inc(estimate_tokens(summary), direction='output')
+    return summary
+
+
+conversation_summarizer = RollingSummarizer(
+    summarize_conversation,
+    batch_messages=CONVERSATION_RECENT_MESSAGES,
+    max_tokens=int(os.environ.get('CONVERSATION_SUMMARY_TOKENS', '300')),
+    max_workers=int(os.environ.get('SUMMARY_WORKERS', '2')),
+    counter=CONVERSATION_SUMMARIES
+) if CONVERSATION_SUMMARY else None
+
+# Canonical graph per session, so clients can send a hash instead of every expression
+graph_states = GraphStateStore(
+    max_sessions=int(os.environ.get('CONVERSATION_MAX_SESSIONS', '1000')),
+    ttl=int(os.environ.get('SESSION_TTL_SECONDS', '3600'))
+)
+
+# Background workers that run PDF ingestion jobs (extract -> embed -> index). With the sqlite session
+# backend, job progress goes to the same database, so a status poll can land on any worker
+ingest_jobs = IngestJobManager(
+    max_workers=int(os.environ.get('INGEST_WORKERS', '2')),
+    store=SQLiteJobStore(session_store.db_path, ttl=int(os.environ.get('SESSION_TTL_SECONDS', '3600')))
+    if SESSION_BACKEND == 'sqlite' else None
+)
+
+# Embedding pipeline tuning: chunks per embedding request and batches in flight at once
+EMBED_BATCH_SIZE = int(os.environ.get('EMBED_BATCH_SIZE', '100'))
+EMBED_CONCURRENCY = int(os.environ.get('EMBED_CONCURRENCY', '4'))
+
+# Worker processes for page extraction of very large PDFs (1 = extract in-process)
+PDF_EXTRACT_WORKERS = int(os.environ.get('PDF_EXTRACT_WORKERS', '1'))
+
+# Persistent caches so re-uploaded documents and repeated chunks skip the embedding API
+# (/tmp is the only writable location on Vercel)
+EMBEDDING_MODEL = "models/embedding-001"
+# Bump when chunking or indexing changes so stale cached documents are not reused
+DOCUMENT_PIPELINE_VERSION = "2"
+CACHE_DIR = Path(os.environ.get('EMBEDDING_CACHE_DIR', Path(tempfile.gettempdir()) / 'axiom-canvas-cache'))
 
-# Print template folder info
-print(f"\n📁 Flask Configuration:")
-print(f"   Template folder: {app.template_folder}")
-print(f"   Static folder: {app.static_folder}")
-print(f"   Template folder exists: {Path(app.template_folder).exists()}")
-print(f"   Static folder exists: {Path(app.static_folder).exists()}")
 
+@memoized
+def get_embedding_cache():
+    """Chunk embedding cache, opened (and its directory scanned) on first use"""
+    return embedding_store.EmbeddingCache(str(CACHE_DIR / 'embeddings'), int(os.environ.get('EMBEDDING_CACHE_MAX_MB', '256')) * 1024 * 1024)
+
+
+@memoized
+def get_document_cache():
+    """Processed document cache, opened (and its directory scanned) on first use"""
+    return embedding_store.DocumentCache(str(CACHE_DIR / 'documents'), int(os.environ.get('DOCUMENT_CACHE_MAX_MB', '256')) * 1024 * 1024)
 
-# Session storage for PDF embeddings (in-memory for simplicity)
-# In production, consider using Redis or a database
-session_data = {}
 
 # System prompt for Gemini
 SYSTEM_PROMPT = """You are Axiom Canvas, an AI-powered mathematical visualization assistant. You help users understand mathematics through both textual explanations and visual representations on a Desmos graphing calculator.
@@ -219,240 +455,655 @@ When a user asks to clear/remove a specific graph, use the removeExpression comm
 """
 
 
+@memoized
+def system_instruction_supported():
+    """Whether the installed SDK takes the prompt as a system instruction (read from its version, not by importing it)"""
+    if backend.name == 'fake':
+        return True
+    import importlib.metadata
+    try:
+        version = importlib.metadata.version('google-generativeai')
+    except importlib.metadata.PackageNotFoundError:
+        return False
+    # GenerativeModel gained system_instruction in 0.5.0
+    return tuple(int(part) for part in version.split('.')[:2] if part.isdigit()) >= (0, 5)
+
+
+@memoized
+def get_chat_model():
+    """Model used for chat turns, built on the first turn that needs it"""
+    if system_instruction_supported():
+        chat_model = backend.generative_model(system_instruction=SYSTEM_PROMPT)
+    else:
+        chat_model = backend.generative_model()
+    print(f"✓ {backend.name} model initialized: {GEMINI_MODEL_NAME}")
+    return chat_model
+
+# Cached responses are only valid for the model and prompt that produced them
+PROMPT_FINGERPRINT = hashlib.sha256(f"{backend.name}\n{GEMINI_MODEL_NAME}\n{SYSTEM_PROMPT}".encode('utf-8')).hexdigest()
+
+
 @app.route('/')
 def index():
     """Serve the main page"""
     return render_template('index.html')
 
 
+# Stage timer of an async request (api/asgi.py), which has no Flask request context
+request_timer = ContextVar('request_timer', default=None)
+
+
+def stage(name):
+    """Time a stage of the current request, if it is being timed"""
+    timer = g.get('stage_timer') if has_request_context() else request_timer.get()
+    return timer.stage(name) if timer else nullcontext()
+
+
+def finish_timing(timer, outcome):
+    """Record a request's stage timings and log them as one structured line"""
+    summary = timer.finish(STAGE_SECONDS, REQUEST_SECONDS, outcome=outcome)
+    print(f"timing {json.dumps(summary)}")
+
+
+def count_stream_bytes(lines, endpoint):
+    for line in lines:
+        HTTP_BYTES.inc(len(line.encode('utf-8')), endpoint=endpoint, direction='out')
+        yield line
+
+
+@app.after_request
+def count_http_bytes(response):
+    if request.path.startswith('/api/'):
+        HTTP_BYTES.inc(request.content_length or 0, endpoint=request.endpoint, direction='in')
+        if not response.is_streamed:
+            HTTP_BYTES.inc(response.calculate_content_length() or 0, endpoint=request.endpoint, direction='out')
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Stage latency histograms and byte/token counters in the Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def format_graph_state(current_expressions):
+    """Describe the full current graph state for the model"""
+    if current_expressions:
+        expr_list = "\n".join([f"- ID: '{expr['id']}', Expression: {expr['latex']}" for expr in current_expressions])
+        return f"CURRENT GRAPH STATE - These expressions are currently plotted:\n{expr_list}\n\nUse these exact IDs if you need to remove or modify any of these expressions."
+    return "CURRENT GRAPH STATE: The graph is currently empty."
+
+
+def get_rag_context(session_id, user_message):
+    """Retrieve PDF chunks for this turn, best first, or an empty list"""
+    # Check if we have RAG context for this session
+    if not session_store.has_document(session_id):
+        return []
+    # Pure graph manipulation ("make it red", "zoom out") cannot use document context
+    if not needs_retrieval(user_message):
+        RAG_RETRIEVALS.inc(result='skipped')
+        print("RAG: skipped retrieval for a graph-only request")
+        return []
+    try:
+        return retrieve_relevant_context(session_id, user_message)
+    except Exception as e:
+        print(f"Error retrieving RAG context: {e}")
+        return []
+
+
+def recent_client_history(history, user_message):
+    """Last 6 client-side messages as model contents, without the current message"""
+    # The frontend appends the current message to its history before sending it
+    if history and history[-1].get('role') == 'user' and history[-1].get('content') == user_message:
+        history = history[:-1]
+    # Messages that never got a reply (the turn failed) would leave two user messages in a row
+    history = [msg for n, msg in enumerate(history)
+               if not (msg.get('role') == 'user' and n + 1 < len(history) and history[n + 1].get('role') == 'user')]
+    if history and history[-1].get('role') == 'user':
+        history = history[:-1]
+    
+    # Only include last 6 messages (3 exchanges) to keep context manageable
+    recent_history = history[-6:] if len(history) > 6 else history
+    return [{
+        'role': 'user' if msg['role'] == 'user' else 'model',
+        'parts': [msg['content']]
+    } for msg in recent_history]
+
+
+def open_conversation(session_id, history, user_message, reply_count):
+    """The session's conversation, seeded again from the client's history if it holds replies this worker never sent.
+
+    With several workers each keeps its own conversations, and a session's turns can land on any of them.
+    """
+    def stale(conversation):
+        if reply_count is None or conversation.replies == reply_count:
+            return False
+        print(f"Conversation of {session_id} is behind the client ({conversation.replies} replies here, "
+              f"{reply_count} in the client's history); seeding it again from the client's history")
+        return True
+    
+    return conversations.get_or_create(session_id, lambda: start_conversation(history, user_message, reply_count), stale)
+
+
+def start_conversation(history, user_message, reply_count=None):
+    """Create server-side conversation state, seeded with the client's recent history"""
+    seed_turns = recent_client_history(history, user_message)
+    preamble = []
+    if not system_instruction_supported():
+        # Older SDKs have no system instruction, so the prompt goes in as the first exchange
+        preamble = [
+            {'role': 'user', 'parts': [SYSTEM_PROMPT]},
+            {'role': 'model', 'parts': ['I understand. I will always respond with valid JSON containing chatResponse and graphCommands.']}
+        ]
+    if reply_count is None:
+        reply_count = sum(turn['role'] == 'model' for turn in seed_turns)
+    return Conversation(preamble, seed_turns=seed_turns,
+                        max_messages=CONVERSATION_MAX_MESSAGES, keep_messages=CONVERSATION_RECENT_MESSAGES,
+                        budget=context_budget, system_tokens=0 if preamble else estimate_tokens(SYSTEM_PROMPT),
+                        summarizer=conversation_summarizer, replies=reply_count)
+
+
+def estimate_rebuild_tokens(history, current_expressions, user_message, rag_chunks):
+    """Estimated input tokens of the old context, rebuilt from scratch on every turn"""
+    rebuilt = [SYSTEM_PROMPT, format_graph_state(current_expressions), user_message]
+    rebuilt += ['I understand. I will always respond with valid JSON containing chatResponse and graphCommands.',
+                'Understood. I can see the current expressions and will use the correct IDs for any modifications.']
+    if rag_chunks:
+        rebuilt += ["Context from uploaded PDF:\n\n" + "\n\n".join(rag_chunks), 'I will use this context to answer questions.']
+    rebuilt += [msg['content'] for msg in history[-6:]]
+    return sum(estimate_tokens(text) for text in rebuilt)
+
+
+def prepare_turn(conversation, user_message, session_id, history, current_expressions, rag_chunks=None, graph_text=None):
+    """Build this turn's model input from the session's conversation and log the token savings.
+
+    The async pipeline passes rag_chunks and graph_text it prepared concurrently.
+    """
+    if rag_chunks is None:
+        rag_chunks = get_rag_context(session_id, user_message)
+    if graph_text is None:
+        graph_text = format_graph_state(current_expressions)
+    turn = conversation.prepare(user_message, current_expressions, graph_text, rag_chunks)
+    
+    stats = conversation.record_stats(turn, estimate_rebuild_tokens(history, current_expressions, user_message, rag_chunks))
+    MODEL_TOKENS.inc(stats['sentTokens'], direction='input')
+    print(f"Context: {len(turn.history)} stored messages, ~{stats['sentTokens']} input tokens "
+          f"(~{stats['newTokens']} new, rebuild would be ~{stats['rebuildTokens']}, saved ~{stats['savedTokens']})")
+    if turn.context:
+        record_context_budget(turn.context)
+    
+    return turn
+
+
+def model_call_key(turn):
+    """Key of the upstream call for a turn: everything the model sees, so only identical calls share"""
+    context = json.dumps([PROMPT_FINGERPRINT, turn.history, turn.message], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(context.encode('utf-8')).hexdigest()
+
+
+def record_context_budget(report):
+    """Export how a turn's token budget was spent and log it as one line"""
+    segments = report['segments']
+    for name, segment in segments.items():
+        CONTEXT_TOKENS.observe(segment['tokens'], segment=name)
+        if segment.get('level', 'full') != 'full':
+            CONTEXT_REDUCTIONS.inc(segment=name, level=segment['level'])
+    print(f"context_budget {json.dumps(report)}")
+
+
+def parse_ai_response(response_text):
+    """Extract chatResponse and graphCommands from raw model text.
+    
+    Returns (chat_response, graph_commands, parsed) where parsed is False when
+    the text could not be read as complete JSON (plain text or a truncated
+    response), so it must not be cached.
+    """
+    parsed_response, truncated = extract_json(response_text)
+    
+    if parsed_response is None:
+        # The model answered in prose - pass it through without commands
+        print("ERROR: No JSON object found in response")
+        text = strip_code_fences(response_text)
+        return text if text else "I couldn't generate a proper response.", [], False
+    
+    chat_response = parsed_response.get('chatResponse', '')
+    graph_commands = [
+        command for command in parsed_response.get('graphCommands') or []
+        if isinstance(command, dict) and command.get('command')
+    ]
+    if not isinstance(chat_response, str):
+        chat_response = str(chat_response)
+    
+    if VERBOSE_LOGGING:
+        print(f"\n=== PARSED {'TRUNCATED RESPONSE' if truncated else 'SUCCESSFULLY'} ===")
+        print(f"Chat response length: {len(chat_response)}")
+        print(f"Graph commands count: {len(graph_commands)}")
+        print(f"===========================\n")
+    
+    if not chat_response and not graph_commands:
+        return "Sorry, I had trouble generating a response. Please try again.", [], False
+    
+    return chat_response, graph_commands, not truncated
+
+
+def replay_response(response, **done_fields):
+    """Yield a complete chatResponse/graphCommands response as NDJSON stream events"""
+    yield json.dumps({'type': 'chatResponse', 'chatResponse': response['chatResponse']}) + '\n'
+    for command in response['graphCommands']:
+        yield json.dumps({'type': 'graphCommand', 'graphCommand': command}) + '\n'
+    done_fields.update({key: response[key] for key in ('graphVersion', 'graphHash') if key in response})
+    yield json.dumps(dict({'type': 'done'}, **done_fields)) + '\n'
+
+
+def record_local_turn(conversation, user_message, current_expressions, response):
+    """Add a turn answered without the model to the session's conversation"""
+    with conversation.lock:
+        turn = conversation.prepare(user_message, current_expressions, format_graph_state(current_expressions))
+        conversation.commit(turn, json.dumps(response))
+
+
+def lookup_cached_response(user_message, session_id, history, current_expressions):
+    """Return (cache_key, cached_response); cache_key is None when the turn must bypass the cache"""
+    # Follow-ups like "make it red" depend on earlier turns, which are not part of the key
+    if depends_on_history(user_message, history):
+        response_cache.record_bypass()
+        return None, None
+    
+    cache_key = response_key(user_message, current_expressions, session_store.document_id(session_id), PROMPT_FINGERPRINT)
+    return cache_key, response_cache.get(cache_key)
+
+
+def read_chat_request():
+    """Read and log the JSON body shared by the chat endpoints"""
+    return parse_chat_request(request.get_json())
+
+
+def parse_chat_request(data):
+    """Unpack and log a chat request body.
+    
+    Clients that are in sync send graphHash instead of currentExpressions; the
+    expressions then come from the server's copy of the graph. If the hash does
+    not match, current_expressions is None and the client has to resend them.
+    """
+    user_message = data.get('message', '')
+    session_id = data.get('sessionId', 'default')
+    history = data.get('history', [])
+    # Assistant replies in the client's whole history, which may be longer than what it sends
+    reply_count = data.get('replyCount')
+    current_expressions = data.get('currentExpressions')
+    graph_hash = data.get('graphHash')
+    
+    graph = graph_states.get_or_create(session_id)
+    if current_expressions is not None or not graph_hash:
+        current_expressions = current_expressions or []
+        graph.replace(current_expressions)
+        source = 'client'
+    elif graph_hash == graph.hash:
+        current_expressions = graph.expressions()
+        source = f'server v{graph.version}'
+    else:
+        source = f'out of sync (client {graph_hash}, server {graph.hash})'
+    
+    if VERBOSE_LOGGING:
+        print(f"\n=== NEW CHAT REQUEST ===")
+        print(f"User message: {user_message}")
+        print(f"Graph state: {source}")
+        if current_expressions:
+            print(f"Current expressions count: {len(current_expressions)}")
+            for expr in current_expressions:
+                print(f"  - {expr.get('id')}: {expr.get('latex')}")
+        print(f"========================\n")
+    
+    return user_message, session_id, history, current_expressions, graph, reply_count
+
+
+GRAPH_RESYNC_BODY = {
+    'chatResponse': '',
+    'graphCommands': [],
+    'resync': True,
+    'error': 'Graph state out of sync, resend currentExpressions'
+}
+
+
+def graph_resync_response():
+    return jsonify(GRAPH_RESYNC_BODY), 409
+
+
+def busy_body(busy):
+    """(response body, seconds until retry) for a chat turn refused by upstream admission control"""
+    retry_after = math.ceil(busy.retry_after)
+    print(f"Upstream busy ({busy.reason}): {busy}")
+    return {
+        'chatResponse': f"Axiom Canvas is handling a lot of requests right now. Please try again in {retry_after} s.",
+        'graphCommands': [],
+        'retryAfter': retry_after
+    }, retry_after
+
+
+def busy_response(busy):
+    body, retry_after = busy_body(busy)
+    return jsonify(body), 503, {'Retry-After': str(retry_after)}
+
+
+def validate_graph_commands(commands):
+    """Repair graph commands whose latex breaks the Desmos syntax rules, dropping those that cannot be repaired"""
+    if not latex_validator or not commands:
+        return commands
+    with stage('latex_check'):
+        commands, report = latex_validator.repair_commands(commands)
+    LATEX_EXPRESSIONS.inc(report['checked'] - report['repaired'] - report['dropped'], result='valid')
+    LATEX_EXPRESSIONS.inc(report['repaired'], result='repaired')
+    LATEX_EXPRESSIONS.inc(report['dropped'], result='dropped')
+    for rule, hits in report['rules'].items():
+        LATEX_RULE_HITS.inc(hits, rule=rule)
+    if report['rules']:
+        print(f"latex_repair {json.dumps(report)}")
+    return commands
+
+
+def apply_graph_commands(graph, response):
+    """Compact a response's graph commands, apply them to the session graph, and add sync fields"""
+    commands = response['graphCommands']
+    with stage('graph_apply'):
+        compacted = compact_commands(commands, graph.ids())
+        graph.apply(compacted)
+    if len(compacted) != len(commands):
+        print(f"Compacted {len(commands)} graph commands to {len(compacted)}")
+    return dict(response, graphCommands=compacted, **graph.sync_fields())
+
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
-    """Handle chat messages and return AI responses with graph commands"""
+    """Handle chat messages and return AI response with graph commands"""
+    g.stage_timer = timer = StageTimer('chat')
+    outcome = 'error'
     try:
-        if not model:
+        if not MODEL_CONFIGURED:
             return jsonify({
                 'chatResponse': 'Error: Gemini API key not configured. Please set GEMINI_API_KEY environment variable.',
                 'graphCommands': []
             }), 500
         
-        data = request.get_json()
-        user_message = data.get('message', '')
-        session_id = data.get('sessionId', 'default')
-        history = data.get('history', [])
-        current_expressions = data.get('currentExpressions', [])
-        
-        print(f"\n=== NEW CHAT REQUEST ===")
-        print(f"User message: {user_message}")
-        print(f"Current expressions count: {len(current_expressions)}")
-        if current_expressions:
-            for expr in current_expressions:
-                print(f"  - {expr.get('id')}: {expr.get('latex')}")
-        print(f"========================\n")
+        with stage('read_request'):
+            user_message, session_id, history, current_expressions, graph, reply_count = read_chat_request()
         
         if not user_message:
+            outcome = 'invalid'
             return jsonify({
                 'chatResponse': 'Please provide a message.',
                 'graphCommands': []
             }), 400
         
-        # Build conversation context
-        conversation_context = []
+        if current_expressions is None:
+            outcome = 'resync'
+            return graph_resync_response()
         
-        # Add system prompt
-        conversation_context.append({
-            'role': 'user',
-            'parts': [SYSTEM_PROMPT]
-        })
-        conversation_context.append({
-            'role': 'model',
-            'parts': ['I understand. I will always respond with valid JSON containing chatResponse and graphCommands.']
-        })
-        
-        # Add current graph state if expressions exist
-        if current_expressions:
-            expr_list = "\n".join([f"- ID: '{expr['id']}', Expression: {expr['latex']}" for expr in current_expressions])
-            conversation_context.append({
-                'role': 'user',
-                'parts': [f"CURRENT GRAPH STATE - These expressions are currently plotted:\n{expr_list}\n\nUse these exact IDs if you need to remove or modify any of these expressions."]
-            })
-            conversation_context.append({
-                'role': 'model',
-                'parts': ['Understood. I can see the current expressions and will use the correct IDs for any modifications.']
-            })
-        else:
-            conversation_context.append({
-                'role': 'user',
-                'parts': ["CURRENT GRAPH STATE: The graph is currently empty."]
-            })
-            conversation_context.append({
-                'role': 'model',
-                'parts': ['Understood. The graph is blank and ready for new expressions.']
-            })
+        conversation = open_conversation(session_id, history, user_message, reply_count)
         
-        # Check if we have RAG context for this session
-        rag_context = ""
-        if session_id in session_data and 'faiss_index' in session_data[session_id]:
-            try:
-                rag_context = retrieve_relevant_context(session_id, user_message)
-                if rag_context:
-                    conversation_context.append({
-                        'role': 'user',
-                        'parts': [f"Context from uploaded PDF:\n\n{rag_context}"]
-                    })
-                    conversation_context.append({
-                        'role': 'model',
-                        'parts': ['I will use this context to answer questions.']
-                    })
-            except Exception as e:
-                print(f"Error retrieving RAG context: {e}")
-        
-        # Add recent conversation history (limited to avoid context overflow)
-        # Only include last 6 messages (3 exchanges) to keep context manageable
-        recent_history = history[-6:] if len(history) > 6 else history
-        for msg in recent_history:
-            role = 'user' if msg['role'] == 'user' else 'model'
-            conversation_context.append({
-                'role': role,
-                'parts': [msg['content']]
-            })
+        # Simple graph commands ("plot y=2x+1", "clear the graph") never need the model
+        with stage('fast_path'):
+            local_response = parse_local_command(user_message, current_expressions) if FAST_PATH_ENABLED else None
+        if local_response:
+            print("Handled by local fast path")
+            record_local_turn(conversation, user_message, current_expressions, local_response)
+            outcome = 'fast_path'
+            return jsonify(dict(apply_graph_commands(graph, local_response), fastPath=True))
         
-        print(f"Context length: {len(conversation_context)} messages")
+        # Identical requests against the same graph and document are served from the cache
+        with stage('cache_lookup'):
+            cache_key, cached_response = lookup_cached_response(user_message, session_id, history, current_expressions)
+        if cached_response:
+            print("Response cache hit")
+            record_local_turn(conversation, user_message, current_expressions, cached_response)
+            outcome = 'cached'
+            return jsonify(dict(apply_graph_commands(graph, cached_response), cached=True))
         
-        # Add current user message
-        conversation_context.append({
-            'role': 'user',
-            'parts': [user_message]
-        })
-        
-        # Generate response
-        try:
-            chat_session = model.start_chat(history=conversation_context[:-1])
-            response = chat_session.send_message(user_message)
-        except Exception as api_error:
-            print(f"ERROR calling Gemini API: {api_error}")
-            return jsonify({
-                'chatResponse': f"Sorry, there was an error communicating with the AI: {str(api_error)}",
-                'graphCommands': []
-            })
-        
-        # Parse the response
-        response_text = response.text.strip() if response and response.text else ""
+        # One turn at a time per session, so the stored history stays in order
+        with conversation.lock:
+            # Send only the new message and graph changes on top of the stored conversation
+            with stage('context'):
+                turn = prepare_turn(conversation, user_message, session_id, history, current_expressions)
+            
+            # Generate response
+            try:
+                with stage('model'):
+                    response, shared = chat_calls.do(model_call_key(turn), lambda: upstream.call(
+                        'generate', 'interactive',
+                        lambda: get_chat_model().start_chat(history=turn.history).send_message(turn.message)
+                    ))
+                if shared:
+                    print("Shared an identical model call already in flight")
+            except UpstreamBusy as busy:
+                outcome = 'shed'
+                return busy_response(busy)
+            except Exception as api_error:
+                print(f"ERROR calling Gemini API: {api_error}")
+                outcome = 'model_error'
+                return jsonify({
+                    'chatResponse': f"Sorry, there was an error communicating with the AI: {str(api_error)}",
+                    'graphCommands': []
+                })
+            
+            # Parse the response
+            response_text = response.text.strip() if response and response.text else ""
+            if response_text:
+                conversation.commit(turn, response_text)
         
-        print(f"\n=== RAW AI RESPONSE ===")
-        print(f"Response object: {response}")
-        print(f"Response text length: {len(response_text)}")
-        print(f"Response text: {response_text[:1000] if response_text else 'EMPTY!'}")
-        print(f"======================\n")
+        MODEL_TOKENS.inc(estimate_tokens(response_text), direction='output')
+        if VERBOSE_LOGGING:
+            print(f"\n=== RAW AI RESPONSE ===")
+            print(f"Response object: {response}")
+            print(f"Response text length: {len(response_text)}")
+            print(f"Response text: {response_text[:1000] if response_text else 'EMPTY!'}")
+            print(f"======================\n")
         
         # Check if response is empty
         if not response_text:
             print("ERROR: AI returned empty response!")
+            outcome = 'empty'
             return jsonify({
                 'chatResponse': "I apologize, but I didn't generate a proper response. Please try rephrasing your question.",
                 'graphCommands': []
             })
         
-        # Try to extract JSON from the response
-        # Sometimes the model wraps JSON in markdown code blocks
-        if '```json' in response_text:
-            json_start = response_text.find('```json') + 7
-            json_end = response_text.find('```', json_start)
-            response_text = response_text[json_start:json_end].strip()
-        elif '```' in response_text:
-            json_start = response_text.find('```') + 3
-            json_end = response_text.find('```', json_start)
-            response_text = response_text[json_start:json_end].strip()
-        
-        # Try to find JSON object if the response contains other text
-        if response_text.startswith('{'):
-            # Already looks like JSON
-            pass
-        elif '{' in response_text:
-            # Extract JSON from mixed content
-            json_start = response_text.find('{')
-            json_end = response_text.rfind('}') + 1
-            if json_end > json_start:
-                response_text = response_text[json_start:json_end]
-            else:
-                print("ERROR: Could not find valid JSON brackets")
-                return jsonify({
-                    'chatResponse': response_text,
-                    'graphCommands': []
+        with stage('parse'):
+            chat_response, graph_commands, parsed = parse_ai_response(response_text)
+        graph_commands = validate_graph_commands(graph_commands)
+        result = apply_graph_commands(graph, {
+            'chatResponse': chat_response,
+            'graphCommands': graph_commands
+        })
+        
+        if parsed and cache_key:
+            with stage('cache_store'):
+                response_cache.put(cache_key, {
+                    'chatResponse': chat_response,
+                    'graphCommands': result['graphCommands']
                 })
-        else:
-            print("ERROR: No JSON found in response")
+        
+        outcome = 'model' if parsed else 'unparsed'
+        return jsonify(result)
+        
+    except Exception as e:
+        print(f"Error in chat endpoint: {e}")
+        traceback.print_exc()
+        return jsonify({
+            'chatResponse': f'An error occurred: {str(e)}',
+            'graphCommands': []
+        }), 500
+    finally:
+        finish_timing(timer, outcome)
+
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Stream chat responses as NDJSON, emitting each graph command as soon as it is complete"""
+    g.stage_timer = timer = StageTimer('chat_stream')
+    outcome = 'error'
+    streaming = False
+    try:
+        if not MODEL_CONFIGURED:
             return jsonify({
-                'chatResponse': response_text if response_text else "I couldn't generate a proper response.",
+                'chatResponse': 'Error: Gemini API key not configured. Please set GEMINI_API_KEY environment variable.',
                 'graphCommands': []
-            })
+            }), 500
         
-        if not response_text or response_text == '':
-            print("ERROR: Extracted text is empty")
+        with stage('read_request'):
+            user_message, session_id, history, current_expressions, graph, reply_count = read_chat_request()
+        
+        if not user_message:
+            outcome = 'invalid'
             return jsonify({
-                'chatResponse': "Sorry, I had trouble generating a response. Please try again.",
+                'chatResponse': 'Please provide a message.',
                 'graphCommands': []
-            })
+            }), 400
+        
+        if current_expressions is None:
+            outcome = 'resync'
+            return graph_resync_response()
+        
+        conversation = open_conversation(session_id, history, user_message, reply_count)
+        
+        with stage('fast_path'):
+            local_response = parse_local_command(user_message, current_expressions) if FAST_PATH_ENABLED else None
+        if local_response:
+            print("Handled by local fast path")
+            record_local_turn(conversation, user_message, current_expressions, local_response)
+            local_response = apply_graph_commands(graph, local_response)
+            outcome = 'fast_path'
+            return Response(count_stream_bytes(replay_response(local_response, fastPath=True), 'chat_stream'),
+                            mimetype='application/x-ndjson')
+        
+        with stage('cache_lookup'):
+            cache_key, cached_response = lookup_cached_response(user_message, session_id, history, current_expressions)
+        if cached_response:
+            print("Response cache hit")
+            record_local_turn(conversation, user_message, current_expressions, cached_response)
+            cached_response = apply_graph_commands(graph, cached_response)
+            outcome = 'cached'
+            return Response(count_stream_bytes(replay_response(cached_response, cached=True), 'chat_stream'),
+                            mimetype='application/x-ndjson')
+        
+        # The response starts before the model call, so refuse now if the turn would only be shed later
+        try:
+            upstream.check('generate', 'interactive')
+        except UpstreamBusy as busy:
+            outcome = 'shed'
+            return busy_response(busy)
         
-        print(f"\n=== EXTRACTED JSON ===")
-        print(response_text[:500])  # Print first 500 chars
-        print(f"======================\n")
+        # The generator finishes the timing once the stream is done
+        streaming = True
+    finally:
+        if not streaming:
+            finish_timing(timer, outcome)
+    
+    def generate():
+        parser = StreamingResponseParser()
+        # Streamed commands after latex repair, which is what gets cached
+        commands_sent = []
+        stream_outcome = 'error'
         
-        # Parse JSON - try with fixing common LaTeX escape issues
         try:
-            parsed_response = json.loads(response_text)
-            chat_response = parsed_response.get('chatResponse', '')
-            graph_commands = parsed_response.get('graphCommands', [])
+            # Held until the stream finishes so the turn is committed before the next one starts
+            with conversation.lock:
+                with stage('context'):
+                    turn = prepare_turn(conversation, user_message, session_id, history, current_expressions)
+                
+                response = None
+                try:
+                    with stage('model_first_chunk'):
+                        response, shared = chat_streams.stream(model_call_key(turn), lambda: upstream.stream(
+                            'generate', 'interactive',
+                            lambda: get_chat_model().start_chat(history=turn.history).send_message(turn.message, stream=True)
+                        ))
+                    if shared:
+                        print("Shared an identical model stream already in flight")
+                    
+                    # Only time spent waiting on the model counts, not time spent sending to the client
+                    for chunk in timer.timed_iter('model_stream', response):
+                        try:
+                            text = chunk.text
+                        except ValueError:
+                            # Chunks without text parts (e.g. safety metadata only)
+                            continue
+                        for event in parser.feed(text):
+                            if event['type'] == 'graphCommand':
+                                commands = validate_graph_commands([event['graphCommand']])
+                                if not commands:
+                                    continue
+                                event = dict(event, graphCommand=commands[0])
+                                # Streamed commands go out as soon as they close, so they are applied but not compacted
+                                graph.apply(commands)
+                                commands_sent.append(commands[0])
+                            yield json.dumps(event) + '\n'
+                except UpstreamBusy as busy:
+                    stream_outcome = 'shed'
+                    body, retry_after = busy_body(busy)
+                    yield json.dumps({'type': 'error', 'error': body['chatResponse'], 'retryAfter': retry_after}) + '\n'
+                    return
+                except Exception as api_error:
+                    print(f"ERROR streaming from Gemini API: {api_error}")
+                    stream_outcome = 'model_error'
+                    yield json.dumps({
+                        'type': 'error',
+                        'error': f"Sorry, there was an error communicating with the AI: {str(api_error)}"
+                    }) + '\n'
+                    return
+                finally:
+                    # A client that disconnected stops reading here; the last reader closes the model stream
+                    if response is not None:
+                        response.close()
+                
+                response_text = parser.buffer.strip()
+                if response_text:
+                    conversation.commit(turn, response_text)
             
-            print(f"\n=== PARSED SUCCESSFULLY ===")
-            print(f"Chat response length: {len(chat_response)}")
-            print(f"Graph commands count: {len(graph_commands)}")
-            print(f"===========================\n")
+            MODEL_TOKENS.inc(estimate_tokens(response_text), direction='output')
+            if VERBOSE_LOGGING:
+                print(f"\n=== RAW AI RESPONSE (stream) ===")
+                print(f"Response text length: {len(response_text)}")
+                print(f"Response text: {response_text[:1000] if response_text else 'EMPTY!'}")
+                print(f"Graph commands streamed: {len(commands_sent)}")
+                print(f"================================\n")
             
-        except json.JSONDecodeError as e:
-            print(f"\n=== JSON PARSE ERROR (trying fix) ===")
-            print(f"Error: {e}")
+            stream_outcome = 'model'
+            if not response_text:
+                print("ERROR: AI returned empty response!")
+                stream_outcome = 'empty'
+                yield json.dumps({
+                    'type': 'chatResponse',
+                    'chatResponse': "I apologize, but I didn't generate a proper response. Please try rephrasing your question."
+                }) + '\n'
+            elif parser.chat_response is None:
+                # The stream never produced a well-formed chatResponse - fall back to the full parser
+                with stage('parse'):
+                    chat_response, graph_commands, _ = parse_ai_response(response_text)
+                stream_outcome = 'unparsed'
+                yield json.dumps({'type': 'chatResponse', 'chatResponse': chat_response}) + '\n'
+                if not commands_sent:
+                    graph_commands = validate_graph_commands(graph_commands)
+                    graph_commands = apply_graph_commands(graph, {'graphCommands': graph_commands})['graphCommands']
+                    for command in graph_commands:
+                        yield json.dumps({'type': 'graphCommand', 'graphCommand': command}) + '\n'
+            elif parser.complete and cache_key:
+                with stage('cache_store'):
+                    response_cache.put(cache_key, {
+                        'chatResponse': parser.chat_response,
+                        'graphCommands': commands_sent
+                    })
             
-            # Try to fix LaTeX backslash escaping issues
-            # The AI sometimes generates single backslashes in LaTeX which need to be doubled for valid JSON
-            try:
-                # Simple approach: escape all backslashes
-                # In valid JSON, all backslashes should already be escaped, so single backslashes are errors
-                fixed_text = response_text.replace('\\', '\\\\')
-                
-                print(f"Attempting to parse with escaped backslashes...")
-                parsed_response = json.loads(fixed_text)
-                chat_response = parsed_response.get('chatResponse', '')
-                graph_commands = parsed_response.get('graphCommands', [])
-                
-                print(f"\n=== PARSED WITH FIX ===")
-                print(f"Chat response length: {len(chat_response)}")
-                print(f"Graph commands count: {len(graph_commands)}")
-                print(f"=======================\n")
-                
-            except Exception as fix_error:
-                print(f"Fix also failed: {fix_error}")
-                print(f"========================================\n")
-                # Last resort: return as text
-                chat_response = response_text
-                graph_commands = []
-        
-        return jsonify({
-            'chatResponse': chat_response,
-            'graphCommands': graph_commands
-        })
-        
-    except Exception as e:
-        print(f"Error in chat endpoint: {e}")
-        traceback.print_exc()
-        return jsonify({
-            'chatResponse': f'An error occurred: {str(e)}',
-            'graphCommands': []
-        }), 500
+            yield json.dumps(dict({'type': 'done'}, **graph.sync_fields())) + '\n'
+        finally:
+            finish_timing(timer, stream_outcome)
+    
+    return Response(stream_with_context(count_stream_bytes(generate(), 'chat_stream')), mimetype='application/x-ndjson')
 
 
 @app.route('/api/upload_pdf', methods=['POST'])
 def upload_pdf():
-    """Handle PDF upload and process it for RAG"""
+    """Handle PDF upload and queue it for RAG processing; returns a job ID to poll"""
+    g.stage_timer = timer = StageTimer('upload_pdf')
+    outcome = 'error'
     try:
         if not PDF_SUPPORT:
             return jsonify({
@@ -481,42 +1132,77 @@ def upload_pdf():
                 'error': 'No file selected'
             }), 400
         
-        # Save PDF to temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            pdf_file.save(tmp_file.name)
-            pdf_path = tmp_file.name
+        with stage('read_upload'):
+            pdf_bytes = pdf_file.read()
         
-        try:
-            # Extract text from PDF
-            text_chunks = extract_text_from_pdf(pdf_path)
-            
-            if not text_chunks:
+        # Reuse the finished index if this exact document was processed before
+        with stage('document_cache'):
+            document_key = embedding_store.content_hash(pdf_bytes, EMBEDDING_MODEL, DOCUMENT_PIPELINE_VERSION)
+            latest_job = ingest_jobs.latest(session_id, document_key)
+            if latest_job and latest_job['status'] not in ('done', 'failed'):
+                # The same PDF is being indexed for this session already; report that job
+                outcome = 'running'
                 return jsonify({
-                    'success': False,
-                    'error': 'No text extracted from PDF'
-                }), 400
-            
-            # Generate embeddings and create FAISS index
-            embeddings, chunks = create_embeddings(text_chunks)
-            index = create_faiss_index(embeddings)
-            
-            # Store in session data
-            if session_id not in session_data:
-                session_data[session_id] = {}
-            
-            session_data[session_id]['faiss_index'] = index
-            session_data[session_id]['text_chunks'] = chunks
-            session_data[session_id]['pdf_name'] = pdf_file.filename
-            
+                    'success': True,
+                    'message': 'PDF is already being processed',
+                    'jobId': latest_job['jobId'],
+                    'status': latest_job['status']
+                }), 202
+            session_index = session_store.get(session_id)
+            indexed = None
+            cached_document = None
+            chunk_count = None
+            if session_index and session_index.has_document(document_key):
+                indexed_count = session_index.documents[document_key]['chunks']
+                if latest_job:
+                    complete = latest_job['status'] == 'done'
+                else:
+                    # No job record left; only complete documents have a document cache entry
+                    cached = get_document_cache().get(document_key)
+                    complete = cached is not None and len(cached[1]) == indexed_count
+                # Already in this session: done if complete, otherwise indexed again for the missing chunks
+                if complete:
+                    chunk_count = indexed_count
+                else:
+                    indexed = indexed_document(session_index, document_key)
+            else:
+                cached_document = get_document_cache().get(document_key)
+        if cached_document:
+            index, chunks = cached_document
+            chunk_count = len(chunks)
+            print(f"Document cache hit for {pdf_file.filename} ({chunk_count} chunks)")
+            with stage('index'):
+                add_session_document(session_id, vector_index.all_vectors(index), chunks, pdf_file.filename, document_key)
+        if chunk_count is not None:
+            job = ingest_jobs.create(session_id, pdf_file.filename, document_key)
+            job.update(status='done', chunksExtracted=chunk_count, chunksEmbedded=chunk_count, queryable=True, cached=True)
+            outcome = 'cached'
             return jsonify({
                 'success': True,
-                'message': f'Successfully processed {len(chunks)} text chunks',
-                'chunks': len(chunks)
+                'message': f'Successfully processed {chunk_count} text chunks (cached)',
+                'jobId': job.job_id,
+                'status': 'done',
+                'chunks': chunk_count,
+                'cached': True
             })
-            
-        finally:
-            # Clean up temporary file
-            os.unlink(pdf_path)
+        
+        # Save PDF to temporary file; the ingest job deletes it when finished
+        with stage('spool'):
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
+                tmp_file.write(pdf_bytes)
+                pdf_path = tmp_file.name
+        
+        # Extract, embed and index in the background so the request returns right away
+        job = ingest_jobs.create(session_id, pdf_file.filename, document_key)
+        ingest_jobs.submit(job, run_ingest_job, pdf_path, document_key, indexed)
+        
+        outcome = 'queued'
+        return jsonify({
+            'success': True,
+            'message': 'PDF queued for processing',
+            'jobId': job.job_id,
+            'status': 'queued'
+        }), 202
         
     except Exception as e:
         print(f"Error in upload_pdf endpoint: {e}")
@@ -525,86 +1211,345 @@ def upload_pdf():
             'success': False,
             'error': str(e)
         }), 500
+    finally:
+        finish_timing(timer, outcome)
 
 
-def extract_text_from_pdf(pdf_path, chunk_size=1000, overlap=200):
-    """Extract text from PDF and split into chunks"""
-    doc = fitz.open(pdf_path)
-    chunks = []
+@app.route('/api/upload_status/<job_id>', methods=['GET'])
+def upload_status(job_id):
+    """Report progress of a PDF ingestion job"""
+    job = ingest_jobs.status(job_id)
+    if not job:
+        return jsonify({
+            'success': False,
+            'error': 'Unknown job ID'
+        }), 404
+    
+    return jsonify(dict(job, success=True))
+
+
+def indexed_document(session_index, document_key):
+    """(name, {(page, text)}) of a document's chunks already in a session's index"""
+    name = session_index.documents[document_key]['name']
+    return name, {(chunk['page'], chunk['text']) for chunk in session_index.chunks if chunk.get('document') == name}
+
+
+def run_ingest_job(job, pdf_path, document_key, indexed=None):
+    """Extract, embed and index a PDF, publishing a partial index after each embedded group.
+
+    indexed is indexed_document() for a document an earlier, incomplete run added to the
+    session in part; its chunks are embedded again (from the embedding cache) but not added twice.
+    """
+    document_name, indexed_keys = indexed or (job.pdf_name, set())
+    # Runs outside any request, so stages are timed on this job's own timer
+    timer = StageTimer('ingest')
+    outcome = 'failed'
     
-    full_text = ""
-    for page in doc:
-        full_text += page.get_text()
+    # One group keeps every embedding batch in flight busy
+    group_size = EMBED_BATCH_SIZE * EMBED_CONCURRENCY
+    vector_groups = []
+    indexed_chunks = []
+    pending = []
+    extracted = 0
     
-    # Split into chunks with overlap
-    for i in range(0, len(full_text), chunk_size - overlap):
-        chunk = full_text[i:i + chunk_size]
-        if chunk.strip():
-            chunks.append(chunk)
+    def index_pending():
+        with timer.stage('embed'):
+            embeddings, chunks = create_embeddings(pending)
+        pending.clear()
+        if not chunks:
+            return
+        vector_groups.append(embeddings)
+        indexed_chunks.extend(chunks)
+        new = [i for i, chunk in enumerate(chunks) if (chunk['page'], chunk['text']) not in indexed_keys]
+        # Added in place to the session's index, so earlier documents and groups stay searchable
+        if new:
+            with timer.stage('index'):
+                add_session_document(job.session_id, embeddings[new], [chunks[i] for i in new], document_name, document_key)
+        job.update(status='embedding', chunksEmbedded=len(indexed_chunks), queryable=True)
     
-    return chunks
+    try:
+        with fitz.open(pdf_path) as doc:
+            job.update(status='extracting', pagesTotal=doc.page_count)
+        
+        for chunk in timer.timed_iter('extract', pdf_chunker.iter_chunks(pdf_path, workers=PDF_EXTRACT_WORKERS)):
+            pending.append(chunk)
+            extracted += 1
+            job.update(pagesParsed=chunk['page'], chunksExtracted=extracted)
+            if len(pending) >= group_size:
+                index_pending()
+        
+        job.update(pagesParsed=job.get('pagesTotal'))
+        if pending:
+            index_pending()
+        
+        if not indexed_chunks:
+            error = 'No text extracted from PDF' if not extracted else 'Failed to generate embeddings'
+            job.update(status='failed', error=error)
+            return
+        
+        embeddings = np.vstack(vector_groups)
+        with timer.stage('cache_write'):
+            cache_chunk_embeddings(indexed_chunks, embeddings)
+            # Every later upload of this PDF reuses the document cache entry, so only a complete index goes there
+            if len(indexed_chunks) == extracted:
+                try:
+                    get_document_cache().put(document_key, create_faiss_index(embeddings), indexed_chunks)
+                except Exception as e:
+                    print(f"Error writing document cache: {e}")
+        
+        if len(indexed_chunks) < extracted:
+            print(f"Ingest job {job.job_id} indexed {len(indexed_chunks)} of {extracted} chunks from {job.pdf_name}")
+            job.update(status='failed', error=f"Only {len(indexed_chunks)} of {extracted} chunks could be embedded; "
+                                              f"upload the PDF again to index the rest")
+            outcome = 'partial'
+            return
+        
+        print(f"Ingest job {job.job_id} finished: {len(indexed_chunks)} chunks from {job.pdf_name}")
+        job.update(status='done')
+        outcome = 'done'
+    finally:
+        if outcome not in ('done', 'partial') and indexed_chunks:
+            # Keep what was embedded, so uploading the PDF again only embeds the rest
+            cache_chunk_embeddings(indexed_chunks, np.vstack(vector_groups))
+        # Clean up temporary file
+        os.unlink(pdf_path)
+        finish_timing(timer, outcome)
+
+
+@app.route('/api/cache_stats', methods=['GET'])
+def cache_stats():
+    """Report hit/miss counters and sizes for the embedding, document, query and response caches,
+    and how many upstream calls were shared with identical ones in flight"""
+    coalescing = {flights.kind: flights.stats() for flights in (chat_calls, chat_streams, embedding_calls)}
+    if not PDF_SUPPORT:
+        return jsonify({'embeddings': None, 'documents': None, 'queries': query_embeddings.stats(),
+                        'responses': response_cache.stats(), 'coalescing': coalescing})
+    
+    return jsonify({
+        'embeddings': get_embedding_cache().stats(),
+        'documents': get_document_cache().stats(),
+        'queries': query_embeddings.stats(),
+        'responses': response_cache.stats(),
+        'coalescing': coalescing
+    })
+
+
+@app.route('/api/conversation_stats/<session_id>', methods=['GET'])
+def conversation_stats(session_id):
+    """Report estimated input tokens per turn for a session's conversation"""
+    conversation = conversations.get(session_id)
+    if not conversation:
+        return jsonify({'success': False, 'error': 'Unknown session'}), 404
+    
+    turns = list(conversation.turn_stats)
+    return jsonify({
+        'success': True,
+        'storedMessages': len(conversation.turns),
+        'summary': {
+            'tokens': estimate_tokens(conversation.summary),
+            'summarizedMessages': conversation.summarized_messages,
+            'pending': conversation.summarizing
+        },
+        'turns': turns,
+        'totalSavedTokens': sum(t['savedTokens'] for t in turns)
+    })
+
+
+@app.route('/api/session_stats', methods=['GET'])
+def session_stats():
+    """Report resident bytes per session and spill/reload counters"""
+    return jsonify(session_store.stats())
+
+
+@app.route('/api/upstream_stats', methods=['GET'])
+def upstream_stats():
+    """Report upstream calls in flight and queued by kind and priority, bucket state, and refusals"""
+    return jsonify(upstream.stats())
+
+
+@app.route('/api/latex_stats', methods=['GET'])
+def latex_stats():
+    """Report how often graphCommands latex broke each Desmos syntax rule, and repairs and drops"""
+    if not latex_validator:
+        return jsonify({'enabled': False})
+    return jsonify(dict(latex_validator.stats(), enabled=True))
+
+
+def new_session_index():
+    return vector_index.SessionIndex(VECTOR_INDEX_FLAT_MAX, VECTOR_INDEX_HNSW_MAX)
+
+
+def add_session_document(session_id, vectors, chunks, pdf_name, document_key):
+    """Add a document's chunks (or the next group of them) to the session's index for RAG"""
+    # Looked up on every call: the session may have been spilled and reloaded, or written by another worker
+    session_store.add(session_id, vectors, chunks, document_key, pdf_name)
+
+
+def extract_text_from_pdf(pdf_path, chunk_size=1000, overlap=200):
+    """Extract text from PDF page by page and split it into {'text', 'page'} chunks"""
+    return list(pdf_chunker.iter_chunks(pdf_path, chunk_size=chunk_size, overlap=overlap, workers=PDF_EXTRACT_WORKERS))
+
+
+def embed_document_batch(batch):
+    """Embed a list of chunks with one batched Gemini call"""
+    # Use Gemini's embedding model
+    result = upstream.call('embed', 'bulk', lambda: backend.embed_content(
+        model=EMBEDDING_MODEL,
+        content=batch,
+        task_type="retrieval_document"
+    ))
+    return result['embedding']
 
 
 def create_embeddings(text_chunks):
-    """Generate embeddings using Gemini"""
-    if not model:
+    """Generate embeddings using Gemini, batching chunks and running batches concurrently"""
+    if not MODEL_CONFIGURED:
         raise Exception("Gemini API not configured")
     
+    # The same handout uploaded to several sessions at once is split into the same groups of
+    # chunks, so concurrent ingest jobs share one embedding run per group
+    texts = [chunk['text'] for chunk in text_chunks]
+    group_key = hashlib.sha256('\0'.join([EMBEDDING_MODEL] + texts).encode('utf-8')).hexdigest()
+    vectors, shared = embedding_calls.do(group_key, lambda: embed_texts(texts))
+    if shared:
+        print(f"Shared the embedding of {len(texts)} chunks with an ingest job already running")
+    
+    # Chunks whose embedding failed are dropped, keeping valid_chunks aligned with the vectors
     embeddings = []
     valid_chunks = []
-    
-    for chunk in text_chunks:
-        try:
-            # Use Gemini's embedding model
-            result = genai.embed_content(
-                model="models/embedding-001",
-                content=chunk,
-                task_type="retrieval_document"
-            )
-            embeddings.append(result['embedding'])
+    for chunk, vector in zip(text_chunks, vectors):
+        if vector is not None:
+            embeddings.append(vector)
             valid_chunks.append(chunk)
-        except Exception as e:
-            print(f"Error generating embedding: {e}")
-            continue
     
     return np.array(embeddings, dtype='float32'), valid_chunks
 
 
+def embed_texts(texts):
+    """One vector per text (None where embedding failed), from the embedding cache or the API"""
+    embedding_cache = get_embedding_cache()
+    # Look every chunk up in the embedding cache before calling the API
+    keys = [embedding_cache.key(EMBEDDING_MODEL, "retrieval_document", text) for text in texts]
+    vectors = {}
+    missing = []
+    for text, key, vector in zip(texts, keys, embedding_cache.get_many(keys)):
+        if key in vectors:
+            continue
+        vectors[key] = vector
+        if vector is None:
+            missing.append(text)
+    
+    print(f"Embedding cache: {len(texts) - len(missing)} cached, {len(missing)} to embed")
+    EMBEDDED_CHUNKS.inc(len(texts) - len(missing), source='cache')
+    
+    new_embeddings, embedded_chunks = embed_in_batches(
+        missing,
+        embed_document_batch,
+        batch_size=EMBED_BATCH_SIZE,
+        max_workers=EMBED_CONCURRENCY
+    )
+    EMBEDDED_CHUNKS.inc(len(embedded_chunks), source='api')
+    for chunk, vector in zip(embedded_chunks, new_embeddings):
+        vectors[embedding_cache.key(EMBEDDING_MODEL, "retrieval_document", chunk)] = vector
+    
+    return [vectors[key] for key in keys]
+
+
+def cache_chunk_embeddings(chunks, embeddings):
+    """Store a document's chunk vectors in the embedding cache, as one entry for the whole document"""
+    embedding_cache = get_embedding_cache()
+    keys = [embedding_cache.key(EMBEDDING_MODEL, "retrieval_document", chunk['text']) for chunk in chunks]
+    try:
+        embedding_cache.put_many(keys, embeddings)
+    except OSError as e:
+        print(f"Error writing embedding cache: {e}")
+
+
 def create_faiss_index(embeddings):
-    """Create FAISS index from embeddings"""
+    """Flat FAISS index of one document's embeddings, the form kept in the document cache"""
     dimension = embeddings.shape[1]
     index = faiss.IndexFlatL2(dimension)
     index.add(embeddings)
     return index
 
 
-def retrieve_relevant_context(session_id, query, top_k=3):
-    """Retrieve relevant text chunks using FAISS"""
-    if session_id not in session_data:
-        return ""
+def embed_query(query):
+    """Query vector from the cache or the embedding API; None if the API fails, is too slow or is cooling down"""
+    key = query_embeddings.key(EMBEDDING_MODEL, query)
+    vector = query_embeddings.get(key)
+    if vector is not None:
+        QUERY_EMBEDDINGS.inc(source='cache')
+        return vector
+    if not embed_breaker.allow():
+        QUERY_EMBEDDINGS.inc(source='skipped')
+        return None
     
-    index = session_data[session_id].get('faiss_index')
-    chunks = session_data[session_id].get('text_chunks')
+    def remember(future):
+        # Also caches results that arrive after the timeout, for the next time this is asked
+        if not future.cancelled() and future.exception() is None:
+            query_embeddings.put(key, future.result()['embedding'])
     
-    if not index or not chunks:
-        return ""
-    
-    # Generate embedding for query
-    result = genai.embed_content(
-        model="models/embedding-001",
-        content=query,
-        task_type="retrieval_query"
-    )
-    query_embedding = np.array([result['embedding']], dtype='float32')
+    future = query_embed_pool.submit(upstream.call, 'embed', 'interactive', lambda: backend.embed_content(
+        model=EMBEDDING_MODEL, content=query, task_type="retrieval_query"
+    ))
+    future.add_done_callback(remember)
+    try:
+        vector = future.result(timeout=RAG_EMBED_TIMEOUT)['embedding']
+    except Exception as e:
+        embed_breaker.record_failure()
+        QUERY_EMBEDDINGS.inc(source='failed')
+        print(f"Query embedding failed ({type(e).__name__}: {e}); retrieving lexically for {embed_breaker.cooldown:.0f} s")
+        return None
+    embed_breaker.record_success()
+    QUERY_EMBEDDINGS.inc(source='api')
+    return vector
+
+
+def retrieve_relevant_context(session_id, query, top_k=3):
+    """Retrieve relevant text chunks, best first, from every document in the session's index"""
+    # Reloads the session from disk if it was evicted
+    session_index = session_store.get(session_id)
+    if not session_index or not session_index.chunks:
+        return []
     
-    # Search FAISS index
-    distances, indices = index.search(query_embedding, top_k)
+    # Without a query vector (embedding slow or down) retrieval is lexical-only
+    with stage('retrieval_embed'):
+        vector = embed_query(query)
     
-    # Retrieve relevant chunks
-    relevant_chunks = [chunks[i] for i in indices[0] if i < len(chunks)]
+    # Search every document of the session at once, fusing vector and BM25 rankings
+    with stage('faiss_search'):
+        hits = session_index.search(query, vector, top_k)
     
-    return "\n\n".join(relevant_chunks)
+    # Keep only relevant chunks, labelled with the document and page they came from
+    relevant = relevant_hits(hits, RAG_MAX_DISTANCE, RAG_MIN_BM25_SCORE)
+    mode = 'hybrid' if vector is not None else 'lexical-only'
+    print(f"RAG ({mode}): kept {len(relevant)} of {len(hits)} chunks "
+          f"({session_index.kind} index, {len(session_index.chunks)} vectors)")
+    RAG_RETRIEVALS.inc(result='context' if relevant else 'no_match')
+    return [f"[{hit['document']}, page {hit['page']}] {hit['text']}" for hit in relevant]
+
+
+@app.route('/api/startup_stats', methods=['GET'])
+def startup_stats():
+    """Report how long this instance took to import and what has been loaded lazily since"""
+    return jsonify({
+        'importMs': round(STARTUP_SECONDS * 1000, 2),
+        'lazyLoadsMs': dict(LOAD_TIMES),
+        'loaded': {
+            'genai': genai.loaded,
+            'pdf': fitz.loaded,
+            'numpy': np.loaded,
+            'faiss': faiss.loaded,
+            'chatModel': get_chat_model.loaded(),
+            'embeddingCache': get_embedding_cache.loaded(),
+            'documentCache': get_document_cache.loaded()
+        }
+    })
+
 
+# Everything above runs on every cold start; heavier work is deferred to first use
+STARTUP_SECONDS = time.perf_counter() - IMPORT_STARTED
+print(f"Startup: index imported in {STARTUP_SECONDS * 1000:.0f} ms")
 
 # For Vercel serverless deployment
 # Vercel will look for 'app' variable
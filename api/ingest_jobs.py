@@ -0,0 +1,202 @@
+"""Background job pool for PDF ingestion with pollable progress"""
+import json
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Most often a job's progress is written to a shared job store; status changes are written at once
+SAVE_INTERVAL = 0.5
+# An unfinished job in the shared store not updated for this long belongs to a worker that stopped
+STALE_SECONDS = 300
+
+
+class IngestJob:
+    """Progress record for one PDF ingestion job, safe to update from a worker thread"""
+
+    def __init__(self, session_id, pdf_name, store=None, document_key=None):
+        self.job_id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.pdf_name = pdf_name
+        self.document_key = document_key
+        # Shared job store other workers answer status polls from, if any
+        self.store = store
+        self._saved = 0.0
+        self._lock = threading.Lock()
+        self._state = {
+            'jobId': self.job_id,
+            'sessionId': session_id,
+            'pdfName': pdf_name,
+            'documentKey': document_key,
+            'status': 'queued',
+            'pagesTotal': 0,
+            'pagesParsed': 0,
+            'chunksExtracted': 0,
+            'chunksEmbedded': 0,
+            'queryable': False,
+            'cached': False,
+            'error': None,
+            'createdAt': time.time(),
+            'finishedAt': None
+        }
+        if store:
+            # Recorded before the job ID is handed out, so the first poll finds it on any worker
+            self._save()
+
+    def update(self, **fields):
+        with self._lock:
+            status_changed = fields.get('status', self._state['status']) != self._state['status']
+            self._state.update(fields)
+            if fields.get('status') in ('done', 'failed'):
+                self._state['finishedAt'] = time.time()
+            # Saved under the lock, so an older state never overwrites a newer one
+            if self.store and (status_changed or time.monotonic() - self._saved >= SAVE_INTERVAL):
+                self._save()
+
+    def _save(self):
+        try:
+            self.store.save(self.job_id, self._state)
+            self._saved = time.monotonic()
+        except sqlite3.Error as e:
+            print(f"Error saving ingest job {self.job_id}: {e}")
+
+    def get(self, field):
+        with self._lock:
+            return self._state[field]
+
+    @property
+    def finished(self):
+        return self.get('status') in ('done', 'failed')
+
+    def to_dict(self):
+        with self._lock:
+            return dict(self._state)
+
+
+class IngestJobManager:
+    """Runs ingestion jobs on a bounded thread pool and keeps recent job records for polling"""
+
+    def __init__(self, max_workers=2, max_jobs=500, store=None):
+        self.max_jobs = max_jobs
+        # SQLiteJobStore shared by the workers on a host, so any of them can report any job
+        self.store = store
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ingest')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, session_id, pdf_name, document_key=None):
+        """Register a new job record without scheduling any work"""
+        job = IngestJob(session_id, pdf_name, self.store, document_key)
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._prune()
+        return job
+
+    def submit(self, job, fn, *args):
+        """Run fn(job, *args) in the background; uncaught errors mark the job as failed"""
+        def run():
+            try:
+                fn(job, *args)
+            except Exception as e:
+                print(f"Error in ingest job {job.job_id}: {e}")
+                traceback.print_exc()
+                job.update(status='failed', error=str(e))
+
+        self._executor.submit(run)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self, job_id):
+        """The job's progress record, from this worker or the shared store; None if unknown"""
+        job = self.get(job_id)
+        if job:
+            return job.to_dict()
+        return self.store.load(job_id) if self.store else None
+
+    def latest(self, session_id, document_key):
+        """Progress record of the newest job for a document in a session, here or in the shared store; None if unknown"""
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job.session_id == session_id and job.document_key == document_key]
+        states = [jobs[-1].to_dict()] if jobs else []
+        if self.store:
+            states.append(self.store.latest(session_id, document_key))
+        states = [state for state in states if state]
+        return max(states, key=lambda state: state['createdAt']) if states else None
+
+    def _prune(self):
+        # Forget the oldest finished jobs once we hold more than max_jobs records
+        excess = len(self._jobs) - self.max_jobs
+        for job_id in list(self._jobs):
+            if excess <= 0:
+                break
+            if self._jobs[job_id].finished:
+                del self._jobs[job_id]
+                excess -= 1
+
+
+class SQLiteJobStore:
+    """Job progress records in a SQLite database shared by the workers on a host"""
+
+    def __init__(self, db_path, ttl=3600):
+        self.db_path = db_path
+        # Finished jobs are deleted this many seconds after their last update
+        self.ttl = ttl
+        self._connections = threading.local()
+        self._next_prune = 0.0
+        db = self._db()
+        db.execute(
+            'CREATE TABLE IF NOT EXISTS ingest_jobs (job_id TEXT PRIMARY KEY, state TEXT NOT NULL, '
+            'finished INTEGER NOT NULL, updated REAL NOT NULL, session_id TEXT, document_key TEXT)'
+        )
+        try:
+            # Databases created before jobs were looked up by document
+            db.execute('ALTER TABLE ingest_jobs ADD COLUMN session_id TEXT')
+            db.execute('ALTER TABLE ingest_jobs ADD COLUMN document_key TEXT')
+        except sqlite3.OperationalError:
+            pass
+        db.execute('CREATE INDEX IF NOT EXISTS ingest_jobs_document ON ingest_jobs (session_id, document_key)')
+
+    def save(self, job_id, state):
+        now = time.time()
+        db = self._db()
+        db.execute(
+            'INSERT OR REPLACE INTO ingest_jobs (job_id, state, finished, updated, session_id, document_key) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (job_id, json.dumps(state), state['status'] in ('done', 'failed'), now,
+             state['sessionId'], state.get('documentKey'))
+        )
+        if now >= self._next_prune:
+            self._next_prune = now + 60
+            db.execute('DELETE FROM ingest_jobs WHERE finished AND updated < ?', (now - self.ttl,))
+
+    def load(self, job_id):
+        row = self._db().execute('SELECT state FROM ingest_jobs WHERE job_id = ?', (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def latest(self, session_id, document_key):
+        row = self._db().execute(
+            'SELECT state, finished, updated FROM ingest_jobs WHERE session_id = ? AND document_key = ? '
+            'ORDER BY updated DESC LIMIT 1', (session_id, document_key)
+        ).fetchone()
+        if not row:
+            return None
+        state = json.loads(row[0])
+        if not row[1] and row[2] < time.time() - STALE_SECONDS:
+            # Its worker stopped mid-job; nothing will finish it
+            state.update(status='failed', error='Ingest job was interrupted')
+        return state
+
+    def _db(self):
+        # sqlite3 connections cannot be shared between threads
+        connection = getattr(self._connections, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._connections.connection = connection
+        return connection
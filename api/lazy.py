@@ -0,0 +1,63 @@
+"""Deferred imports and one-time initialization for the serverless entry point.
+
+A cold start only pays for what the first request actually uses: modules
+wrapped in LazyModule are imported on first attribute access, and functions
+decorated with @memoized run once, on first call. Both record how long the
+load took in LOAD_TIMES so the startup profile can be inspected.
+"""
+import functools
+import importlib
+import threading
+import time
+
+LOAD_TIMES = {}
+_load_lock = threading.RLock()
+
+
+def _record(name, seconds):
+    LOAD_TIMES[name] = round(seconds * 1000, 2)
+    print(f"Lazy load {name}: {seconds * 1000:.0f} ms")
+
+
+class LazyModule:
+    """Stand-in for a module that imports it on first attribute access"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            with _load_lock:
+                if self._module is None:
+                    start = time.perf_counter()
+                    module = importlib.import_module(self._name)
+                    _record(self._name, time.perf_counter() - start)
+                    self._module = module
+        return self._module
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+
+def memoized(fn):
+    """Run fn once, on first call, and return the same result afterwards (thread-safe)"""
+    state = {}
+
+    @functools.wraps(fn)
+    def wrapper():
+        if 'value' not in state:
+            with _load_lock:
+                if 'value' not in state:
+                    start = time.perf_counter()
+                    value = fn()
+                    _record(fn.__name__, time.perf_counter() - start)
+                    state['value'] = value
+        return state['value']
+
+    wrapper.loaded = lambda: 'value' in state
+    return wrapper
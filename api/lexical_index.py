@@ -0,0 +1,75 @@
+"""BM25 inverted index over document chunks, for exact-term retrieval.
+
+Math documents are full of terms dense embeddings blur together: theorem
+and equation numbers ("Theorem 3.2"), symbols written as LaTeX commands
+(\\sin, \\alpha) and named functions. The tokenizer keeps those intact, and
+the index is updated incrementally as chunks are added, like the vector
+index it sits next to.
+"""
+import math
+import re
+from collections import Counter
+
+# Words, numbers with their dotted parts ("3.2", "1.4.7") and LaTeX command names (\sin -> sin)
+TOKEN = re.compile(r'\\?([a-z]+|\d+(?:\.\d+)*)')
+STOPWORDS = frozenset(
+    'a an and are as at be by can do does for from how i if in is it its me of on or say says show that the '
+    'their then there these this to was what when where which why will with you your'.split()
+)
+
+K1 = 1.5
+B = 0.75
+
+
+def tokenize(text):
+    """Lowercased search terms of text, without stopwords"""
+    return [token for token in TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """Okapi BM25 over a growing list of texts; document IDs are positions in insertion order"""
+
+    def __init__(self, k1=K1, b=B):
+        self.k1 = k1
+        self.b = b
+        # term -> {document position: term frequency}
+        self.postings = {}
+        self.lengths = []
+        self.total_length = 0
+        self.posting_count = 0
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def add(self, texts):
+        for text in texts:
+            position = len(self.lengths)
+            counts = Counter(tokenize(text))
+            for term, frequency in counts.items():
+                self.postings.setdefault(term, {})[position] = frequency
+            self.posting_count += len(counts)
+            length = sum(counts.values())
+            self.lengths.append(length)
+            self.total_length += length
+
+    def search(self, query, top_k=10):
+        """[(document position, score)] for the best matches of query, highest score first"""
+        terms = set(tokenize(query))
+        count = len(self.lengths)
+        if not terms or not count:
+            return []
+        average_length = self.total_length / count or 1.0
+        scores = {}
+        for term in terms:
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for position, frequency in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[position] / average_length)
+                scores[position] = scores.get(position, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+    def nbytes(self):
+        """Rough resident size: one small dict entry per posting plus the term keys"""
+        return self.posting_count * 100 + len(self.postings) * 80
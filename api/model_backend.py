@@ -0,0 +1,266 @@
+"""Chat and embedding backends: Gemini, or a local fake for benchmarks and load tests.
+
+Both expose the small surface the app uses:
+    backend.generative_model(system_instruction=None).start_chat(history=...)
+        .send_message(message, stream=False) -> object with .text, or an
+        iterable of chunks with .text when stream=True
+        .send_message_async(message, stream=False) -> the same, awaited; an
+        async iterable of chunks when stream=True
+    backend.embed_content(model=..., content=..., task_type=...) -> {'embedding': ...}
+"""
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+
+WORD = re.compile(r'\w+')
+
+
+class GeminiBackend:
+    """Thin pass-through to google.generativeai, configured with the API key on first use"""
+
+    name = 'gemini'
+
+    def __init__(self, genai, model_name, api_key=None):
+        self.genai = genai
+        self.model_name = model_name
+        self.api_key = api_key
+        self._configured = False
+        self._lock = threading.Lock()
+
+    def client(self):
+        if not self._configured:
+            with self._lock:
+                if not self._configured:
+                    if self.api_key:
+                        self.genai.configure(api_key=self.api_key)
+                    self._configured = True
+        return self.genai
+
+    def generative_model(self, system_instruction=None):
+        genai = self.client()
+        if system_instruction:
+            return genai.GenerativeModel(self.model_name, system_instruction=system_instruction)
+        return genai.GenerativeModel(self.model_name)
+
+    def embed_content(self, model, content, task_type):
+        return self.client().embed_content(model=model, content=content, task_type=task_type)
+
+
+class FakeQuotaError(Exception):
+    """What the fake raises past its quota, like the API's 429 RESOURCE_EXHAUSTED"""
+
+    code = 429
+
+
+class FakeText:
+    def __init__(self, text):
+        self.text = text
+
+
+# Raw outputs of the kinds the real model produces now and then; {answer} and
+# {latex} are filled in per message. Each one exercises a different parser path.
+MALFORMED_TEMPLATES = [
+    '```json\n{{"chatResponse": "{answer}", "graphCommands": [{{"command": "setExpression", "params": {{"id": "fake", "latex": "{latex}"}}}}]}}\n```',
+    '{{"chatResponse": "{answer} Note that \\frac{{1}}{{2}} and \\theta appear unescaped.", "graphCommands": [{{"command": "setExpression", "params": {{"id": "fake", "latex": "y=\\sin(x)"}}}}]}}',
+    'Sure! Here is the graph:\n{{"chatResponse": "{answer}", "graphCommands": [{{"command": "setExpression", "params": {{"id": "fake", "latex": "{latex}"}}}},]}}',
+    '{{"chatResponse": "{answer} This response was cut off before the graph commands were fin',
+    "I can't format that as JSON right now, but here is the answer: {answer}"
+]
+
+
+class FakeChatSession:
+    def __init__(self, backend, history, system_instruction=None):
+        self.backend = backend
+        self.history = list(history or [])
+        self.system_instruction = system_instruction
+
+    def respond(self, message):
+        """(reply text, time to read the input) for a message on top of this session's history"""
+        self.backend.spend_quota('generate')
+        prefill = self.backend.prefill_time([self.system_instruction or '', message] +
+                                            [part for content in self.history for part in content['parts']])
+        if self.system_instruction and 'running summary' in self.system_instruction:
+            text = self.backend.summary_for(message)
+        else:
+            text = self.backend.reply_for(message)
+        self.history.append({'role': 'user', 'parts': [message]})
+        self.history.append({'role': 'model', 'parts': [text]})
+        return text, prefill
+
+    def send_message(self, message, stream=False):
+        text, prefill = self.respond(message)
+        if stream:
+            return self.backend.stream(text, prefill)
+        self.backend.sleep(self.backend.latency + prefill + self.backend.generation_time(text))
+        return FakeText(text)
+
+    async def send_message_async(self, message, stream=False):
+        text, prefill = self.respond(message)
+        if stream:
+            # Like the SDK, the first chunk is awaited before the response object is returned
+            await asyncio.sleep(self.backend.call_latency() + prefill)
+            return self.backend.stream_async(text)
+        await asyncio.sleep(self.backend.call_latency() + prefill + self.backend.generation_time(text))
+        return FakeText(text)
+
+
+class FakeModel:
+    def __init__(self, backend, system_instruction=None):
+        self.backend = backend
+        self.system_instruction = system_instruction
+
+    def start_chat(self, history=None):
+        return FakeChatSession(self.backend, history, self.system_instruction)
+
+
+class FakeBackend:
+    """Local stand-in for Gemini with configurable latency, streaming and malformed output.
+
+    Replies are well-formed JSON answers that plot one expression, except for
+    a malformed_rate fraction drawn from MALFORMED_TEMPLATES. Embeddings are
+    deterministic unit vectors hashed from the words of the text, so the same
+    chunk always gets the same vector, caches behave as they would live, and
+    texts that share words are close enough for retrieval to find them.
+    A slow_rate fraction of async calls takes slow_latency longer, like the
+    long tail of a real model service, and every call takes prefill_per_1k
+    longer per thousand input tokens. A model whose system instruction asks
+    for a running summary answers with an extractive one. With quota_rpm set,
+    chat and embedding calls beyond that many per minute (each kind on its
+    own, spread evenly with a second's worth of burst) fail with a 429.
+    """
+
+    name = 'fake'
+
+    def __init__(self, latency=0.5, chunk_chars=40, chunk_delay=0.02, malformed_rate=0.0,
+                 embed_latency=0.05, embed_per_item=0.0005, dimension=768, seed=0, slow_rate=0.0, slow_latency=5.0,
+                 prefill_per_1k=0.0, quota_rpm=0):
+        self.latency = latency
+        self.chunk_chars = chunk_chars
+        self.chunk_delay = chunk_delay
+        self.malformed_rate = malformed_rate
+        self.embed_latency = embed_latency
+        self.embed_per_item = embed_per_item
+        self.dimension = dimension
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.prefill_per_1k = prefill_per_1k
+        self.quota_rpm = quota_rpm
+        self.quota_errors = 0
+        self._quota = {}
+        self.calls = 0
+        self.embed_calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, environ):
+        return cls(
+            latency=float(environ.get('FAKE_MODEL_LATENCY_MS', '500')) / 1000,
+            chunk_chars=int(environ.get('FAKE_STREAM_CHUNK_CHARS', '40')),
+            chunk_delay=float(environ.get('FAKE_STREAM_CHUNK_MS', '20')) / 1000,
+            malformed_rate=float(environ.get('FAKE_MALFORMED_RATE', '0')),
+            embed_latency=float(environ.get('FAKE_EMBED_LATENCY_MS', '50')) / 1000,
+            seed=int(environ.get('FAKE_SEED', '0')),
+            slow_rate=float(environ.get('FAKE_SLOW_RATE', '0')),
+            slow_latency=float(environ.get('FAKE_SLOW_MS', '5000')) / 1000,
+            prefill_per_1k=float(environ.get('FAKE_PREFILL_MS_PER_1K_TOKENS', '0')) / 1000,
+            quota_rpm=int(environ.get('FAKE_QUOTA_RPM', '0'))
+        )
+
+    def generative_model(self, system_instruction=None):
+        return FakeModel(self, system_instruction)
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def call_latency(self):
+        """Time to the first token of an async call, occasionally from the slow tail"""
+        with self._lock:
+            slow = self._random.random() < self.slow_rate
+        return self.latency + (self.slow_latency if slow else 0.0)
+
+    def spend_quota(self, kind):
+        """Count a call against the per-minute quota of its kind; raises FakeQuotaError past it"""
+        if not self.quota_rpm:
+            return
+        rate = self.quota_rpm / 60
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._quota.get(kind, (max(rate, 1.0), now))
+            tokens = min(max(rate, 1.0), tokens + (now - updated) * rate)
+            if tokens < 1:
+                self._quota[kind] = (tokens, now)
+                self.quota_errors += 1
+                raise FakeQuotaError("429 Resource has been exhausted (e.g. check quota).")
+            self._quota[kind] = (tokens - 1, now)
+
+    def prefill_time(self, texts):
+        """Time to read the input, at ~4 characters per token"""
+        return sum(len(text) for text in texts) / 4000 * self.prefill_per_1k
+
+    def generation_time(self, text):
+        return (len(text) // max(self.chunk_chars, 1)) * self.chunk_delay
+
+    def reply_for(self, message):
+        with self._lock:
+            self.calls += 1
+            malformed = self._random.random() < self.malformed_rate
+            template = self._random.choice(MALFORMED_TEMPLATES)
+
+        # The user's text is the last paragraph; earlier ones are graph updates or PDF context
+        question = message.rsplit('\n\n', 1)[-1].strip()
+        slope = int(hashlib.sha256(question.encode('utf-8')).hexdigest()[:4], 16) % 9 + 1
+        latex = f'y={slope}x+1'
+        answer = f'Here is a fake answer to: {question[:80]}'
+        if malformed:
+            return template.format(answer=answer.replace('"', "'"), latex=latex)
+        return json.dumps({
+            'chatResponse': answer,
+            'graphCommands': [
+                {'command': 'setExpression', 'params': {'id': f'fake_{slope}', 'latex': latex, 'color': '#2563eb'}}
+            ]
+        })
+
+    def summary_for(self, message):
+        """Stand-in for a summary: the opening words of each line of the summary and messages given"""
+        with self._lock:
+            self.calls += 1
+        lines = [line.strip() for line in message.splitlines()]
+        kept = [' '.join(line.lstrip('- ').split()[:12]) for line in lines if line and not line.endswith(':')]
+        return '\n'.join(f'- {line}' for line in kept if line != '(none yet)')
+
+    def stream(self, text, prefill=0.0):
+        self.sleep(self.latency + prefill)
+        for start in range(0, len(text), self.chunk_chars):
+            if start:
+                self.sleep(self.chunk_delay)
+            yield FakeText(text[start:start + self.chunk_chars])
+
+    async def stream_async(self, text):
+        for start in range(0, len(text), self.chunk_chars):
+            if start:
+                await asyncio.sleep(self.chunk_delay)
+            yield FakeText(text[start:start + self.chunk_chars])
+
+    def embed_content(self, model, content, task_type):
+        batch = content if isinstance(content, list) else [content]
+        self.spend_quota('embed')
+        with self._lock:
+            self.embed_calls += 1
+        self.sleep(self.embed_latency + self.embed_per_item * len(batch))
+        vectors = [self._vector(text) for text in batch]
+        return {'embedding': vectors if isinstance(content, list) else vectors[0]}
+
+    def _vector(self, text):
+        # Feature hashing: every word adds +-1 to one dimension chosen by its hash
+        vector = [0.0] * self.dimension
+        for word in WORD.findall(text.lower()) or [text]:
+            digest = hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest()
+            vector[int.from_bytes(digest[:4], 'little') % self.dimension] += 1.0 if digest[4] & 1 else -1.0
+        norm = sum(x * x for x in vector) ** 0.5 or 1.0
+        return [x / norm for x in vector]
@@ -0,0 +1,131 @@
+"""Streaming page-wise PDF text extraction with paragraph/sentence-aware chunking"""
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz  # PyMuPDF
+
+# Paragraphs are separated by blank lines; sentences end in .!? followed by
+# whitespace and an uppercase letter, digit or opening bracket. Decimal numbers
+# and formulas like "f(x) = 3.5x" never match because there is no whitespace
+# after the period.
+PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+SENTENCE_BREAK = re.compile(r'(?<=[.!?])\s+(?=[A-Z0-9(\[\\$])')
+ABBREVIATIONS = ('e.g.', 'i.e.', 'etc.', 'Fig.', 'Eq.', 'Thm.', 'Def.', 'cf.', 'vs.', 'Prop.', 'Lem.')
+
+# Pages per task when extraction is spread across a process pool
+PAGES_PER_TASK = 16
+
+
+def _extract_page_range(pdf_path, start, stop):
+    """Extract (page_number, text) for pages [start, stop); runs in worker processes"""
+    with fitz.open(pdf_path) as doc:
+        return [(page_number + 1, doc[page_number].get_text()) for page_number in range(start, stop)]
+
+
+def iter_page_texts(pdf_path, workers=1, min_pages_for_pool=64):
+    """Yield (page_number, text) for each page in order, one page at a time.
+
+    With workers > 1 and a large enough document, pages are extracted by a
+    process pool in ranges of PAGES_PER_TASK and yielded back in page order.
+    """
+    with fitz.open(pdf_path) as doc:
+        page_count = doc.page_count
+        if workers <= 1 or page_count < min_pages_for_pool:
+            for page in doc:
+                yield page.number + 1, page.get_text()
+            return
+
+    ranges = [(start, min(start + PAGES_PER_TASK, page_count)) for start in range(0, page_count, PAGES_PER_TASK)]
+    try:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    except (OSError, NotImplementedError) as e:
+        # Some serverless sandboxes lack the shared memory multiprocessing needs
+        print(f"Process pool unavailable ({e}), extracting pages serially")
+        yield from iter_page_texts(pdf_path, workers=1)
+        return
+
+    with executor:
+        futures = [executor.submit(_extract_page_range, pdf_path, start, stop) for start, stop in ranges]
+        for future in futures:
+            yield from future.result()
+
+
+def _split_sentences(paragraph):
+    """Split a paragraph into sentences, re-joining splits that follow an abbreviation"""
+    sentences = []
+    for part in SENTENCE_BREAK.split(paragraph):
+        if sentences and sentences[-1].endswith(ABBREVIATIONS):
+            sentences[-1] += ' ' + part
+        else:
+            sentences.append(part)
+    return sentences
+
+
+def _hard_split(text, chunk_size):
+    """Split an over-long sentence at whitespace so no unit exceeds chunk_size"""
+    pieces = []
+    while len(text) > chunk_size:
+        cut = text.rfind(' ', 0, chunk_size)
+        if cut <= 0:
+            cut = chunk_size
+        pieces.append(text[:cut])
+        text = text[cut:].lstrip()
+    if text:
+        pieces.append(text)
+    return pieces
+
+
+def iter_units(text, chunk_size):
+    """Yield paragraph-sized units of a page, falling back to sentences for long paragraphs"""
+    for paragraph in PARAGRAPH_BREAK.split(text):
+        # PDF text wraps lines mid-sentence; collapse them back into one paragraph
+        paragraph = ' '.join(line.strip() for line in paragraph.splitlines() if line.strip())
+        if not paragraph:
+            continue
+        if len(paragraph) <= chunk_size:
+            yield paragraph
+            continue
+        for sentence in _split_sentences(paragraph):
+            if len(sentence) <= chunk_size:
+                yield sentence
+            else:
+                yield from _hard_split(sentence, chunk_size)
+
+
+def iter_chunks(pdf_path, chunk_size=1000, overlap=200, workers=1):
+    """Yield {'text', 'page'} chunks page by page without building the full document text.
+
+    Units (paragraphs or sentences) are packed into chunks of at most
+    chunk_size characters. Consecutive chunks share trailing units of up to
+    overlap characters, and each chunk records the page it starts on.
+    """
+    units = []  # (page_number, text) of the chunk being built
+    size = 0
+    fresh = False  # whether units holds anything beyond the carried overlap
+
+    for page_number, page_text in iter_page_texts(pdf_path, workers=workers):
+        for unit in iter_units(page_text, chunk_size):
+            if fresh and size + len(unit) + 1 > chunk_size:
+                yield {'text': ' '.join(text for _, text in units), 'page': units[0][0]}
+
+                # Carry the trailing units forward as overlap
+                carried = []
+                carried_size = 0
+                for previous in reversed(units):
+                    if carried_size + len(previous[1]) + 1 > overlap:
+                        break
+                    carried.insert(0, previous)
+                    carried_size += len(previous[1]) + 1
+                # Never let the overlap push the next chunk past chunk_size
+                while carried and carried_size + len(unit) + 1 > chunk_size:
+                    carried_size -= len(carried.pop(0)[1]) + 1
+                units = carried
+                size = carried_size
+                fresh = False
+
+            units.append((page_number, unit))
+            size += len(unit) + 1
+            fresh = True
+
+    if fresh:
+        yield {'text': ' '.join(text for _, text in units), 'page': units[0][0]}
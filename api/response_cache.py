@@ -0,0 +1,162 @@
+"""LRU + TTL cache for /api/chat responses, shared across workers through SQLite"""
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Spaces around operators and punctuation carry no meaning: "y = x^2" == "y=x^2"
+OPERATOR_SPACING = re.compile(r'\s*([=+\-*/^(),<>])\s*')
+WHITESPACE = re.compile(r'\s+')
+TRAILING_PUNCTUATION = re.compile(r'[\s.!?]+$')
+
+# Words that usually refer back to earlier turns ("make it red", "do that again")
+HISTORY_REFERENCES = re.compile(
+    r"\b(it|its|it's|that|this|these|those|them|they|again|also|too|instead|same|previous|"
+    r"last|above|before|another|more|less|why|how come|what about|and now|now)\b"
+)
+
+
+def normalize_message(message):
+    """Canonical form of a user message for cache lookups"""
+    text = message.strip().lower()
+    text = OPERATOR_SPACING.sub(r'\1', text)
+    text = WHITESPACE.sub(' ', text)
+    return TRAILING_PUNCTUATION.sub('', text)
+
+
+def expressions_fingerprint(expressions):
+    """Order-independent hash of the current graph state"""
+    canonical = sorted(
+        (str(expr.get('id', '')), str(expr.get('latex', '')), str(expr.get('color', '')))
+        for expr in expressions
+    )
+    return hashlib.sha256(json.dumps(canonical).encode('utf-8')).hexdigest()
+
+
+def depends_on_history(message, history):
+    """True if the answer may depend on earlier turns, so the response must not be cached"""
+    if not history:
+        return False
+    return bool(HISTORY_REFERENCES.search(message.lower()))
+
+
+def response_key(message, expressions, document_id, model_fingerprint):
+    """Cache key for a chat turn"""
+    parts = [model_fingerprint, normalize_message(message), expressions_fingerprint(expressions), document_id or '']
+    return hashlib.sha256('\x00'.join(parts).encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """In-process LRU in front of an optional SQLite table shared by every worker on the host"""
+
+    def __init__(self, max_entries=2000, ttl=3600, db_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._connections = threading.local()
+        self._puts = 0
+        if db_path:
+            self._db().execute(
+                'CREATE TABLE IF NOT EXISTS responses '
+                '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL, last_access REAL NOT NULL)'
+            )
+
+    def get(self, key):
+        """Return the cached response dict for key, or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._local.get(key)
+            if entry and entry[0] > now:
+                self._local.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+        value = self._db_get(key, now) if self.db_path else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, value, now + self.ttl)
+        return value
+
+    def put(self, key, value):
+        expires = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, value, expires)
+        if self.db_path:
+            self._db_put(key, value, expires)
+
+    def record_bypass(self):
+        with self._lock:
+            self.bypassed += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'bypassed': self.bypassed,
+                'hitRate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'localEntries': len(self._local),
+                'maxEntries': self.max_entries,
+                'ttlSeconds': self.ttl,
+                'shared': bool(self.db_path)
+            }
+
+    def _remember(self, key, value, expires):
+        self._local[key] = (expires, value)
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_entries:
+            self._local.popitem(last=False)
+
+    def _db(self):
+        # sqlite3 connections cannot be shared between threads
+        connection = getattr(self._connections, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._connections.connection = connection
+        return connection
+
+    def _db_get(self, key, now):
+        try:
+            db = self._db()
+            row = db.execute('SELECT value FROM responses WHERE key = ? AND expires > ?', (key, now)).fetchone()
+            if row is None:
+                return None
+            db.execute('UPDATE responses SET last_access = ? WHERE key = ?', (now, key))
+            return json.loads(row[0])
+        except sqlite3.Error as e:
+            print(f"Response cache read error: {e}")
+            return None
+
+    def _db_put(self, key, value, expires):
+        now = time.time()
+        try:
+            db = self._db()
+            db.execute(
+                'INSERT OR REPLACE INTO responses (key, value, expires, last_access) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value), expires, now)
+            )
+            self._puts += 1
+            if self._puts % 100 == 0:
+                # Drop expired rows, then the least recently used beyond max_entries
+                db.execute('DELETE FROM responses WHERE expires <= ?', (now,))
+                db.execute(
+                    'DELETE FROM responses WHERE key NOT IN '
+                    '(SELECT key FROM responses ORDER BY last_access DESC LIMIT ?)',
+                    (self.max_entries,)
+                )
+        except sqlite3.Error as e:
+            print(f"Response cache write error: {e}")
@@ -0,0 +1,293 @@
+"""Parsing helpers for Gemini responses (chatResponse + graphCommands JSON)"""
+import json
+import re
+
+# Characters that change scanner state outside and inside string literals
+STRUCTURAL = re.compile(r'["{}\[\],:]')
+STRING_SPECIAL = re.compile(r'["\\\x00-\x1f]')
+LATEX_WORD = re.compile(r'[a-zA-Z]+')
+HEX4 = re.compile(r'[0-9a-fA-F]{4}')
+CODE_FENCE = re.compile(r'```(?:json)?')
+DECODER = json.JSONDecoder()
+
+# LaTeX commands that begin with a valid JSON escape letter: an unescaped \frac
+# would otherwise decode silently as a form feed followed by "rac"
+LATEX_COMMANDS = {
+    'bar', 'beta', 'big', 'bigl', 'bigr', 'binom', 'bmod', 'bot', 'boxed', 'bullet',
+    'flat', 'forall', 'frac',
+    'nabla', 'neg', 'neq', 'newline', 'not', 'notin', 'nu',
+    'rangle', 'rbrace', 'rceil', 'rfloor', 'rho', 'right', 'rightarrow', 'rm', 'rvert',
+    'tan', 'tanh', 'tau', 'tbinom', 'text', 'textbf', 'textit', 'textrm', 'tfrac', 'therefore',
+    'theta', 'tilde', 'times', 'to', 'top', 'triangle'
+}
+CONTROL_ESCAPES = {'\n': '\\n', '\r': '\\r', '\t': '\\t'}
+
+# Commands live at depth 3 (root object > graphCommands array > command); a truncated
+# response is only ever cut back to a point at depth 2 or less, so no half-written
+# command is kept
+MAX_CUT_DEPTH = 2
+
+
+def _scan_string(text, i, out):
+    """Copy the string literal starting at text[i] to out, repairing it on the way.
+
+    Invalid escapes (LaTeX such as \\sin or \\frac) get their backslash doubled and
+    raw control characters are escaped. Returns (end index, closed).
+    """
+    out.append('"')
+    pos = i + 1
+    n = len(text)
+    while True:
+        match = STRING_SPECIAL.search(text, pos)
+        if not match:
+            out.append(text[pos:])
+            return n, False
+        k = match.start()
+        out.append(text[pos:k])
+        ch = text[k]
+        if ch == '"':
+            out.append('"')
+            return k + 1, True
+        if ch != '\\':
+            out.append(CONTROL_ESCAPES.get(ch) or '\\u%04x' % ord(ch))
+            pos = k + 1
+            continue
+
+        following = text[k + 1:k + 2]
+        if not following:
+            # Stream cut off right after a backslash
+            return n, False
+        if following in '"\\/':
+            out.append(text[k:k + 2])
+            pos = k + 2
+        elif following == 'u' and HEX4.match(text, k + 2):
+            out.append(text[k:k + 6])
+            pos = k + 6
+        elif following in 'bfnrt' and LATEX_WORD.match(text, k + 1).group() not in LATEX_COMMANDS:
+            out.append(text[k:k + 2])
+            pos = k + 2
+        else:
+            out.append('\\\\')
+            pos = k + 1
+
+
+def decode_string(literal):
+    """Decode one JSON string literal, tolerating raw LaTeX backslashes"""
+    out = []
+    _, closed = _scan_string(literal, 0, out)
+    if not closed:
+        raise ValueError('unterminated string')
+    return json.loads(''.join(out))
+
+
+def _extract_from(text, start):
+    out = ['{']
+    closers = ['}']
+    cut = (1, ['}'])  # (pieces of out, closers) of the last point where a truncated document can end
+    after_colon = False
+    pos = start + 1
+    n = len(text)
+
+    while pos < n:
+        match = STRUCTURAL.search(text, pos)
+        if not match:
+            break
+        i = match.start()
+        ch = text[i]
+        out.append(text[pos:i])
+
+        if ch == '"':
+            value = after_colon and len(closers) == 1
+            pos, closed = _scan_string(text, i, out)
+            if not closed:
+                if value:
+                    # Keep a partial top-level value such as a cut-off chatResponse
+                    out.append('"')
+                    cut = (len(out), closers[:])
+                break
+            if value:
+                cut = (len(out), closers[:])
+            continue
+
+        if ch == '{' or ch == '[':
+            closers.append('}' if ch == '{' else ']')
+            after_colon = False
+        elif ch == '}' or ch == ']':
+            if ch != closers[-1]:
+                return None, False
+            # Drop a trailing comma before the closing bracket
+            last = len(out) - 1
+            if not out[last].strip():
+                last -= 1
+            if out[last] == ',':
+                out[last] = ''
+            closers.pop()
+            out.append(ch)
+            if not closers:
+                return json.loads(''.join(out)), False
+            if len(closers) <= MAX_CUT_DEPTH:
+                cut = (len(out), closers[:])
+            after_colon = False
+            pos = i + 1
+            continue
+        elif ch == ',':
+            if len(closers) <= MAX_CUT_DEPTH:
+                cut = (len(out), closers[:])
+            after_colon = False
+        else:
+            after_colon = True
+        out.append(ch)
+        pos = i + 1
+
+    # Truncated: cut back to the last complete value and close what is still open
+    pieces, open_closers = cut
+    return json.loads(''.join(out[:pieces]) + ''.join(reversed(open_closers))), True
+
+
+def extract_json(text, max_attempts=3):
+    """Extract the top-level JSON object from raw model text in one pass.
+
+    Anything before the first '{' (prose, code fences) and after its matching
+    '}' is ignored. Invalid escapes and raw control characters inside strings
+    are repaired, trailing commas are dropped, and a truncated object is closed
+    at its last complete value. Returns (object, truncated), or (None, False)
+    when no JSON object can be recovered.
+    """
+    start = text.find('{')
+    if start >= 0 and '\\' not in text:
+        # Nothing to repair in the common case: let the C decoder read the object directly
+        try:
+            result, _ = DECODER.raw_decode(text, start)
+            if isinstance(result, dict):
+                return result, False
+        except ValueError:
+            pass
+    for _ in range(max_attempts):
+        if start < 0:
+            break
+        try:
+            result, truncated = _extract_from(text, start)
+        except ValueError:
+            result, truncated = None, False
+        if isinstance(result, dict):
+            return result, truncated
+        # A stray '{' in leading prose; try the next one
+        start = text.find('{', start + 1)
+    return None, False
+
+
+def strip_code_fences(text):
+    return CODE_FENCE.sub('', text).strip()
+
+
+class StreamingResponseParser:
+    """Incrementally parse a streamed model response.
+
+    Text is fed in as it arrives from the model. The parser tracks string and
+    nesting state in a single pass over the new characters and returns an event
+    as soon as the top-level "chatResponse" string closes, or as soon as one
+    object inside the top-level "graphCommands" array closes.
+
+    Events are dicts ready to be serialized as NDJSON lines:
+        {'type': 'chatResponse', 'chatResponse': '...'}
+        {'type': 'graphCommand', 'graphCommand': {...}}
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self.chat_response = None
+        self.graph_commands = []
+        self.complete = False
+
+        self._pos = 0
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_key = None
+        self._current_key = None
+        self._command_start = None
+
+    def feed(self, text):
+        """Consume a chunk of streamed text and return the events it completed"""
+        self.buffer += text
+        events = []
+        buf = self.buffer
+        i = self._pos
+        n = len(buf)
+
+        while i < n and not self.complete:
+            ch = buf[i]
+
+            # Skip anything before the root object (code fences, preamble text)
+            if not self._started:
+                if ch == '{':
+                    self._started = True
+                    self._depth = 1
+                i += 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._on_string(buf[self._string_start:i + 1], events)
+                i += 1
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch == ':' and self._depth == 1:
+                self._current_key = self._last_key
+            elif ch == ',' and self._depth == 1:
+                self._current_key = None
+            elif ch == '{' or ch == '[':
+                self._depth += 1
+                if ch == '{' and self._depth == 3 and self._current_key == 'graphCommands':
+                    self._command_start = i
+            elif ch == '}' or ch == ']':
+                if ch == '}' and self._depth == 3 and self._command_start is not None:
+                    self._on_command(buf[self._command_start:i + 1], events)
+                    self._command_start = None
+                self._depth -= 1
+                if self._depth == 0:
+                    self.complete = True
+            i += 1
+
+        self._pos = i
+        return events
+
+    def _on_string(self, literal, events):
+        """Handle a string literal that just closed at any depth"""
+        if self._depth != 1:
+            return
+        if self._current_key is None:
+            # A key at the top level of the root object
+            try:
+                self._last_key = json.loads(literal)
+            except json.JSONDecodeError:
+                self._last_key = None
+        elif self._current_key == 'chatResponse' and self.chat_response is None:
+            try:
+                self.chat_response = decode_string(literal)
+            except ValueError as e:
+                print(f"Stream parser: could not decode chatResponse: {e}")
+                return
+            events.append({'type': 'chatResponse', 'chatResponse': self.chat_response})
+
+    def _on_command(self, text, events):
+        """Handle a graph command object that just closed"""
+        try:
+            command, truncated = extract_json(text, max_attempts=1)
+        except ValueError as e:
+            command, truncated = None, False
+            print(f"Stream parser: skipping malformed graph command: {e}")
+        if command is None or truncated:
+            return
+        self.graph_commands.append(command)
+        events.append({'type': 'graphCommand', 'graphCommand': command})
@@ -0,0 +1,143 @@
+"""Cheap checks in front of RAG retrieval: intent gating, query-embedding cache, relevance cutoff.
+
+needs_retrieval() decides locally whether a chat turn could use document
+context at all; self-contained graph manipulation ("plot y=x^2 in red",
+"zoom out") skips the embedding call and the extra prompt tokens. QueryEmbeddingCache keeps
+recent query vectors so repeated questions skip the embedding API, and
+EmbeddingBreaker stops calling it for a while after it fails or times
+out, so retrieval runs lexical-only instead. relevant_hits() drops
+results that are neither close to the query vector nor a strong BM25 match.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from fast_path import parse_local_command
+from response_cache import normalize_message
+
+# Leading verbs of requests that only change the canvas
+GRAPH_ACTION = re.compile(
+    r'^(?:(?:please|can\s+you|could\s+you|now|ok(?:ay)?|and|then)\s+)*'
+    r'(?:plot|graph|draw|add|show|clear|erase|remove|delete|hide|unhide|reset|zoom|pan|move|shift|'
+    r'make|change|color|colour|set|restyle|undo|redo|start\s+over|label|shade|fill)\b'
+)
+# Anything that asks for an explanation or points at the document keeps retrieval on
+KNOWLEDGE_CUE = re.compile(
+    r'\?|\b(?:what|why|how|which|when|who|explain|describe|define|definition|mean|means|meaning|'
+    r'document|pdf|paper|notes|textbook|book|page|section|chapter|theorem|lemma|corollary|proof|prove|'
+    r'example|exercise|problem|question|according|summar\w*|derive|discuss|figure|equation\s+\d+|'
+    r'handout|slides?|lecture|worksheet)\b'
+)
+# Words pointing back at earlier turns or the document ("plot its derivative", "shade between them")
+ANAPHORA = re.compile(
+    r"\b(?:it|its|it's|itself|them|they|their|that|this|these|those|"
+    r"the\s+(?:function|functions|curve|curves|equation|equations|formula|one|ones|same|previous|last)|"
+    r"above|earlier|before|again)\b"
+)
+# Explicit math in the message itself: an equation, a power, a term in x or a function call
+EXPLICIT_MATH = re.compile(
+    r'[=^]|\d\s*x\b|\bx\s*[-+*/]|\b(?:sin|cos|tan|sec|csc|cot|sqrt|abs|exp|log|ln)\s*\(|\(\s*-?\d'
+)
+# Actions on the view or the edit history, which need nothing beyond the message
+VIEW_ACTION = re.compile(
+    r'^(?:(?:please|can\s+you|could\s+you|now|ok(?:ay)?|and|then)\s+)*'
+    r'(?:zoom|pan|undo|redo|reset|clear|start\s+over)\b'
+)
+# Longer messages carry enough content that skipping retrieval is not worth the risk
+MAX_ACTION_WORDS = 12
+
+
+def needs_retrieval(message):
+    """False when the message is a self-contained graph-manipulation request that document context cannot help.
+
+    Graph actions that point back at something ("now plot its derivative") may
+    build on the document, so only ones that carry their own math, only move
+    the view, or that the local fast path handles skip retrieval.
+    """
+    text = message.strip().lower()
+    if not text or KNOWLEDGE_CUE.search(text) or ANAPHORA.search(text):
+        return True
+    if not (GRAPH_ACTION.match(text) and len(text.split()) <= MAX_ACTION_WORDS):
+        return True
+    self_contained = VIEW_ACTION.match(text) or EXPLICIT_MATH.search(text) or parse_local_command(text, [])
+    return not self_contained
+
+
+def relevant_hits(hits, max_distance, min_bm25):
+    """Search hits within max_distance of the query vector, or scoring at least min_bm25 lexically"""
+    return [
+        hit for hit in hits
+        if (hit['distance'] is not None and hit['distance'] <= max_distance) or hit['bm25'] >= min_bm25
+    ]
+
+
+class EmbeddingBreaker:
+    """Skips query embedding calls for cooldown seconds after one fails or times out"""
+
+    def __init__(self, cooldown=30):
+        self.cooldown = cooldown
+        self.failures = 0
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        return time.time() >= self._open_until
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._open_until = time.time() + self.cooldown
+
+    def record_success(self):
+        with self._lock:
+            self._open_until = 0.0
+
+
+class QueryEmbeddingCache:
+    """LRU + TTL cache of query embeddings, keyed by model and normalized query text"""
+
+    def __init__(self, max_entries=1000, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model, query):
+        return (model, normalize_message(query))
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, vector):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'entries': len(self._entries),
+                'maxEntries': self.max_entries
+            }
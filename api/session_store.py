@@ -0,0 +1,237 @@
+"""Memory-bounded session store for per-session document indexes (vector_index.SessionIndex)"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+
+# Per-session locks are striped over this many locks, so their number stays bounded
+LOCK_STRIPES = 64
+
+
+class SessionStore:
+    """LRU + TTL session store with a memory budget.
+
+    Sessions that fall out of the budget or sit idle for longer than ttl
+    seconds are spilled to disk (SessionIndex.save) and reloaded lazily the
+    next time get() is called for them.
+
+    The store lock only guards the in-memory map; spills and reloads do
+    their disk I/O outside it. A session's own (striped) lock is held while
+    its index is changed and while it is written out, so a spill never
+    saves or drops an index in the middle of an add.
+    """
+
+    def __init__(self, spill_dir, max_bytes, ttl=3600, index_factory=None):
+        self.spill_dir = spill_dir
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # Builds an empty SessionIndex for a session's first document
+        self.index_factory = index_factory
+        self.spills = 0
+        self.reloads = 0
+        self._sessions = OrderedDict()
+        # Sessions picked for spilling whose files are still being written; still served from memory
+        self._spilling = {}
+        self._lock = threading.RLock()
+        self._session_locks = [threading.RLock() for _ in range(LOCK_STRIPES)]
+        os.makedirs(spill_dir, exist_ok=True)
+
+    def put(self, session_id, session_index):
+        """Store a session's index after it changed, evicting others if over budget"""
+        entry = {
+            'index': session_index,
+            'bytes': session_index.nbytes(),
+            'last_access': time.time()
+        }
+        with self._session_lock(session_id):
+            # The in-memory index is newer than any spilled copy
+            shutil.rmtree(self._spill_path(session_id), ignore_errors=True)
+            with self._lock:
+                self._spilling.pop(session_id, None)
+                self._sessions[session_id] = entry
+                self._sessions.move_to_end(session_id)
+                victims = self._enforce_limits(keep=session_id)
+        self._write_spills(victims)
+
+    def get(self, session_id):
+        """Return the session's index (reloading it from disk if spilled), or None"""
+        with self._lock:
+            entry = self._sessions.get(session_id) or self._spilling.get(session_id)
+        # Read from disk outside the store lock
+        loaded = self._reload(session_id) if entry is None else None
+        with self._lock:
+            # Another thread may have loaded or stored the session meanwhile; its copy wins
+            entry = self._sessions.get(session_id) or self._spilling.pop(session_id, None) or loaded
+            if entry is None:
+                return None
+            entry['last_access'] = time.time()
+            self._sessions[session_id] = entry
+            self._sessions.move_to_end(session_id)
+            victims = self._enforce_limits(keep=session_id)
+        self._write_spills(victims)
+        return entry['index']
+
+    def add(self, session_id, vectors, chunks, document_id, document_name):
+        """Add a document's chunks (or the next group of them) to the session's index"""
+        # Held from reading the index to storing it, so a spill cannot write out or drop it in between
+        with self._session_lock(session_id):
+            session_index = self.get_or_create(session_id, self._new_index)
+            session_index.add(vectors, chunks, document_id, document_name)
+            self.put(session_id, session_index)
+
+    def get_or_create(self, session_id, factory):
+        """Return the session's index, creating an empty one with factory() if it has none"""
+        with self._session_lock(session_id):
+            session_index = self.get(session_id)
+            if session_index is None:
+                session_index = factory()
+                with self._lock:
+                    self._sessions[session_id] = {'index': session_index, 'bytes': 0, 'last_access': time.time()}
+            return session_index
+
+    def has_document(self, session_id):
+        """True if the session has indexed chunks in memory or spilled to disk"""
+        with self._lock:
+            entry = self._sessions.get(session_id) or self._spilling.get(session_id)
+            if entry is not None:
+                return bool(entry['index'].chunks)
+        return os.path.exists(os.path.join(self._spill_path(session_id), 'index.faiss'))
+
+    def document_id(self, session_id):
+        """ID of the session's indexed documents without loading a spilled index, or None"""
+        with self._lock:
+            entry = self._sessions.get(session_id) or self._spilling.get(session_id)
+            if entry is not None:
+                return entry['index'].document_id
+        try:
+            with open(os.path.join(self._spill_path(session_id), 'meta.json'), encoding='utf-8') as f:
+                return json.load(f).get('document_id')
+        except (OSError, ValueError):
+            return None
+
+    def resident_bytes(self):
+        """Estimated resident bytes per in-memory session"""
+        with self._lock:
+            return {session_id: entry['bytes'] for session_id, entry in self._sessions.items()}
+
+    def index_stats(self):
+        """Index type, vector count and documents per in-memory session"""
+        with self._lock:
+            return {session_id: entry['index'].stats() for session_id, entry in self._sessions.items()}
+
+    def stats(self):
+        with self._lock:
+            per_session = self.resident_bytes()
+            return {
+                'backend': 'memory',
+                'residentSessions': len(per_session),
+                'residentBytes': sum(per_session.values()),
+                'maxBytes': self.max_bytes,
+                'ttlSeconds': self.ttl,
+                'spills': self.spills,
+                'reloads': self.reloads,
+                'sessions': per_session,
+                'indexes': self.index_stats()
+            }
+
+    def _enforce_limits(self, keep=None):
+        """Move idle and over-budget sessions to _spilling and return their IDs for _write_spills"""
+        victims = []
+        now = time.time()
+        for session_id in list(self._sessions):
+            if session_id != keep and now - self._sessions[session_id]['last_access'] > self.ttl:
+                victims.append(session_id)
+
+        total = sum(entry['bytes'] for session_id, entry in self._sessions.items() if session_id not in victims)
+        for session_id in list(self._sessions):
+            if total <= self.max_bytes:
+                break
+            if session_id == keep or session_id in victims:
+                continue
+            total -= self._sessions[session_id]['bytes']
+            victims.append(session_id)
+
+        for session_id in victims:
+            self._spilling[session_id] = self._sessions.pop(session_id)
+        return victims
+
+    def _session_lock(self, session_id):
+        return self._session_locks[hash(session_id) % LOCK_STRIPES]
+
+    def _write_spills(self, victims):
+        # Called without the store lock held
+        for session_id in victims:
+            self._spill(session_id)
+
+    def _new_index(self):
+        if self.index_factory:
+            return self.index_factory()
+        from vector_index import SessionIndex
+
+        return SessionIndex()
+
+    def _spill_path(self, session_id):
+        # Session IDs come from the client, so never use them as path components directly
+        return os.path.join(self.spill_dir, hashlib.sha256(session_id.encode('utf-8')).hexdigest())
+
+    def _spill(self, session_id):
+        lock = self._session_lock(session_id)
+        # Never wait for it: a session whose lock is held is being added to, so it stays in memory
+        if not lock.acquire(blocking=False):
+            self._unspill(session_id)
+            return
+        try:
+            with self._lock:
+                entry = self._spilling.get(session_id)
+            if entry is None:
+                # get() or put() took it back meanwhile
+                return
+            if entry['index'].index is None:
+                # Created for an ingestion that has not indexed anything yet; nothing to keep
+                with self._lock:
+                    self._spilling.pop(session_id, None)
+                return
+            path = self._spill_path(session_id)
+            try:
+                entry['index'].save(path)
+                with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as f:
+                    json.dump({'document_id': entry['index'].document_id}, f)
+            except Exception as e:
+                print(f"Error spilling session {session_id}: {e}")
+                shutil.rmtree(path, ignore_errors=True)
+                self._unspill(session_id)
+                return
+            with self._lock:
+                # If get() took it back while the files were written, they still match its index
+                self._spilling.pop(session_id, None)
+                self.spills += 1
+            print(f"Spilled session {session_id} to disk ({entry['bytes']} bytes)")
+        finally:
+            lock.release()
+
+    def _unspill(self, session_id):
+        with self._lock:
+            entry = self._spilling.pop(session_id, None)
+            if entry is not None:
+                self._sessions.setdefault(session_id, entry)
+
+    def _reload(self, session_id):
+        from vector_index import SessionIndex
+
+        path = self._spill_path(session_id)
+        try:
+            session_index = SessionIndex.load(path)
+        except (OSError, RuntimeError, ValueError, KeyError):
+            return None
+        with self._lock:
+            self.reloads += 1
+        print(f"Reloaded session {session_id} from disk")
+        return {
+            'index': session_index,
+            'bytes': session_index.nbytes(),
+            'last_access': time.time()
+        }
@@ -0,0 +1,291 @@
+"""Session store shared by every worker on a host: SQLite for chunks and metadata, one mmap'd vector file per session.
+
+The in-memory SessionStore keeps each session in the process that indexed
+it, so with several gunicorn workers a chat request that lands on another
+worker finds no document. Here every write goes to disk and any worker can
+open any session:
+
+- Vectors are appended, normalized, to <dir>/<hash>.f32 as float32 rows and
+  read back with np.memmap, so opening a session copies nothing and workers
+  share one copy in the page cache; flat indexes search the mapping in place.
+- Chunk text, pages and documents live in SQLite (WAL), with a per-session
+  row count that says how many vector rows are committed.
+- Writers take SQLite's write lock (BEGIN IMMEDIATE) before appending, so
+  concurrent writers in any process are serialized; rows past the committed
+  count (a writer that died mid-append) are never read and get overwritten.
+
+Each worker caches the SessionIndex it built for a session and catches up
+on rows other workers added, instead of rebuilding it.
+
+Sessions nobody has used for ttl seconds are deleted, rows and vector file,
+by whichever worker next sweeps. Workers record use in the shared row at
+most every TOUCH_SECONDS, and a session created again under the same ID
+gets a new creation time, so workers drop the copy they had of the old one.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Most often a worker writes a session's last use to SQLite, and sweeps for expired sessions
+TOUCH_SECONDS = 60
+# Per-session locks are striped over this many locks, so their number stays bounded
+LOCK_STRIPES = 64
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS sessions '
+    '(session_id TEXT PRIMARY KEY, dimension INTEGER NOT NULL, vectors INTEGER NOT NULL, updated REAL NOT NULL, '
+    'created REAL)',
+    'CREATE TABLE IF NOT EXISTS documents '
+    '(session_id TEXT NOT NULL, document_id TEXT NOT NULL, name TEXT NOT NULL, chunks INTEGER NOT NULL, '
+    'PRIMARY KEY (session_id, document_id))',
+    'CREATE TABLE IF NOT EXISTS chunks '
+    '(session_id TEXT NOT NULL, position INTEGER NOT NULL, document_id TEXT NOT NULL, page INTEGER, text TEXT NOT NULL, '
+    'PRIMARY KEY (session_id, position)) WITHOUT ROWID'
+)
+
+
+class SQLiteSessionStore:
+    """Drop-in for SessionStore that shares sessions across processes through SQLite and mapped vector files"""
+
+    def __init__(self, directory, max_bytes, ttl=3600, index_factory=None):
+        self.directory = directory
+        self.db_path = os.path.join(directory, 'sessions.sqlite3')
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # Builds an empty SessionIndex when this worker first opens a session
+        self.index_factory = index_factory
+        self.syncs = 0
+        self.synced_rows = 0
+        self.expired = 0
+        # session ID -> {'index', 'vectors' (rows synced), 'created', 'bytes', 'last_access', 'touched'};
+        # this worker's open sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.RLock()
+        # Held while a session catches up, so other sessions are not kept waiting on the store lock
+        self._session_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self._connections = threading.local()
+        self._next_sweep = 0.0
+        os.makedirs(directory, exist_ok=True)
+        db = self._db()
+        for statement in SCHEMA:
+            db.execute(statement)
+        try:
+            # Databases written before sessions had a creation time
+            db.execute('ALTER TABLE sessions ADD COLUMN created REAL')
+        except sqlite3.OperationalError:
+            pass
+
+    def add(self, session_id, vectors, chunks, document_id, document_name):
+        """Append a document's chunks (or the next group of them) and their embeddings for every worker to see"""
+        if not len(chunks):
+            return
+        from vector_index import normalize
+
+        vectors = normalize(vectors)
+        self._sweep()
+        db = self._db()
+        # Taking the write lock first serializes appends to the vector file across processes
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = db.execute('SELECT dimension, vectors FROM sessions WHERE session_id = ?', (session_id,)).fetchone()
+            dimension, start = row if row else (vectors.shape[1], 0)
+            now = time.time()
+            if vectors.shape[1] != dimension:
+                raise ValueError(f"Session {session_id} holds {dimension}-dimensional vectors, got {vectors.shape[1]}")
+            path = self._vector_path(session_id)
+            with open(path, 'r+b' if os.path.exists(path) else 'w+b') as f:
+                f.seek(start * dimension * 4)
+                f.write(vectors.tobytes())
+            db.executemany(
+                'INSERT OR REPLACE INTO chunks (session_id, position, document_id, page, text) VALUES (?, ?, ?, ?, ?)',
+                [(session_id, start + i, document_id, chunk.get('page'), chunk['text']) for i, chunk in enumerate(chunks)]
+            )
+            db.execute(
+                'INSERT INTO documents (session_id, document_id, name, chunks) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (session_id, document_id) DO UPDATE SET chunks = chunks + excluded.chunks',
+                (session_id, document_id, document_name, len(chunks))
+            )
+            db.execute(
+                'INSERT INTO sessions (session_id, dimension, vectors, updated, created) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (session_id) DO UPDATE SET vectors = excluded.vectors, updated = excluded.updated',
+                (session_id, dimension, start + len(chunks), now, now)
+            )
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        # Open it here too, so this worker's next query does not pay for the catch-up
+        self.get(session_id)
+
+    def get(self, session_id):
+        """Return the session's index, caught up with rows any worker added, or None"""
+        self._sweep()
+        row = self._db().execute(
+            'SELECT dimension, vectors, created FROM sessions WHERE session_id = ?', (session_id,)
+        ).fetchone()
+        with self._lock:
+            if row is None:
+                # Expired (or never indexed); drop any copy of it this worker still has
+                self._sessions.pop(session_id, None)
+                return None
+            dimension, count, created = row
+            entry = self._sessions.get(session_id)
+            if entry is None or entry['created'] != created:
+                entry = {'index': self._new_index(), 'vectors': 0, 'created': created, 'bytes': 0,
+                         'last_access': 0, 'touched': time.time()}
+                self._sessions[session_id] = entry
+        if entry['vectors'] < count:
+            with self._session_locks[hash(session_id) % LOCK_STRIPES]:
+                # Another thread may have caught this session up while we waited
+                if entry['vectors'] < count:
+                    self._catch_up(session_id, entry, dimension, count)
+        with self._lock:
+            now = time.time()
+            entry['last_access'] = now
+            touch = now - entry['touched'] >= min(TOUCH_SECONDS, self.ttl / 4)
+            if touch:
+                entry['touched'] = now
+            if self._sessions.get(session_id) is entry:
+                self._sessions.move_to_end(session_id)
+            self._enforce_limits(keep=session_id)
+            session_index = entry['index']
+        if touch:
+            self._db().execute('UPDATE sessions SET updated = ? WHERE session_id = ?', (now, session_id))
+        return session_index
+
+    def has_document(self, session_id):
+        row = self._db().execute('SELECT vectors FROM sessions WHERE session_id = ?', (session_id,)).fetchone()
+        return bool(row and row[0])
+
+    def document_id(self, session_id):
+        """Same value as SessionIndex.document_id, read from SQLite without opening the session"""
+        rows = self._db().execute(
+            'SELECT document_id, chunks FROM documents WHERE session_id = ? ORDER BY rowid', (session_id,)
+        ).fetchall()
+        return ','.join(f"{doc_id}:{chunks}" for doc_id, chunks in rows) or None
+
+    def resident_bytes(self):
+        """Estimated bytes of the sessions this worker has open (mapped flat vectors are not counted)"""
+        with self._lock:
+            return {session_id: entry['bytes'] for session_id, entry in self._sessions.items()}
+
+    def index_stats(self):
+        with self._lock:
+            return {session_id: entry['index'].stats() for session_id, entry in self._sessions.items()}
+
+    def stats(self):
+        stored = self._db().execute('SELECT COUNT(*), COALESCE(SUM(vectors), 0) FROM sessions').fetchone()
+        with self._lock:
+            per_session = self.resident_bytes()
+            return {
+                'backend': 'sqlite',
+                'storedSessions': stored[0],
+                'storedVectors': stored[1],
+                'residentSessions': len(per_session),
+                'residentBytes': sum(per_session.values()),
+                'maxBytes': self.max_bytes,
+                'ttlSeconds': self.ttl,
+                'expiredSessions': self.expired,
+                'syncs': self.syncs,
+                'syncedRows': self.synced_rows,
+                'sessions': per_session,
+                'indexes': self.index_stats()
+            }
+
+    def _catch_up(self, session_id, entry, dimension, count):
+        """Add the rows written since this worker last looked, document by document"""
+        import numpy as np
+
+        start = entry['vectors']
+        mapped = np.memmap(self._vector_path(session_id), dtype='float32', mode='r', shape=(count, dimension))
+        rows = self._db().execute(
+            'SELECT c.document_id, d.name, c.page, c.text FROM chunks c '
+            'JOIN documents d ON d.session_id = c.session_id AND d.document_id = c.document_id '
+            'WHERE c.session_id = ? AND c.position >= ? AND c.position < ? ORDER BY c.position',
+            (session_id, start, count)
+        ).fetchall()
+        position = start
+        while position < count:
+            document_id, name = rows[position - start][:2]
+            end = position
+            while end < count and rows[end - start][0] == document_id:
+                end += 1
+            chunks = [{'text': text, 'page': page} for _, _, page, text in rows[position - start:end - start]]
+            entry['index'].add(mapped[position:end], chunks, document_id, name, mapped=mapped[:end])
+            position = end
+        entry['vectors'] = count
+        entry['bytes'] = entry['index'].nbytes()
+        with self._lock:
+            self.syncs += 1
+            self.synced_rows += count - start
+
+    def _sweep(self):
+        """Delete sessions no worker has used for ttl seconds; runs at most every TOUCH_SECONDS per worker"""
+        now = time.time()
+        with self._lock:
+            if now < self._next_sweep:
+                return
+            self._next_sweep = now + min(TOUCH_SECONDS, self.ttl / 4)
+        db = self._db()
+        if not db.execute('SELECT 1 FROM sessions WHERE updated < ? LIMIT 1', (now - self.ttl,)).fetchone():
+            return
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            expired = [row[0] for row in db.execute(
+                'SELECT session_id FROM sessions WHERE updated < ?', (now - self.ttl,)
+            ).fetchall()]
+            for table in ('chunks', 'documents', 'sessions'):
+                db.executemany(f'DELETE FROM {table} WHERE session_id = ?', [(session_id,) for session_id in expired])
+            # Removed while holding the write lock, so no writer is appending to them; workers that
+            # still map a file keep reading it until they notice the session is gone
+            for session_id in expired:
+                try:
+                    os.remove(self._vector_path(session_id))
+                except FileNotFoundError:
+                    pass
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        with self._lock:
+            for session_id in expired:
+                self._sessions.pop(session_id, None)
+            self.expired += len(expired)
+        print(f"Deleted {len(expired)} sessions unused for {self.ttl} s")
+
+    def _enforce_limits(self, keep=None):
+        # Closing a session only drops this worker's copy; it reopens from disk on the next get()
+        now = time.time()
+        for session_id in list(self._sessions):
+            if session_id != keep and now - self._sessions[session_id]['last_access'] > self.ttl:
+                del self._sessions[session_id]
+        total = sum(entry['bytes'] for entry in self._sessions.values())
+        for session_id in list(self._sessions):
+            if total <= self.max_bytes:
+                break
+            if session_id != keep:
+                total -= self._sessions.pop(session_id)['bytes']
+
+    def _new_index(self):
+        if self.index_factory:
+            return self.index_factory()
+        from vector_index import SessionIndex
+
+        return SessionIndex()
+
+    def _vector_path(self, session_id):
+        # Session IDs come from the client, so never use them as path components directly
+        return os.path.join(self.directory, hashlib.sha256(session_id.encode('utf-8')).hexdigest() + '.f32')
+
+    def _db(self):
+        # sqlite3 connections cannot be shared between threads
+        connection = getattr(self._connections, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._connections.connection = connection
+        return connection
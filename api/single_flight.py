@@ -0,0 +1,369 @@
+"""Coalescing of identical in-flight upstream calls.
+
+When many clients send the same thing at once (a class typing the same
+prompt on an empty canvas, or uploading the same handout), every request
+would otherwise make its own model or embedding call. Here the first
+caller for a key makes the call and everyone who asks for the same key
+while it is in flight waits for that call's result (or error) instead.
+Nothing is kept once the call finishes; later repeats are the caches' job.
+
+Streams are shared too: every caller reads every chunk from the start, and
+whichever reader is furthest ahead pulls the next one from upstream, so a
+stream keeps going if the caller that started it goes away. Once the last
+reader is closed before the end, the upstream stream is closed (giving back
+what it holds) and the next caller starts a new one.
+"""
+import asyncio
+import threading
+
+
+class SingleFlight:
+    """Share one call among the threads asking for the same key at the same time"""
+
+    def __init__(self, kind, counter=None, enabled=True):
+        self.kind = kind
+        # Counter with kind and role labels; role is 'origin' or 'coalesced'
+        self.counter = counter
+        self.enabled = enabled
+        self.originated = 0
+        self.coalesced = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """Return (func's result, whether it came from a call already in flight)"""
+        flight, leader = self._join(key)
+        if not leader:
+            flight['done'].wait()
+            if flight['error'] is not None:
+                raise flight['error']
+            return flight['result'], True
+        try:
+            flight['result'] = func()
+        except BaseException as e:
+            flight['error'] = e
+            raise
+        finally:
+            self._leave(key, flight)
+            flight['done'].set()
+        return flight['result'], False
+
+    def stream(self, key, func):
+        """Like do() for a call returning an iterator; each caller gets its own iterator over every item.
+
+        Close the iterator when done with it early, so the last reader to go closes the upstream one.
+        """
+        while True:
+            flight, leader = self._join(key)
+            if leader:
+                try:
+                    flight['result'] = SharedStream(func(), lambda: self._leave(key, flight))
+                except BaseException as e:
+                    flight['error'] = e
+                    self._leave(key, flight)
+                    raise
+                finally:
+                    flight['done'].set()
+            else:
+                flight['done'].wait()
+                if flight['error'] is not None:
+                    raise flight['error']
+            reader = flight['result'].reader()
+            # None if every reader of that stream closed it meanwhile
+            if reader is not None:
+                return reader, not leader
+
+    def stats(self):
+        return {'originated': self.originated, 'coalesced': self.coalesced, 'inFlight': len(self._flights)}
+
+    def _join(self, key):
+        with self._lock:
+            flight = self._flights.get(key) if self.enabled else None
+            leader = flight is None
+            if leader:
+                flight = {'done': threading.Event(), 'result': None, 'error': None}
+                if self.enabled:
+                    self._flights[key] = flight
+                self.originated += 1
+            else:
+                self.coalesced += 1
+        if self.counter:
+            self.counter.inc(kind=self.kind, role='origin' if leader else 'coalesced')
+        return flight, leader
+
+    def _leave(self, key, flight):
+        with self._lock:
+            # A flight whose stream was abandoned may already have been replaced by a newer one
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+
+class SharedStream:
+    """One upstream iterator replayed to any number of readers"""
+
+    def __init__(self, upstream, on_finish):
+        self._upstream = iter(upstream)
+        self._on_finish = on_finish
+        self._items = []
+        self._finished = False
+        self._error = None
+        self._readers = 0
+        # Set when every reader closed before the end; the rest of the stream is never pulled
+        self._abandoned = False
+        self._lock = threading.Lock()
+
+    def reader(self):
+        """A new StreamReader from the first item, or None once the stream has been abandoned"""
+        with self._lock:
+            if self._abandoned:
+                return None
+            self._readers += 1
+        return StreamReader(self)
+
+    def item(self, position):
+        """The item at position, pulling it from upstream if no reader has yet"""
+        while True:
+            if position < len(self._items):
+                return self._items[position]
+            # Readers that catch up wait here for whoever is pulling the next item
+            with self._lock:
+                if position < len(self._items):
+                    continue
+                if self._error is not None:
+                    raise self._error
+                if self._finished:
+                    raise StopIteration
+                try:
+                    self._items.append(next(self._upstream))
+                except StopIteration:
+                    self._finished = True
+                    self._on_finish()
+                except Exception as e:
+                    self._error = e
+                    self._on_finish()
+
+    def detach(self):
+        """Called once by each reader as it closes; the last one closes an unfinished upstream iterator"""
+        with self._lock:
+            self._readers -= 1
+            if self._readers or self._finished or self._error is not None:
+                return
+            self._finished = True
+            self._abandoned = True
+            close = getattr(self._upstream, 'close', None)
+            try:
+                if close:
+                    close()
+            finally:
+                self._on_finish()
+
+class StreamReader:
+    """One caller's iterator over a SharedStream"""
+
+    def __init__(self, shared):
+        self._shared = shared
+        self._position = 0
+        self._open = True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self._open:
+            raise StopIteration
+        try:
+            item = self._shared.item(self._position)
+        except Exception:
+            # Including StopIteration at the end of the stream
+            self.close()
+            raise
+        self._position += 1
+        return item
+
+    def close(self):
+        if self._open:
+            self._open = False
+            self._shared.detach()
+
+    def __del__(self):
+        self.close()
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines on one event loop.
+
+    The shared call runs as its own task, so a caller that is cancelled (a
+    client that disconnected) does not cancel it for the others.
+    """
+
+    def __init__(self, kind, counter=None, enabled=True):
+        self.kind = kind
+        self.counter = counter
+        self.enabled = enabled
+        self.originated = 0
+        self.coalesced = 0
+        self._flights = {}
+
+    async def do(self, key, factory):
+        """Return (the result of awaiting factory(), whether it came from a call already in flight)"""
+        task, leader = self._join(key, factory)
+        return await asyncio.shield(task), not leader
+
+    async def stream(self, key, factory):
+        """Like do() for a coroutine returning an async iterator; each caller gets its own async iterator.
+
+        aclose() the iterator when done with it early, so the last reader to go closes the upstream one.
+        """
+        while True:
+            flight = {}
+
+            async def open_stream():
+                try:
+                    upstream = await factory()
+                except BaseException:
+                    self._leave(key, flight['task'])
+                    raise
+                return SharedAsyncStream(upstream, lambda: self._leave(key, flight['task']))
+
+            flight['task'], leader = self._join(key, open_stream, finish_with_task=False)
+            shared = await asyncio.shield(flight['task'])
+            reader = shared.reader()
+            # None if every reader of that stream closed it meanwhile
+            if reader is not None:
+                return reader, not leader
+
+    def stats(self):
+        return {'originated': self.originated, 'coalesced': self.coalesced, 'inFlight': len(self._flights)}
+
+    def _join(self, key, factory, finish_with_task=True):
+        task = self._flights.get(key) if self.enabled else None
+        leader = task is None
+        if leader:
+            task = asyncio.ensure_future(factory())
+            # Retrieve the error even if every caller was cancelled, so it is not reported as unhandled
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+            if self.enabled:
+                self._flights[key] = task
+                if finish_with_task:
+                    task.add_done_callback(lambda _: self._leave(key, task))
+            self.originated += 1
+        else:
+            self.coalesced += 1
+        if self.counter:
+            self.counter.inc(kind=self.kind, role='origin' if leader else 'coalesced')
+        return task, leader
+
+    def _leave(self, key, task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+
+
+class SharedAsyncStream:
+    """One upstream async iterator replayed to any number of readers on the same event loop"""
+
+    def __init__(self, upstream, on_finish):
+        self._upstream = aiter(upstream)
+        self._on_finish = on_finish
+        self._items = []
+        self._finished = False
+        self._error = None
+        self._pulling = None
+        self._readers = 0
+        self._abandoned = False
+        self._loop = asyncio.get_running_loop()
+
+    def reader(self):
+        """A new AsyncStreamReader from the first item, or None once the stream has been abandoned"""
+        if self._abandoned:
+            return None
+        self._readers += 1
+        return AsyncStreamReader(self)
+
+    async def item(self, position):
+        """The item at position, pulling it from upstream if no reader has yet"""
+        while True:
+            if position < len(self._items):
+                return self._items[position]
+            if self._error is not None:
+                raise self._error
+            if self._finished:
+                raise StopAsyncIteration
+            if self._pulling is None:
+                self._pulling = asyncio.ensure_future(self._pull())
+            # Shielded, so a reader that times out or is cancelled leaves the pull running for the rest
+            await asyncio.shield(self._pulling)
+
+    def detach(self):
+        """Called once by each reader as it closes; returns the coroutine closing an abandoned upstream, or None"""
+        self._readers -= 1
+        if self._readers or self._finished or self._error is not None:
+            return None
+        self._finished = True
+        self._abandoned = True
+        self._on_finish()
+        return self._close_upstream()
+
+    async def _close_upstream(self):
+        # A pull still running (a reader that timed out) is cancelled first, which also ends the upstream
+        # generator; closing one that is mid-step would fail
+        if self._pulling is not None:
+            self._pulling.cancel()
+            await asyncio.wait([self._pulling])
+        close = getattr(self._upstream, 'aclose', None)
+        if close:
+            await close()
+
+    async def _pull(self):
+        try:
+            self._items.append(await anext(self._upstream))
+        except StopAsyncIteration:
+            self._finished = True
+            self._on_finish()
+        except Exception as e:
+            self._error = e
+            self._on_finish()
+        finally:
+            self._pulling = None
+
+
+class AsyncStreamReader:
+    """One caller's async iterator over a SharedAsyncStream"""
+
+    def __init__(self, shared):
+        self._shared = shared
+        self._position = 0
+        self._open = True
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._open:
+            raise StopAsyncIteration
+        try:
+            item = await self._shared.item(self._position)
+        except Exception:
+            # Including StopAsyncIteration at the end of the stream
+            await self.aclose()
+            raise
+        self._position += 1
+        return item
+
+    async def aclose(self):
+        if self._open:
+            self._open = False
+            closing = self._shared.detach()
+            if closing is not None:
+                await closing
+
+    def __del__(self):
+        # A reader dropped without aclose(), e.g. by a request handler that was cancelled
+        if self._open:
+            self._open = False
+            closing = self._shared.detach()
+            if closing is not None:
+                loop = self._shared._loop
+                if loop.is_closed():
+                    closing.close()
+                else:
+                    loop.call_soon_threadsafe(loop.create_task, closing)
@@ -0,0 +1,421 @@
+"""Admission control and quota-aware scheduling of upstream model and embedding calls.
+
+Every Gemini call goes through one UpstreamScheduler. A call waits in a
+queue until the token bucket of its kind ('generate' or 'embed') has a
+token and one of the shared in-flight slots is free, and queued calls are
+admitted strictly by priority: interactive chat turns and query embeddings,
+then bulk document embedding, then background work such as conversation
+summaries. A few slots are kept for interactive calls, so a large PDF
+ingest cannot hold every slot while a student waits for an answer.
+
+A call that would wait longer than its priority allows, or find its queue
+full, is refused at once with UpstreamBusy; the chat routes answer that with
+a 503 and Retry-After instead of holding the request until it times out.
+Quota errors (HTTP 429, RESOURCE_EXHAUSTED) pause the kind's bucket, so the
+calls queued behind them back off too, and are retried after a jittered
+exponential delay.
+"""
+import asyncio
+import itertools
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+PRIORITIES = ('interactive', 'bulk', 'background')
+# How long a call of each priority may wait for admission before it is refused, in seconds
+DEFAULT_MAX_WAIT = {'interactive': 10.0, 'bulk': 300.0, 'background': 60.0}
+
+
+class UpstreamBusy(Exception):
+    """A call refused by admission control; retry_after is how long to wait before trying again, in seconds"""
+
+    def __init__(self, message, retry_after=1.0, reason='wait'):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+def is_quota_error(error):
+    """Whether an upstream error means the call was rate limited (HTTP 429 or RESOURCE_EXHAUSTED)"""
+    if type(error).__name__ in ('ResourceExhausted', 'TooManyRequests'):
+        return True
+    if 429 in (getattr(error, 'code', None), getattr(error, 'status_code', None)):
+        return True
+    text = str(error).lower()
+    return '429' in text or 'resource has been exhausted' in text or 'quota' in text or 'rate limit' in text
+
+
+class TokenBucket:
+    """rate tokens per second, up to burst; a rate of 0 admits every call"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def ready_in(self, now, calls=1):
+        """Seconds until the next calls calls can all take a token"""
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = (calls - self.tokens) / self.rate if self.rate and self.tokens < calls else 0.0
+        return max(wait, self.paused_until - now)
+
+    def take(self):
+        if self.rate:
+            self.tokens -= 1
+
+    def pause(self, now, seconds):
+        """Admit nothing for seconds, after the upstream service said the quota is used up"""
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = min(self.tokens, 0.0)
+
+
+class Waiter:
+    __slots__ = ('kind', 'priority', 'rank', 'seq', 'enqueued', 'wake', 'granted')
+
+    def __init__(self, kind, priority, seq, wake):
+        self.kind = kind
+        self.priority = priority
+        self.rank = PRIORITIES.index(priority)
+        self.seq = seq
+        self.enqueued = time.monotonic()
+        self.wake = wake
+        self.granted = False
+
+
+class UpstreamScheduler:
+    """Token buckets per kind of call, shared in-flight slots and priority queues in front of the upstream API"""
+
+    def __init__(self, rates, max_in_flight=16, reserved_slots=2, max_queue=64, max_wait=None,
+                 max_retries=3, base_delay=0.5, max_delay=8.0, burst_seconds=10.0,
+                 queue_depth=None, wait_seconds=None, shed=None, retries=None):
+        # rates: calls per second allowed for each kind (0 = unlimited), with burst_seconds' worth of burst
+        self.buckets = {kind: TokenBucket(rate, int(rate * burst_seconds)) for kind, rate in rates.items()}
+        self.max_in_flight = max_in_flight
+        # Slots only interactive calls may take
+        self.reserved_slots = min(reserved_slots, max_in_flight - 1)
+        self.max_queue = max_queue
+        self.max_wait = dict(DEFAULT_MAX_WAIT, **(max_wait or {}))
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # Metrics: queue depth gauge {kind,priority}, admission wait histogram {kind,priority},
+        # shed counter {kind,priority,reason} and quota retry counter {kind}
+        self.queue_depth = queue_depth
+        self.wait_seconds = wait_seconds
+        self.shed = shed
+        self.retries = retries
+        self.in_flight = 0
+        self.admitted = 0
+        self.refused = 0
+        self.quota_errors = 0
+        # (kind, priority) -> [seconds waited, calls admitted]
+        self.waits = {}
+        self._waiting = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._dispatcher = None
+
+    def call(self, kind, priority, func, max_wait=None):
+        """func() once admitted, retried after quota errors"""
+        for attempt in itertools.count():
+            with self.slot(kind, priority, max_wait):
+                try:
+                    return func()
+                except Exception as e:
+                    delay = self._after_error(kind, attempt, e)
+            time.sleep(delay)
+
+    def stream(self, kind, priority, func, max_wait=None):
+        """Like call() for func returning an iterator; the slot is held until the iterator is done or closed"""
+        for attempt in itertools.count():
+            self.acquire(kind, priority, max_wait)
+            try:
+                iterator = iter(func())
+            except BaseException as e:
+                self.release()
+                if not isinstance(e, Exception):
+                    raise
+                time.sleep(self._after_error(kind, attempt, e))
+                continue
+            return HeldStream(iterator, self.release)
+
+    async def acall(self, kind, priority, factory, max_wait=None):
+        """call() for a coroutine: the result of awaiting factory() once admitted"""
+        for attempt in itertools.count():
+            await self.acquire_async(kind, priority, max_wait)
+            try:
+                return await factory()
+            except Exception as e:
+                delay = self._after_error(kind, attempt, e)
+            finally:
+                self.release()
+            await asyncio.sleep(delay)
+
+    async def astream(self, kind, priority, factory, max_wait=None):
+        """stream() for a coroutine returning an async iterator"""
+        for attempt in itertools.count():
+            await self.acquire_async(kind, priority, max_wait)
+            try:
+                iterator = aiter(await factory())
+            except BaseException as e:
+                self.release()
+                if not isinstance(e, Exception):
+                    raise
+                await asyncio.sleep(self._after_error(kind, attempt, e))
+                continue
+            return HeldAsyncStream(iterator, self.release)
+
+    @contextmanager
+    def slot(self, kind, priority, max_wait=None):
+        self.acquire(kind, priority, max_wait)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def acquire(self, kind, priority, max_wait=None):
+        """Wait for admission; raises UpstreamBusy if it would take longer than the priority's max wait"""
+        event = threading.Event()
+        timeout = self.max_wait[priority] if max_wait is None else max_wait
+        waiter = self._enqueue(kind, priority, timeout, event.set)
+        if not event.wait(timeout) and self._abandon(waiter):
+            self._refuse(kind, priority, 'timeout', f"no {kind} capacity within {timeout:.1f} s", timeout)
+
+    async def acquire_async(self, kind, priority, max_wait=None):
+        loop = asyncio.get_running_loop()
+        admitted = loop.create_future()
+        timeout = self.max_wait[priority] if max_wait is None else max_wait
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: admitted.done() or admitted.set_result(None))
+
+        waiter = self._enqueue(kind, priority, timeout, wake)
+        try:
+            await asyncio.wait_for(admitted, timeout)
+        except asyncio.TimeoutError:
+            if self._abandon(waiter):
+                self._refuse(kind, priority, 'timeout', f"no {kind} capacity within {timeout:.1f} s", timeout)
+        except asyncio.CancelledError:
+            if not self._abandon(waiter):
+                # Admitted just as the caller went away; give the slot back
+                self.release()
+            raise
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._dispatch()
+            self._cond.notify()
+
+    def check(self, kind, priority):
+        """Raise UpstreamBusy now if a call of this kind and priority would be refused, without queueing it"""
+        with self._cond:
+            refusal = self._refusal(kind, priority, self.max_wait[priority])
+        if refusal:
+            self._refuse(kind, priority, *refusal)
+
+    def stats(self):
+        with self._cond:
+            now = time.monotonic()
+            return {
+                'inFlight': self.in_flight,
+                'maxInFlight': self.max_in_flight,
+                'admitted': self.admitted,
+                'refused': self.refused,
+                'quotaErrors': self.quota_errors,
+                'queued': {
+                    kind: {priority: sum(w.kind == kind and w.priority == priority for w in self._waiting)
+                           for priority in PRIORITIES}
+                    for kind in self.buckets
+                },
+                'meanWaitMs': {
+                    kind: {priority: round(total / count * 1000, 1)
+                           for (waited_kind, priority), (total, count) in self.waits.items() if waited_kind == kind}
+                    for kind in self.buckets
+                },
+                'buckets': {
+                    kind: {'ratePerSecond': bucket.rate, 'tokens': round(bucket.tokens, 2),
+                           'readyInMs': round(bucket.ready_in(now) * 1000)}
+                    for kind, bucket in self.buckets.items()
+                }
+            }
+
+    def _enqueue(self, kind, priority, timeout, wake):
+        with self._cond:
+            refusal = self._refusal(kind, priority, timeout)
+            if refusal is None:
+                waiter = Waiter(kind, priority, next(self._seq), wake)
+                self._waiting.append(waiter)
+                self._dispatch()
+                self._record_depth(kind, priority)
+                self._start_dispatcher()
+                self._cond.notify()
+        if refusal:
+            self._refuse(kind, priority, *refusal)
+        return waiter
+
+    def _refusal(self, kind, priority, timeout):
+        """(reason, message, retry after) if a new call would be refused, else None"""
+        rank = PRIORITIES.index(priority)
+        ahead = sum(w.kind == kind and w.rank <= rank for w in self._waiting)
+        if ahead >= self.max_queue:
+            return 'queue_full', f"{ahead} {kind} calls already queued", self.max_wait[priority]
+        # The bucket's refill rate bounds how fast the calls ahead can go
+        estimate = self.buckets[kind].ready_in(time.monotonic(), ahead + 1)
+        if estimate > timeout:
+            return 'wait', f"{kind} calls are rate limited; about {estimate:.1f} s to wait", estimate
+        return None
+
+    def _refuse(self, kind, priority, reason, message, retry_after):
+        with self._cond:
+            self.refused += 1
+        if self.shed:
+            self.shed.inc(kind=kind, priority=priority, reason=reason)
+        raise UpstreamBusy(message, retry_after=max(1.0, retry_after), reason=reason)
+
+    def _abandon(self, waiter):
+        """Take a waiter out of its queue; False if it was admitted first"""
+        with self._cond:
+            if waiter.granted:
+                return False
+            self._waiting.remove(waiter)
+            self._record_depth(waiter.kind, waiter.priority)
+            return True
+
+    def _dispatch(self):
+        """Admit what can go now, best priority first; returns seconds until a bucket may admit more"""
+        now = time.monotonic()
+        next_check = None
+        blocked = set()
+        for waiter in sorted(self._waiting, key=lambda w: (w.rank, w.seq)):
+            if self.in_flight >= self.max_in_flight - (self.reserved_slots if waiter.rank else 0):
+                # Every waiter after this one has the same or a lower priority
+                break
+            if waiter.kind in blocked:
+                continue
+            ready_in = self.buckets[waiter.kind].ready_in(now)
+            if ready_in > 0:
+                # Later calls of this kind must not overtake it
+                blocked.add(waiter.kind)
+                next_check = ready_in if next_check is None else min(next_check, ready_in)
+                continue
+            self.buckets[waiter.kind].take()
+            self.in_flight += 1
+            self.admitted += 1
+            self._waiting.remove(waiter)
+            waiter.granted = True
+            waiter.wake()
+            self._record_depth(waiter.kind, waiter.priority)
+            waited = self.waits.setdefault((waiter.kind, waiter.priority), [0.0, 0])
+            waited[0] += now - waiter.enqueued
+            waited[1] += 1
+            if self.wait_seconds:
+                self.wait_seconds.observe(now - waiter.enqueued, kind=waiter.kind, priority=waiter.priority)
+        return next_check
+
+    def _start_dispatcher(self):
+        # Admits calls as buckets refill; started on first use so importing the app starts no threads
+        if self._dispatcher is None:
+            self._dispatcher = threading.Thread(target=self._run, name='upstream-dispatch', daemon=True)
+            self._dispatcher.start()
+
+    def _run(self):
+        with self._cond:
+            while True:
+                delay = self._dispatch() if self._waiting else None
+                self._cond.wait(delay)
+
+    def _after_error(self, kind, attempt, error):
+        """Delay before retrying a call that failed with a quota error; re-raises any other error"""
+        if not is_quota_error(error):
+            raise error
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        with self._cond:
+            self.quota_errors += 1
+            # Queued calls of the same kind would hit the same limit, so they wait as well
+            self.buckets[kind].pause(time.monotonic(), delay)
+            self._cond.notify()
+        if attempt >= self.max_retries:
+            raise UpstreamBusy(f"{kind} quota exhausted after {attempt + 1} attempts: {error}",
+                               retry_after=max(1.0, delay), reason='quota') from error
+        if self.retries:
+            self.retries.inc(kind=kind)
+        print(f"Upstream {kind} call rate limited ({type(error).__name__}); retrying in {delay:.2f} s")
+        return delay
+
+    def _record_depth(self, kind, priority):
+        if self.queue_depth:
+            self.queue_depth.set(sum(w.kind == kind and w.priority == priority for w in self._waiting),
+                                 kind=kind, priority=priority)
+
+
+class HeldStream:
+    """An upstream iterator holding a scheduler slot until it ends, is closed or is garbage collected"""
+
+    def __init__(self, iterator, release):
+        self._iterator = iterator
+        self._release = release
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._iterator)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        release, self._release = self._release, None
+        if release is None:
+            return
+        try:
+            close = getattr(self._iterator, 'close', None)
+            if close:
+                close()
+        finally:
+            release()
+
+    def __del__(self):
+        self.close()
+
+
+class HeldAsyncStream:
+    """HeldStream for an async iterator"""
+
+    def __init__(self, iterator, release):
+        self._iterator = iterator
+        self._release = release
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await anext(self._iterator)
+        except BaseException:
+            await self.aclose()
+            raise
+
+    async def aclose(self):
+        release, self._release = self._release, None
+        if release is None:
+            return
+        try:
+            close = getattr(self._iterator, 'aclose', None)
+            if close:
+                await close()
+        finally:
+            release()
+
+    def __del__(self):
+        # Without a loop to close the iterator on, at least give the slot back
+        release, self._release = self._release, None
+        if release is not None:
+            release()
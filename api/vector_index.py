@@ -0,0 +1,271 @@
+"""Per-session hybrid (vector + BM25) index over every document a session has uploaded.
+
+Vectors are L2-normalized and searched by inner product, so scores are
+cosine similarities. The FAISS index grows in place with add() and
+switches type as the corpus grows: exact flat search for small corpora,
+HNSW once a linear scan gets slow, and IVF for very large ones where HNSW
+builds get expensive. A BM25 index over the same chunks is kept next to
+it; search() fuses both rankings, or uses BM25 alone when there is no
+query vector. Every chunk keeps the name of the document it came from and
+its page, and search() returns them with each hit.
+"""
+import json
+import os
+import sys
+import threading
+
+import numpy as np
+
+from lexical_index import BM25Index
+
+# Corpus sizes (vectors) at which the index is rebuilt as the next type
+FLAT_MAX_VECTORS = 10000
+HNSW_MAX_VECTORS = 100000
+
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = 128
+# IVF probes this fraction of its lists per query
+IVF_PROBE_FRACTION = 1 / 16
+
+# Candidates taken from each ranking before fusion, and the reciprocal rank fusion constant
+FUSION_CANDIDATES = 20
+RRF_K = 60
+# BM25 candidates scoring below this fraction of the best one matched only common words
+# (rank fusion would otherwise credit them as much as an exact theorem-number match)
+LEXICAL_MIN_FRACTION = 0.25
+
+
+def normalize(vectors):
+    """float32 copy of vectors with every row scaled to unit length (zero rows stay zero)"""
+    vectors = np.array(vectors, dtype='float32', ndmin=2)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def index_kind(count, flat_max=FLAT_MAX_VECTORS, hnsw_max=HNSW_MAX_VECTORS):
+    """Index type for a corpus of count vectors"""
+    if count <= flat_max:
+        return 'flat'
+    if count <= hnsw_max:
+        return 'hnsw'
+    return 'ivf'
+
+
+def build_index(kind, vectors):
+    """New FAISS inner-product index of the given kind holding the (normalized) vectors"""
+    import faiss
+
+    dimension = vectors.shape[1]
+    if kind == 'flat':
+        index = faiss.IndexFlatIP(dimension)
+    elif kind == 'hnsw':
+        index = faiss.IndexHNSWFlat(dimension, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    else:
+        # ~4 * sqrt(n) lists, trained on the corpus collected so far (FAISS wants >= 39 points per list)
+        nlist = max(1, min(int(4 * len(vectors) ** 0.5), len(vectors) // 39))
+        index = faiss.IndexIVFFlat(faiss.IndexFlatIP(dimension), dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        index.nprobe = max(1, int(nlist * IVF_PROBE_FRACTION))
+        # Lets search() reconstruct vectors of chunks found only by BM25
+        index.make_direct_map()
+    index.add(vectors)
+    return index
+
+
+class MappedFlatIndex:
+    """Exact inner-product search over a read-only (e.g. memory-mapped) matrix, searched in place.
+
+    Implements the part of the FAISS index interface SessionIndex uses, so
+    processes mapping the same vector file share one copy in the page cache
+    instead of each holding its own.
+    """
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.d = vectors.shape[1]
+
+    @property
+    def ntotal(self):
+        return len(self.vectors)
+
+    def search(self, queries, k):
+        scores = queries @ self.vectors.T
+        k = min(k, self.ntotal)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        return np.take_along_axis(top_scores, order, axis=1), np.take_along_axis(top, order, axis=1)
+
+    def reconstruct(self, i):
+        return np.array(self.vectors[i])
+
+    def reconstruct_n(self, start, count):
+        return np.array(self.vectors[start:start + count])
+
+
+def all_vectors(index):
+    """Every vector stored in a flat, HNSW or IVF index, in insertion order"""
+    import faiss
+
+    if isinstance(index, MappedFlatIndex):
+        return index.reconstruct_n(0, index.ntotal)
+    if isinstance(index, faiss.IndexIVF):
+        index.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+class SessionIndex:
+    """Incremental multi-document cosine index with per-chunk document and page metadata"""
+
+    def __init__(self, flat_max=FLAT_MAX_VECTORS, hnsw_max=HNSW_MAX_VECTORS):
+        self.flat_max = flat_max
+        self.hnsw_max = hnsw_max
+        self.index = None
+        self.kind = None
+        self.chunks = []
+        self.lexical = BM25Index()
+        # document ID -> {'name', 'chunks'}, in upload order
+        self.documents = {}
+        self._lock = threading.RLock()
+
+    def add(self, vectors, chunks, document_id, document_name, mapped=None):
+        """Append chunks of a document with their embeddings; an index rebuild happens only on a type switch.
+
+        mapped, if given, is every (normalized) vector so far including the new
+        ones, e.g. a memory-mapped file; while the index is flat it is searched
+        in place rather than copied.
+        """
+        if not len(chunks):
+            return
+        vectors = normalize(vectors) if mapped is None else mapped[-len(chunks):]
+        with self._lock:
+            count = len(self.chunks) + len(chunks)
+            kind = index_kind(count, self.flat_max, self.hnsw_max)
+            if mapped is not None and kind == 'flat':
+                self.index = MappedFlatIndex(mapped)
+            elif self.index is None or kind != self.kind:
+                if mapped is not None:
+                    every = np.ascontiguousarray(mapped)
+                else:
+                    existing = [all_vectors(self.index)] if self.index is not None and self.index.ntotal else []
+                    every = np.vstack(existing + [vectors])
+                self.index = build_index(kind, every)
+                if self.kind:
+                    print(f"Vector index switched from {self.kind} to {kind} at {count} vectors")
+            else:
+                self.index.add(vectors)
+            self.kind = kind
+            self.chunks.extend(dict(chunk, document=document_name) for chunk in chunks)
+            self.lexical.add(chunk['text'] for chunk in chunks)
+            document = self.documents.setdefault(document_id, {'name': document_name, 'chunks': 0})
+            document['chunks'] += len(chunks)
+
+    def has_document(self, document_id):
+        with self._lock:
+            return document_id in self.documents
+
+    @property
+    def document_id(self):
+        """Identifies the indexed content (documents and how much of each is indexed), for cache keys"""
+        with self._lock:
+            return ','.join(f"{doc_id}:{doc['chunks']}" for doc_id, doc in self.documents.items()) or None
+
+    def search(self, query_text, query_vector=None, top_k=3, candidates=FUSION_CANDIDATES):
+        """Best chunks for a query, fusing vector and BM25 rankings (BM25 only without a query vector).
+
+        Each hit is the chunk dict plus score (cosine similarity), distance
+        (squared L2 between the unit vectors, 2 - 2 * score), bm25 and fused
+        (reciprocal rank fusion) scores; score and distance are None without
+        a query vector.
+        """
+        with self._lock:
+            if self.index is None or not self.chunks:
+                return []
+            lexical = self.lexical.search(query_text, candidates)
+            rankings = [[(i, score) for i, score in lexical if score >= lexical[0][1] * LEXICAL_MIN_FRACTION]]
+            cosine = {}
+            if query_vector is not None:
+                query = normalize(query_vector)
+                scores, indices = self.index.search(query, min(candidates, len(self.chunks)))
+                dense = [(int(i), float(score)) for score, i in zip(scores[0], indices[0]) if 0 <= i < len(self.chunks)]
+                rankings.append(dense)
+                cosine = dict(dense)
+
+            fused = {}
+            for ranking in rankings:
+                for rank, (i, _) in enumerate(ranking):
+                    fused[i] = fused.get(i, 0.0) + 1 / (RRF_K + rank + 1)
+            best = sorted(fused, key=fused.get, reverse=True)[:top_k]
+
+            if query_vector is not None:
+                # Chunks found only by BM25 get their exact cosine too, so every hit can be thresholded
+                for i in best:
+                    if i not in cosine:
+                        cosine[i] = float(self.index.reconstruct(i) @ query[0])
+            bm25 = dict(lexical)
+            return [
+                dict(
+                    self.chunks[i],
+                    score=cosine.get(i),
+                    distance=2 - 2 * cosine[i] if i in cosine else None,
+                    bm25=bm25.get(i, 0.0),
+                    fused=fused[i]
+                )
+                for i in best
+            ]
+
+    def nbytes(self):
+        """Approximate resident size of the vectors, graph links, chunk text and BM25 postings"""
+        with self._lock:
+            if self.index is None:
+                return 0
+            # Mapped vectors live in the shared page cache, not in this process
+            vector_bytes = 0 if isinstance(self.index, MappedFlatIndex) else self.index.ntotal * self.index.d * 4
+            if self.kind == 'hnsw':
+                vector_bytes += self.index.ntotal * HNSW_M * 2 * 4
+            chunk_bytes = sum(sys.getsizeof(chunk) + sys.getsizeof(chunk['text']) for chunk in self.chunks)
+            return vector_bytes + chunk_bytes + sys.getsizeof(self.chunks) + self.lexical.nbytes()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'kind': self.kind,
+                'vectors': len(self.chunks),
+                'documents': [{'name': doc['name'], 'chunks': doc['chunks']} for doc in self.documents.values()]
+            }
+
+    def save(self, path):
+        import faiss
+
+        with self._lock:
+            os.makedirs(path, exist_ok=True)
+            faiss.write_index(self.index, os.path.join(path, 'index.faiss'))
+            with open(os.path.join(path, 'chunks.json'), 'w', encoding='utf-8') as f:
+                json.dump(self.chunks, f)
+            with open(os.path.join(path, 'documents.json'), 'w', encoding='utf-8') as f:
+                json.dump({'kind': self.kind, 'documents': self.documents,
+                           'flatMax': self.flat_max, 'hnswMax': self.hnsw_max}, f)
+
+    @classmethod
+    def load(cls, path):
+        import faiss
+
+        with open(os.path.join(path, 'documents.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        session_index = cls(meta['flatMax'], meta['hnswMax'])
+        session_index.index = faiss.read_index(os.path.join(path, 'index.faiss'))
+        with open(os.path.join(path, 'chunks.json'), encoding='utf-8') as f:
+            session_index.chunks = json.load(f)
+        session_index.kind = meta['kind']
+        session_index.documents = meta['documents']
+        if session_index.kind == 'hnsw':
+            session_index.index.hnsw.efSearch = HNSW_EF_SEARCH
+        elif session_index.kind == 'ivf':
+            session_index.index.make_direct_map()
+        # Rebuilding BM25 from the chunk text is cheaper than storing the postings
+        session_index.lexical.add(chunk['text'] for chunk in session_index.chunks)
+        return session_index
@@ -0,0 +1,170 @@
+"""Chat turns and a PDF ingest against a rate-limited model service, with and without admission control.
+
+Usage: python benchmarks/bench_admission.py [--chats 60] [--window-s 4] [--quota-rpm 1200] [--chunks 600]
+
+Runs the app in-process on the fake model backend with a quota: chat and
+embedding calls beyond --quota-rpm per minute each fail with a 429, the
+way Gemini answers once a project is over its limits. --chats students
+on sessions with a document send a question within --window-s while a
+large PDF of --chunks chunks is being embedded, so their query embeddings
+compete with the ingest for the embedding quota. The same load runs with
+every call sent straight upstream and through the scheduler configured
+for the quota, and reports how the chats ended (answered, AI error, 503),
+their latency, query embeddings that fell back to lexical retrieval, the
+ingest, and the 429s the service returned.
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+
+def configure(args):
+    os.environ.update({
+        'MODEL_BACKEND': 'fake',
+        'FAKE_MODEL_LATENCY_MS': '300',
+        'FAKE_EMBED_LATENCY_MS': '100',
+        'VERBOSE_LOGGING': '0',
+        'RESPONSE_CACHE_DB': '',
+        'RESPONSE_CACHE_SIZE': '0',
+        'LOCAL_FAST_PATH': '0',
+        'CONVERSATION_SUMMARY': '0',
+        'EMBED_BATCH_SIZE': '10',
+        'EMBED_CONCURRENCY': '8',
+        'EMBEDDING_CACHE_DIR': tempfile.mkdtemp(),
+        'SESSION_SPILL_DIR': tempfile.mkdtemp()
+    })
+    sys.path.insert(0, str(Path(__file__).parent.parent / 'api'))
+
+
+def add_documents(index, sessions):
+    chunks = [{'text': f"Theorem {n}.{n % 7}: every bounded monotone sequence of order {n} converges", 'page': n // 3 + 1}
+              for n in range(60)]
+    vectors = index.np.array(index.backend.embed_content(
+        model=index.EMBEDDING_MODEL, content=[chunk['text'] for chunk in chunks], task_type='retrieval_document'
+    )['embedding'], dtype='float32')
+    for session_id in sessions:
+        index.add_session_document(session_id, vectors, chunks, 'notes.pdf', 'notes.pdf')
+
+
+def run(index, run_name, args):
+    """One burst of chats during an ingest; returns (chat results, ingest seconds, chunks embedded)"""
+    client = index.app.test_client()
+    offsets = sorted(random.Random(0).uniform(0, args.window_s) for _ in range(args.chats))
+    chunks = [{'text': f"{run_name} handout section {n}: the derivative of x^{n % 9} is {n % 9}x^{n % 9 - 1}", 'page': n}
+              for n in range(args.chunks)]
+    ingest = {}
+
+    def embed_handout():
+        started = time.perf_counter()
+        _, valid = index.create_embeddings(chunks)
+        ingest['seconds'] = time.perf_counter() - started
+        ingest['chunks'] = len(valid)
+
+    ingest_thread = threading.Thread(target=embed_handout)
+    start = time.perf_counter()
+    ingest_thread.start()
+
+    def chat(n):
+        time.sleep(max(0.0, start + offsets[n] - time.perf_counter()))
+        began = time.perf_counter()
+        response = client.post('/api/chat', json={
+            'message': f"what does theorem {n % 60} say about sequences? ({run_name} {n})",
+            'sessionId': f"{run_name}-{n}",
+            'currentExpressions': []
+        })
+        seconds = time.perf_counter() - began
+        if response.status_code == 503:
+            return 'busy (503)', seconds
+        if response.get_json()['chatResponse'].startswith('Sorry, there was an error'):
+            return 'AI error', seconds
+        return 'answered', seconds
+
+    with ThreadPoolExecutor(max_workers=args.chats) as pool:
+        results = list(pool.map(chat, range(args.chats)))
+    ingest_thread.join()
+    return results, ingest['seconds'], ingest['chunks']
+
+
+def report(name, results, ingest_seconds, ingest_chunks, quota_errors, queries, args):
+    print(f"\n{name}")
+    outcomes = {}
+    for outcome, seconds in results:
+        outcomes.setdefault(outcome, []).append(seconds)
+    for outcome in ('answered', 'AI error', 'busy (503)'):
+        latencies = sorted(outcomes.get(outcome, []))
+        if not latencies:
+            print(f"  {outcome:<11} {0:4d}")
+            continue
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(f"  {outcome:<11} {len(latencies):4d}  p50 {statistics.median(latencies) * 1000:6.0f} ms  p95 {p95 * 1000:6.0f} ms")
+    print(f"  query embeddings: {queries.get('api', 0)} from the API, {queries.get('failed', 0)} failed, "
+          f"{queries.get('skipped', 0)} skipped while the embedding API cooled down (lexical retrieval)")
+    print(f"  ingest: {ingest_chunks}/{args.chunks} chunks embedded in {ingest_seconds:.1f} s")
+    print(f"  429s from the service: {quota_errors}")
+
+
+def query_counts(index):
+    counts = {}
+    for line in index.QUERY_EMBEDDINGS.render():
+        if not line.startswith('#'):
+            labels, value = line.rsplit(' ', 1)
+            counts[labels.split('"')[1]] = int(float(value))
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--chats', type=int, default=60)
+    parser.add_argument('--window-s', type=float, default=4.0)
+    parser.add_argument('--quota-rpm', type=int, default=1200)
+    parser.add_argument('--chunks', type=int, default=600)
+    parser.add_argument('--max-wait-ms', type=int, default=4000)
+    args = parser.parse_args()
+    configure(args)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import index
+        from upstream_scheduler import UpstreamScheduler
+    for run_name in ('direct', 'scheduled'):
+        add_documents(index, [f"{run_name}-{n}" for n in range(args.chats)])
+    backend = index.backend
+    backend.quota_rpm = args.quota_rpm
+    print(f"{args.chats} chats within {args.window_s:.0f} s during a {args.chunks}-chunk ingest; "
+          f"quota {args.quota_rpm} chat and {args.quota_rpm} embedding calls a minute")
+
+    # The fake refills its quota a second's worth at a time, so the buckets get one second of burst
+    rate = args.quota_rpm / 60
+    runs = [
+        ('straight upstream (no limits, no retries)',
+         UpstreamScheduler({'generate': 0, 'embed': 0}, max_in_flight=10 ** 6, reserved_slots=0, max_retries=0)),
+        ('admission control at the quota',
+         UpstreamScheduler({'generate': rate, 'embed': rate}, burst_seconds=1.0,
+                           max_wait={'interactive': args.max_wait_ms / 1000}))
+    ]
+    for run_name, (name, scheduler) in zip(('direct', 'scheduled'), runs):
+        index.upstream = scheduler
+        index.embed_breaker.record_success()
+        # The fake's quota starts full for each run
+        backend._quota.clear()
+        before_errors, before_queries = backend.quota_errors, query_counts(index)
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = run(index, run_name, args)
+        queries = {source: count - before_queries.get(source, 0) for source, count in query_counts(index).items()}
+        report(name, *results, backend.quota_errors - before_errors, queries, args)
+        if rate and scheduler.buckets['embed'].rate:
+            stats = scheduler.stats()
+            print(f"  mean admission wait (ms): {stats['meanWaitMs']}")
+            print(f"  refused {stats['refused']}, 429s retried {stats['quotaErrors']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""Concurrent chats through the async (ASGI) pipeline against the Flask route on a thread pool.
+
+Usage: python benchmarks/bench_async_chat.py [--chats 300] [--threads 16] [--latency-ms 500]
+                                             [--slow-rate 0.05] [--slow-ms 5000] [--hedge-ms 1000]
+
+Runs the app in-process on the fake model backend. Each chat is a distinct
+question in its own session, half of them on a session with an indexed
+document so retrieval runs too. The Flask route gets a pool of --threads
+workers (like gunicorn's threads); the ASGI app is driven by one event
+loop. Then a --slow-rate fraction of model calls takes --slow-ms longer,
+and the async pipeline runs with and without hedging after --hedge-ms.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+
+def configure(args):
+    os.environ.update({
+        'MODEL_BACKEND': 'fake',
+        'FAKE_MODEL_LATENCY_MS': str(args.latency_ms),
+        'FAKE_EMBED_LATENCY_MS': '50',
+        'VERBOSE_LOGGING': '0',
+        'RESPONSE_CACHE_DB': '',
+        'EMBEDDING_CACHE_DIR': tempfile.mkdtemp(),
+        'SESSION_SPILL_DIR': tempfile.mkdtemp()
+    })
+    sys.path.insert(0, str(Path(__file__).parent.parent / 'api'))
+
+
+def add_documents(index, sessions):
+    chunks = [{'text': f"Theorem {n}.{n % 7}: every bounded monotone sequence of order {n} converges", 'page': n // 3 + 1}
+              for n in range(60)]
+    vectors = index.np.array(index.backend.embed_content(
+        model=index.EMBEDDING_MODEL, content=[chunk['text'] for chunk in chunks], task_type='retrieval_document'
+    )['embedding'], dtype='float32')
+    for session_id in sessions:
+        index.add_session_document(session_id, vectors, chunks, 'notes.pdf', 'notes.pdf')
+
+
+def request_body(run, n):
+    return {
+        'message': f"explain theorem {n % 60} about sequences ({run} {n})",
+        'sessionId': f"{run}-{n}",
+        'currentExpressions': [{'id': f'graph_{i}', 'latex': f'y=\\sin({i}x)'} for i in range(20)]
+    }
+
+
+async def asgi_chat(app, body):
+    """One POST /api/chat through the ASGI app; returns (seconds, status)"""
+    payload = json.dumps(body).encode('utf-8')
+    scope = {'type': 'http', 'method': 'POST', 'path': '/api/chat', 'headers': [(b'content-type', b'application/json')]}
+    messages = [{'type': 'http.request', 'body': payload}]
+    status = {}
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status['code'] = message['status']
+
+    start = time.perf_counter()
+    await app(scope, receive, send)
+    return time.perf_counter() - start, status['code']
+
+
+async def run_async(app, run, chats):
+    return await asyncio.gather(*(asgi_chat(app, request_body(run, n)) for n in range(chats)))
+
+
+def run_sync(flask_app, run, chats, threads):
+    client = flask_app.test_client()
+
+    # Every chat arrives at once, so a chat's latency includes its wait for a free thread
+    start = time.perf_counter()
+
+    def one(n):
+        status = client.post('/api/chat', json=request_body(run, n)).status_code
+        return time.perf_counter() - start, status
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return list(pool.map(one, range(chats)))
+
+
+def report(name, results, seconds):
+    latencies = sorted(latency for latency, _ in results)
+    failed = sum(status != 200 for _, status in results)
+    p95, p99 = (latencies[min(len(latencies) - 1, int(len(latencies) * q))] for q in (0.95, 0.99))
+    print(f"  {name:<28} {len(results) / seconds:7.1f} chats/s  wall {seconds:6.2f} s  "
+          f"p50 {statistics.median(latencies) * 1000:6.0f} ms  p95 {p95 * 1000:6.0f} ms  "
+          f"p99 {p99 * 1000:6.0f} ms  failed {failed}")
+
+
+def timed(function):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = function()
+    return results, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--chats', type=int, default=300)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--latency-ms', type=int, default=500)
+    parser.add_argument('--slow-rate', type=float, default=0.05)
+    parser.add_argument('--slow-ms', type=int, default=5000)
+    parser.add_argument('--hedge-ms', type=int, default=1000)
+    args = parser.parse_args()
+    configure(args)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import index
+        import asgi
+    half = range(0, args.chats, 2)
+    for run in ('sync', 'async', 'slow', 'hedged'):
+        add_documents(index, [f"{run}-{n}" for n in half])
+
+    print(f"{args.chats} concurrent chats, model latency {args.latency_ms} ms, "
+          f"documents on half of the sessions")
+    report(f"Flask, {args.threads} threads", *timed(lambda: run_sync(index.app, 'sync', args.chats, args.threads)))
+    report('ASGI, one event loop', *timed(lambda: asyncio.run(run_async(asgi.app, 'async', args.chats))))
+
+    print(f"\n{args.slow_rate:.0%} of model calls {args.slow_ms} ms slower")
+    index.backend.slow_rate = args.slow_rate
+    index.backend.slow_latency = args.slow_ms / 1000
+    index.MODEL_HEDGE_AFTER = None
+    report('ASGI, no hedging', *timed(lambda: asyncio.run(run_async(asgi.app, 'slow', args.chats))))
+    index.MODEL_HEDGE_AFTER = args.hedge_ms / 1000
+    report(f"ASGI, hedged after {args.hedge_ms} ms", *timed(lambda: asyncio.run(run_async(asgi.app, 'hedged', args.chats))))
+    print('  ' + '  '.join(line for line in index.MODEL_CALLS.render() + index.MODEL_HEDGES.render()
+                           if not line.startswith('#')))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""Cold-start time of the serverless entry point, with an import-time profile.
+
+Usage: python benchmarks/bench_cold_start.py [--runs 5] [--budget-ms 1500] [--top 10]
+
+Every scenario runs in a fresh interpreter, as a new serverless instance
+would: it imports api/index.py and sends one request through the Flask
+test client, reporting the import time, the time to the first response and
+which heavy modules (Gemini SDK, PyMuPDF, numpy, FAISS) ended up loaded.
+Model turns use MODEL_BACKEND=fake with no added latency, so the numbers
+are the app's own overhead. The script exits non-zero when the median time
+to first response of any scenario exceeds --budget-ms.
+
+The profile comes from `python -X importtime` and lists the slowest
+modules imported directly by index, by cumulative time.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+root = Path(__file__).parent.parent
+HEAVY_MODULES = ['google.generativeai', 'fitz', 'numpy', 'faiss']
+
+# Runs inside the fresh interpreter; prints the measurements as one RESULT line of JSON
+SCENARIO_CODE = r'''
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, 'api')
+import index
+imported = time.perf_counter()
+client = index.app.test_client()
+scenario = sys.argv[1]
+if scenario == 'page':
+    response = client.get('/')
+elif scenario == 'upload':
+    with open(sys.argv[2], 'rb') as pdf:
+        response = client.post('/api/upload_pdf', data={'sessionId': 'cold', 'pdf': (pdf, 'cold.pdf')},
+                               content_type='multipart/form-data')
+else:
+    response = client.post('/api/chat', json={'message': sys.argv[2], 'sessionId': 'cold', 'history': [],
+                                              'currentExpressions': []})
+finished = time.perf_counter()
+print('RESULT ' + json.dumps({
+    'status': response.status_code,
+    'importMs': (imported - started) * 1000,
+    'firstResponseMs': (finished - started) * 1000,
+    'loaded': [name for name in json.loads(sys.argv[3]) if name in sys.modules]
+}))
+'''
+
+SCENARIOS = {
+    'GET /': ['page', ''],
+    'fast-path chat': ['chat', 'plot y = 2x + 1'],
+    'model chat (fake)': ['chat', 'explain what a derivative is'],
+}
+
+
+def cold_env(cache_dir):
+    return dict(os.environ, MODEL_BACKEND='fake', FAKE_MODEL_LATENCY_MS='0', FAKE_STREAM_CHUNK_MS='0',
+                FAKE_EMBED_LATENCY_MS='0', VERBOSE_LOGGING='0', RESPONSE_CACHE_DB='',
+                EMBEDDING_CACHE_DIR=cache_dir, SESSION_SPILL_DIR=str(Path(cache_dir) / 'sessions'))
+
+
+def run_scenario(args, env):
+    result = subprocess.run([sys.executable, '-c', SCENARIO_CODE, *args, json.dumps(HEAVY_MODULES)],
+                            cwd=root, env=env, capture_output=True, text=True, check=True)
+    # Background ingestion may log after the result line
+    line = next(line for line in result.stdout.splitlines() if line.startswith('RESULT '))
+    return json.loads(line[len('RESULT '):])
+
+
+def import_profile(env):
+    """Total import time of api/index.py in ms and its direct imports as (cumulative ms, module)"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', "import sys; sys.path.insert(0, 'api'); import index"],
+                            cwd=root, env=env, capture_output=True, text=True, check=True)
+    # Children are listed before their parent, nested two spaces per level
+    segment = []
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)', line)
+        if not match:
+            continue
+        ms, depth, module = int(match.group(1)) / 1000, len(match.group(2)) // 2, match.group(3)
+        if depth == 0:
+            if module == 'index':
+                return ms, sorted(((child_ms, child) for child_ms, child_depth, child in segment if child_depth == 1), reverse=True)
+            segment = []
+        else:
+            segment.append((ms, depth, module))
+    return None, []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per scenario')
+    parser.add_argument('--budget-ms', type=float, default=1500, help='maximum median time to first response')
+    parser.add_argument('--top', type=int, default=10, help='modules to list in the import profile')
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(Path(__file__).parent))
+    from bench_pdf_extraction import make_corpus
+
+    over_budget = []
+    with tempfile.TemporaryDirectory() as workdir:
+        env = cold_env(workdir)
+        total_ms, modules = import_profile(env)
+        print(f"Import profile: index {total_ms:.0f} ms, slowest direct imports")
+        for ms, module in modules[:args.top]:
+            print(f"  {ms:8.1f} ms  {module}")
+
+        scenarios = dict(SCENARIOS)
+        scenarios['PDF upload (small)'] = ['upload', make_corpus(workdir)[0]]
+
+        print(f"\nCold start, median of {args.runs} fresh processes (budget {args.budget_ms:.0f} ms)")
+        for name, scenario in scenarios.items():
+            runs = [run_scenario(scenario, env) for _ in range(args.runs)]
+            import_ms = statistics.median(run['importMs'] for run in runs)
+            first_ms = statistics.median(run['firstResponseMs'] for run in runs)
+            verdict = 'ok' if first_ms <= args.budget_ms else 'OVER BUDGET'
+            if first_ms > args.budget_ms:
+                over_budget.append(name)
+            loaded = ', '.join(runs[-1]['loaded']) or 'none'
+            print(f"  {name:<20} import {import_ms:7.0f} ms  first response {first_ms:7.0f} ms  "
+                  f"status {runs[-1]['status']}  {verdict}  (heavy modules loaded: {loaded})")
+
+    if over_budget:
+        print(f"\nOver budget: {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
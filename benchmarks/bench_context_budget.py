@@ -0,0 +1,74 @@
+"""Prompt size with and without the token-budgeted context assembler.
+
+Usage: python benchmarks/bench_context_budget.py [--budget 8000]
+
+Runs a few turns of a conversation per scenario (small canvas, large
+canvas, long messages, several retrieved chunks) through Conversation with
+no budget and with a ContextBudget, printing the estimated input tokens of
+the last turn, how segments were reduced to fit on any turn and the cost
+of assembling the context.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'api'))
+from context_budget import ContextBudget
+from conversation import Conversation, contents_tokens, estimate_tokens
+
+SYSTEM_TOKENS = 1650
+TURNS = 8
+
+
+def canvas(size):
+    return [{'id': f'graph_{i}', 'latex': f'y=\\sin({i}x)+\\frac{{x^2}}{{{i + 1}}}'} for i in range(size)]
+
+
+def graph_text(expressions):
+    listed = "\n".join(f"- ID: '{expr['id']}', Expression: {expr['latex']}" for expr in expressions)
+    return f"CURRENT GRAPH STATE - These expressions are currently plotted:\n{listed}"
+
+
+SCENARIOS = {
+    'small canvas': dict(expressions=canvas(5), message='make the second curve steeper', reply_chars=600, chunks=0),
+    'large canvas (800)': dict(expressions=canvas(800), message='why do these oscillate?', reply_chars=600, chunks=0),
+    'long messages': dict(expressions=canvas(20), message='explain this derivation: ' + 'step ' * 1500,
+                          reply_chars=6000, chunks=0),
+    'PDF question': dict(expressions=canvas(20), message='what does theorem 3.2 say?', reply_chars=1500, chunks=3)
+}
+
+
+def run(scenario, budget):
+    conversation = Conversation([], budget=budget, system_tokens=SYSTEM_TOKENS)
+    chunks = [f"[notes.pdf, page {n}] " + 'The theorem states that ' * 40 for n in range(scenario['chunks'])]
+    elapsed = 0.0
+    reductions = {}
+    for _ in range(TURNS):
+        start = time.perf_counter()
+        turn = conversation.prepare(scenario['message'], scenario['expressions'], graph_text(scenario['expressions']), chunks)
+        elapsed += time.perf_counter() - start
+        conversation.commit(turn, 'x' * scenario['reply_chars'])
+        for segment, info in (turn.context['segments'] if turn.context else {}).items():
+            if info.get('level', 'full') != 'full':
+                reductions.setdefault(segment, set()).add(info['level'])
+    tokens = SYSTEM_TOKENS + contents_tokens(turn.history) + estimate_tokens(turn.message)
+    return tokens, reductions, elapsed / TURNS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--budget', type=int, default=8000)
+    args = parser.parse_args()
+
+    print(f"Estimated input tokens on turn {TURNS} (budget {args.budget})")
+    for name, scenario in SCENARIOS.items():
+        unbudgeted, _, _ = run(scenario, None)
+        budgeted, reductions, per_turn = run(scenario, ContextBudget(args.budget))
+        reduced = ', '.join(f"{segment} {'/'.join(sorted(levels))}" for segment, levels in reductions.items()) or 'nothing reduced'
+        print(f"  {name:<19} unbudgeted {unbudgeted:6d}  budgeted {budgeted:6d}  "
+              f"assembly {per_turn * 1000:6.2f} ms/turn  ({reduced})")
+
+
+if __name__ == '__main__':
+    main()
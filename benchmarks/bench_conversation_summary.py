@@ -0,0 +1,150 @@
+"""Prompt size and turn latency over a long tutoring session, with and without rolling summaries.
+
+Usage: python benchmarks/bench_conversation_summary.py [--turns 50] [--latency-ms 300] [--prefill-ms-per-1k 200]
+
+Runs the app in-process on the fake model backend, whose calls take
+--prefill-ms-per-1k longer per thousand input tokens the way a real model's
+time to first token grows with its prompt. One scripted student session of
+--turns questions (each with the graph the previous answers left) goes
+through /api/chat three times: keeping every message (within the token
+budget), with the old compaction that drops all but the last few messages,
+and with the rolling summary. Reports the input tokens sent per turn, turn
+latency early and late in the session, how many earlier messages each turn
+still carried verbatim or summarized, and what the summaries cost.
+"""
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+TOPICS = [
+    ('the derivative of x^2', 'why the slope of the tangent changes as x moves'),
+    ('the chain rule for sin(3x)', 'where the factor of 3 comes from'),
+    ('the product rule for x e^x', 'how the two terms relate to the graph'),
+    ('implicit differentiation of x^2+y^2=25', 'why dy/dx is -x/y'),
+    ('the limit of sin(x)/x at 0', 'how the squeeze theorem shows it is 1'),
+    ('the area under y=x^2 from 0 to 2', 'how Riemann sums approach 8/3'),
+    ('integration by parts for x cos(x)', 'how to choose u and dv'),
+    ('the mean value theorem on [1, 4] for sqrt(x)', 'what the point c means on the graph'),
+    ('a related rates problem with a ladder sliding down a wall', 'how the rates are linked'),
+    ('optimizing the area of a fenced rectangle with 40 m of fence', 'why the square is best')
+]
+FOLLOW_UPS = [
+    "Can you explain {topic} again more slowly? I want to understand {detail}, because my exam next week has questions exactly like this.",
+    "I tried {topic} on my own and got a different answer. Could you walk me through {detail} step by step and show it on the graph?",
+    "Going back to {topic}: how would the picture change if I doubled everything, and does that change {detail}?",
+    "My teacher said {topic} connects to what we did earlier. What is the connection, and how does it explain {detail}?",
+    "Please give me a practice problem like {topic} and then check my reasoning about {detail}."
+]
+
+
+def configure(args):
+    os.environ.update({
+        'MODEL_BACKEND': 'fake',
+        'FAKE_MODEL_LATENCY_MS': str(args.latency_ms),
+        'FAKE_PREFILL_MS_PER_1K_TOKENS': str(args.prefill_ms_per_1k),
+        'VERBOSE_LOGGING': '0',
+        'RESPONSE_CACHE_DB': '',
+        'RESPONSE_CACHE_SIZE': '0',
+        'LOCAL_FAST_PATH': '0',
+        'EMBEDDING_CACHE_DIR': tempfile.mkdtemp(),
+        'SESSION_SPILL_DIR': tempfile.mkdtemp()
+    })
+    sys.path.insert(0, str(Path(__file__).parent.parent / 'api'))
+
+
+def script(turns):
+    """The student's messages, cycling through topics and ways of asking about them"""
+    return [FOLLOW_UPS[(n // len(TOPICS)) % len(FOLLOW_UPS)].format(topic=TOPICS[n % len(TOPICS)][0],
+                                                                    detail=TOPICS[n % len(TOPICS)][1])
+            for n in range(turns)]
+
+
+def run_session(index, session_id, messages):
+    """Send the scripted turns like the frontend does; returns per-turn (seconds, input tokens, carried messages)"""
+    client = index.app.test_client()
+    expressions = {}
+    history = []
+    results = []
+    for message in messages:
+        history.append({'role': 'user', 'content': message})
+        started = time.perf_counter()
+        reply = client.post('/api/chat', json={
+            'message': message,
+            'sessionId': session_id,
+            'history': history[-10:],
+            'currentExpressions': [{'id': expr_id, 'latex': latex} for expr_id, latex in expressions.items()]
+        }).get_json()
+        seconds = time.perf_counter() - started
+        history.append({'role': 'assistant', 'content': reply['chatResponse']})
+        for command in reply['graphCommands']:
+            if command['command'] == 'setExpression':
+                expressions[command['params']['id']] = command['params']['latex']
+        conversation = index.conversations.get(session_id)
+        results.append((seconds, conversation.turn_stats[-1]['sentTokens'],
+                        len(conversation.turns) + conversation.summarized_messages))
+    # Let a fold still running finish, so its log line is not printed over the report
+    while conversation.summarizing:
+        time.sleep(0.05)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--turns', type=int, default=50)
+    parser.add_argument('--latency-ms', type=int, default=300)
+    parser.add_argument('--prefill-ms-per-1k', type=int, default=200)
+    args = parser.parse_args()
+    configure(args)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import index
+    messages = script(args.turns)
+    summarizer = index.conversation_summarizer
+    summarize = summarizer.summarize
+    cost = {'calls': 0, 'tokens': 0}
+
+    def counted(previous_summary, folded):
+        cost['calls'] += 1
+        cost['tokens'] += index.estimate_tokens(summarizer.prompt + index.summary_request(previous_summary, folded))
+        return summarize(previous_summary, folded)
+    summarizer.summarize = counted
+
+    configs = [('keep everything', 10 ** 6, None), ('compaction', index.CONVERSATION_MAX_MESSAGES, None),
+               ('rolling summary', index.CONVERSATION_MAX_MESSAGES, summarizer)]
+    print(f"{args.turns}-turn session, model latency {args.latency_ms} ms + {args.prefill_ms_per_1k} ms per 1k input tokens, "
+          f"token budget {index.CONTEXT_TOKEN_BUDGET}")
+    curves = {}
+    for name, max_messages, config_summarizer in configs:
+        index.CONVERSATION_MAX_MESSAGES = max_messages
+        index.conversation_summarizer = config_summarizer
+        session_id = name.replace(' ', '-')
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = run_session(index, session_id, messages)
+        tokens = [sent for _, sent, _ in results]
+        curves[name] = tokens
+        early = statistics.median(seconds for seconds, _, _ in results[:10])
+        late = statistics.median(seconds for seconds, _, _ in results[-10:])
+        print(f"\n{name}")
+        print(f"  input tokens: mean {statistics.mean(tokens):6.0f}  max {max(tokens):6d}  "
+              f"last 10 turns mean {statistics.mean(tokens[-10:]):6.0f}  total {sum(tokens)}")
+        print(f"  turn latency p50: turns 1-10 {early * 1000:5.0f} ms, last 10 turns {late * 1000:5.0f} ms")
+        print(f"  earlier messages carried at the last turn (verbatim or summarized): "
+              f"{results[-1][2]} of {2 * args.turns}")
+
+    print(f"\nrolling summary cost: {cost['calls']} background calls, ~{cost['tokens']} input tokens, "
+          f"summary now ~{index.estimate_tokens(index.conversations.get('rolling-summary').summary)} tokens")
+
+    print("\nInput tokens per turn")
+    print(f"  {'turn':>4}  " + '  '.join(f"{name:>16}" for name in curves))
+    for turn in sorted({1, *range(5, args.turns + 1, 5)}):
+        print(f"  {turn:>4}  " + '  '.join(f"{tokens[turn - 1]:>16}" for tokens in curves.values()))
+
+
+if __name__ == '__main__':
+    main()
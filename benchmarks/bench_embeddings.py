@@ -0,0 +1,77 @@
+"""Benchmark the batched embedding pipeline against a local fake embedding backend.
+
+Usage: python benchmarks/bench_embeddings.py [num_chunks]
+
+The fake backend sleeps for a fixed round-trip latency plus a small per-chunk
+cost and fails a fraction of requests, so the numbers approximate a remote
+embedding API without needing a Gemini key or quota.
+"""
+import random
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'api'))
+from embedding_pipeline import embed_in_batches
+
+DIMENSION = 768
+
+
+class FakeEmbeddingBackend:
+    """Local stand-in for genai.embed_content with configurable latency and failures"""
+
+    def __init__(self, round_trip=0.08, per_chunk=0.0005, failure_rate=0.02, seed=0):
+        self.round_trip = round_trip
+        self.per_chunk = per_chunk
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def embed(self, batch):
+        with self._lock:
+            self.calls += 1
+            fail = self._random.random() < self.failure_rate
+        time.sleep(self.round_trip + self.per_chunk * len(batch))
+        if fail:
+            raise RuntimeError('429 Resource has been exhausted (fake)')
+        return [[float(len(text) % 7)] * DIMENSION for text in batch]
+
+
+def serial_baseline(chunks, backend):
+    """The original one-request-per-chunk loop"""
+    embeddings, valid_chunks = [], []
+    for chunk in chunks:
+        try:
+            embeddings.append(backend.embed([chunk])[0])
+            valid_chunks.append(chunk)
+        except Exception:
+            continue
+    return embeddings, valid_chunks
+
+
+def run(name, fn, chunks):
+    backend = FakeEmbeddingBackend()
+    start = time.perf_counter()
+    embeddings, valid_chunks = fn(chunks, backend)
+    elapsed = time.perf_counter() - start
+    assert len(embeddings) == len(valid_chunks)
+    print(f"{name:<28} {len(valid_chunks):>6}/{len(chunks)} chunks  "
+          f"{backend.calls:>5} calls  {elapsed:7.2f}s  {len(chunks) / elapsed:9.1f} chunks/sec")
+
+
+def main():
+    num_chunks = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    chunks = [f"chunk {i} " + "lorem ipsum " * 80 for i in range(num_chunks)]
+
+    print(f"Embedding {num_chunks} chunks with a fake backend\n")
+    run('serial (baseline)', serial_baseline, chunks)
+    for batch_size, workers in [(20, 1), (50, 4), (100, 4), (100, 8)]:
+        run(f'batched {batch_size} x {workers} in flight',
+            lambda c, b: embed_in_batches(c, b.embed, batch_size=batch_size, max_workers=workers, base_delay=0.05),
+            chunks)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Latency and hit-rate report for the local fast path over TEST_PROMPTS.md.
+
+Usage: python benchmarks/bench_fast_path.py
+
+Every quoted prompt in TEST_PROMPTS.md is run through parse_local_command()
+against an empty canvas and against a canvas holding a parabola and a sine
+wave (so removal prompts have something to match).
+"""
+import re
+import statistics
+import sys
+import time
+from pathlib import Path
+
+root = Path(__file__).parent.parent
+sys.path.insert(0, str(root / 'api'))
+from fast_path import parse_local_command
+
+CANVASES = {
+    'empty canvas': [],
+    'parabola + sine': [
+        {'id': 'parabola', 'latex': 'y=x^2', 'color': '#2563eb'},
+        {'id': 'sinx', 'latex': 'y=\\sin(x)', 'color': '#dc2626'}
+    ]
+}
+REPEATS = 200
+
+
+def load_prompts():
+    text = (root / 'TEST_PROMPTS.md').read_text(encoding='utf-8')
+    return re.findall(r'^\s*\d+\.\s+"([^"]+)"', text, re.MULTILINE)
+
+
+def main():
+    prompts = load_prompts()
+    print(f"{len(prompts)} prompts from TEST_PROMPTS.md\n")
+
+    for name, canvas in CANVASES.items():
+        hits = []
+        timings = []
+        for prompt in prompts:
+            start = time.perf_counter()
+            for _ in range(REPEATS):
+                response = parse_local_command(prompt, canvas)
+            timings.append((time.perf_counter() - start) / REPEATS * 1e6)
+            if response:
+                hits.append((prompt, [c['command'] for c in response['graphCommands']]))
+
+        timings.sort()
+        print(f"== {name}: {len(hits)}/{len(prompts)} handled locally ({len(hits) / len(prompts):.0%})")
+        print(f"   latency per prompt: mean {statistics.mean(timings):.1f}us, "
+              f"p50 {timings[len(timings) // 2]:.1f}us, max {timings[-1]:.1f}us")
+        for prompt, commands in hits:
+            print(f"   {prompt!r:<48} -> {', '.join(commands)}")
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Request payload and command-count savings from server-side graph state.
+
+Usage: python benchmarks/bench_graph_sync.py
+
+For canvases of increasing size, compares the /api/chat request body with
+the full currentExpressions list against the graphHash-only body a synced
+client sends, and measures compact_commands() on typical model command
+sequences (redundant sets, set-then-remove, clear followed by sets).
+"""
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'api'))
+from graph_state import compact_commands, graph_hash
+
+REPEATS = 1000
+
+
+def canvas(size):
+    return [
+        {'id': f'graph_{i}', 'latex': f'y=\\sin({i}x)+\\frac{{x^2}}{{{i + 1}}}', 'color': '#2563eb'}
+        for i in range(size)
+    ]
+
+
+def request_body(expressions, synced):
+    body = {'message': 'what is the period of these curves?', 'sessionId': 'session_1', 'history': []}
+    body['graphHash'] = graph_hash(expressions)
+    if not synced:
+        body['currentExpressions'] = expressions
+    return json.dumps(body)
+
+
+def set_expression(expr_id, latex, **params):
+    return {'command': 'setExpression', 'params': dict(id=expr_id, latex=latex, **params)}
+
+
+def model_sequences(size):
+    sets = [set_expression(f'graph_{i}', f'y={i}x') for i in range(size)]
+    return {
+        'restyle every curve twice': sets + [set_expression(f'graph_{i}', f'y={i}x', color='#dc2626') for i in range(size)],
+        'draw helpers then remove them': sets + [{'command': 'removeExpression', 'params': {'id': f'graph_{i}'}} for i in range(size)],
+        'clear then redraw': [{'command': 'clearExpressions', 'params': {}}] + sets
+                             + [{'command': 'setMathBounds', 'params': {'left': -5, 'right': 5, 'bottom': -5, 'top': 5}}] * 2
+    }
+
+
+def main():
+    print("Request body size")
+    for size in (0, 10, 100, 500):
+        expressions = canvas(size)
+        full = len(request_body(expressions, synced=False))
+        synced = len(request_body(expressions, synced=True))
+        print(f"  {size:>4} expressions: full list {full:>7} bytes, hash only {synced:>4} bytes")
+
+    print("\nCommand compaction")
+    for name, commands in model_sequences(50).items():
+        start = time.perf_counter()
+        for _ in range(REPEATS):
+            compacted = compact_commands(commands)
+        elapsed = (time.perf_counter() - start) / REPEATS * 1e6
+        print(f"  {name}: {len(commands)} -> {len(compacted)} commands, "
+              f"{len(json.dumps(commands))} -> {len(json.dumps(compacted))} bytes, {elapsed:.1f} µs")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Hit quality and latency of vector-only, BM25-only and hybrid retrieval on sample documents.
+
+Usage: python benchmarks/bench_hybrid_retrieval.py [--queries 100]
+
+Indexes the chunks of the generated sample PDFs (numbered theorems, as in
+a textbook) in a SessionIndex and asks for specific theorems by number
+("What does Theorem 57.3 say?"). A hit means a chunk containing that
+theorem is among the top 3. The dense embeddings are the fake backend's
+with digits removed first, standing in for embedding models that blur
+identifiers like "57.3" and "12.1" together; the question is how much the
+BM25 side recovers. Latency is the local search only, without the
+embedding call that lexical-only retrieval saves.
+"""
+import argparse
+import random
+import re
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'api'))
+sys.path.insert(0, str(Path(__file__).parent))
+from bench_pdf_extraction import make_corpus
+from model_backend import FakeBackend
+from pdf_chunker import iter_chunks
+from retrieval import relevant_hits
+from vector_index import SessionIndex
+
+DIGITS = re.compile(r'\d')
+THEOREM = re.compile(r'Theorem (\d+\.\d+)\.')
+TOP_K = 3
+MAX_DISTANCE = 1.0
+MIN_BM25 = 3.0
+
+
+def dense(backend, texts):
+    return backend.embed_content('fake', [DIGITS.sub('', text) for text in texts], 'retrieval_document')['embedding']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--queries', type=int, default=100)
+    args = parser.parse_args()
+    backend = FakeBackend(embed_latency=0, embed_per_item=0)
+    rng = random.Random(0)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        index = SessionIndex()
+        for path in make_corpus(workdir):
+            chunks = list(iter_chunks(path))
+            index.add(dense(backend, [chunk['text'] for chunk in chunks]), chunks, path, Path(path).name)
+    print(f"{len(index.chunks)} chunks from {len(index.documents)} documents ({index.kind} index)\n")
+
+    theorems = sorted({number for chunk in index.chunks for number in THEOREM.findall(chunk['text'])})
+    questions = [f"What does Theorem {number} say?" for number in rng.sample(theorems, args.queries)]
+    vectors = dense(backend, questions)
+
+    modes = {
+        # An empty query text has no BM25 terms, leaving the vector ranking alone
+        'vector only': lambda question, vector: index.search('', vector, TOP_K),
+        'BM25 only': lambda question, vector: index.search(question, None, TOP_K),
+        'hybrid (RRF)': lambda question, vector: index.search(question, vector, TOP_K)
+    }
+    for name, search in modes.items():
+        hits = 0
+        kept = 0
+        latencies = []
+        for question, vector in zip(questions, vectors):
+            number = question.split()[3]
+            start = time.perf_counter()
+            results = search(question, vector)
+            latencies.append(time.perf_counter() - start)
+            hits += any(f"Theorem {number}." in hit['text'] for hit in results)
+            kept += len(relevant_hits(results, MAX_DISTANCE, MIN_BM25))
+        print(f"  {name:<13} hit@{TOP_K} {hits / len(questions):5.2f}  p50 {statistics.median(latencies) * 1000:6.2f} ms  "
+              f"chunks passing the relevance cutoff {kept / len(questions):.1f} per query")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Repairs, per-rule hit rates and check time of the Desmos LaTeX validator over a fixture corpus.
+
+Usage: python benchmarks/bench_latex_validator.py
+
+Each line of fixtures/desmos_latex.jsonl holds graphCommands latex as a
+model might write it, the latex the validator should send instead (null
+when the command must be dropped) and the rules it breaks. Reports how many
+fixtures come out as expected, how many would have failed in the browser
+before and after repair, each rule's hit rate, and the time per check
+uncached and from the validator's cache.
+"""
+import json
+import sys
+import time
+from pathlib import Path
+
+root = Path(__file__).parent
+sys.path.insert(0, str(root.parent / 'api'))
+from desmos_latex import RULES, LatexValidator, check_latex
+
+REPEATS = 2000
+
+
+def main():
+    fixtures = [json.loads(line) for line in (root / 'fixtures' / 'desmos_latex.jsonl').read_text(encoding='utf-8').splitlines()]
+    validator = LatexValidator()
+
+    matched = 0
+    for fixture in fixtures:
+        latex, rules = validator.check(fixture['latex'])
+        if latex == fixture['expected'] and rules == fixture['rules']:
+            matched += 1
+        else:
+            print(f"  mismatch: {fixture['latex']!r} -> {latex!r} {rules} (expected {fixture['expected']!r} {fixture['rules']})")
+
+    broken = sum(bool(fixture['rules']) for fixture in fixtures)
+    dropped = sum(fixture['expected'] is None for fixture in fixtures)
+    print(f"{matched}/{len(fixtures)} fixtures repaired as expected")
+    print(f"Expressions that would fail in Desmos: {broken}/{len(fixtures)} before, "
+          f"0 after ({broken - dropped} repaired, {dropped} dropped as unrepairable)")
+
+    stats = validator.stats()
+    print("\nRule hit rates over the corpus:")
+    for rule in RULES:
+        print(f"  {rule:<18} {stats['rules'][rule]['hits']:3d}  {stats['rules'][rule]['rate']:6.1%}")
+
+    texts = [fixture['latex'] for fixture in fixtures]
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        for text in texts:
+            check_latex(text)
+    uncached = (time.perf_counter() - start) / (REPEATS * len(texts))
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        for text in texts:
+            validator.check(text)
+    cached = (time.perf_counter() - start) / (REPEATS * len(texts))
+
+    commands = [{'command': 'setExpression', 'params': {'id': f'e{n}', 'latex': text}} for n, text in enumerate(texts)]
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        validator.repair_commands(commands)
+    per_response = (time.perf_counter() - start) / REPEATS
+    print(f"\nCheck time: {uncached * 1e6:.1f} µs uncached, {cached * 1e6:.1f} µs cached; "
+          f"{per_response * 1e6:.0f} µs for a response with all {len(commands)} commands")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Benchmark PDF extraction and chunking: pages/sec and peak RSS.
+
+Usage: python benchmarks/bench_pdf_extraction.py [pdf ...]
+
+Without arguments a small corpus of synthetic math PDFs is generated in a
+temporary directory. Each variant runs in a fresh subprocess so peak RSS is
+measured independently (including pool worker processes).
+"""
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'api'))
+
+VARIANTS = ['baseline', 'streaming', 'streaming-pool']
+
+
+def baseline_chunks(pdf_path, chunk_size=1000, overlap=200):
+    """The original extract_text_from_pdf: concatenate every page, then slice fixed windows"""
+    import fitz
+
+    doc = fitz.open(pdf_path)
+    chunks = []
+    full_text = ""
+    for page in doc:
+        full_text += page.get_text()
+    for i in range(0, len(full_text), chunk_size - overlap):
+        chunk = full_text[i:i + chunk_size]
+        if chunk.strip():
+            chunks.append(chunk)
+    return chunks
+
+
+def run_variant(variant, pdf_path):
+    import fitz
+    from pdf_chunker import iter_chunks
+
+    with fitz.open(pdf_path) as doc:
+        pages = doc.page_count
+
+    start = time.perf_counter()
+    if variant == 'baseline':
+        count = len(baseline_chunks(pdf_path))
+    else:
+        workers = 4 if variant == 'streaming-pool' else 1
+        count = sum(1 for _ in iter_chunks(pdf_path, workers=workers))
+    elapsed = time.perf_counter() - start
+
+    peak_kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    print(json.dumps({'pages': pages, 'chunks': count, 'seconds': elapsed, 'peak_rss_mb': peak_kb / 1024}))
+
+
+def make_corpus(directory):
+    import fitz
+
+    paths = []
+    for name, page_count in [('lecture_notes', 20), ('chapter', 120), ('textbook', 400)]:
+        doc = fitz.open()
+        for p in range(page_count):
+            page = doc.new_page()
+            text = "\n\n".join(
+                f"Theorem {p + 1}.{k}. Let f(x) = x^{k} + {p}. Then f'(x) = {k}x^{k - 1}, e.g. f'(1) = {k}. "
+                f"The proof follows from the power rule and linearity of the derivative."
+                for k in range(1, 9)
+            )
+            page.insert_textbox(fitz.Rect(40, 40, 560, 820), text, fontsize=8)
+        path = Path(directory) / f'{name}.pdf'
+        doc.save(str(path))
+        paths.append(str(path))
+    return paths
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == '--run':
+        run_variant(sys.argv[2], sys.argv[3])
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = sys.argv[1:] or make_corpus(directory)
+        print(f"{'document':<20} {'variant':<16} {'pages':>6} {'chunks':>7} {'pages/sec':>10} {'peak RSS':>10}")
+        for path in paths:
+            for variant in VARIANTS:
+                output = subprocess.run([sys.executable, __file__, '--run', variant, path],
+                                        capture_output=True, text=True, check=True).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                print(f"{Path(path).stem:<20} {variant:<16} {result['pages']:>6} {result['chunks']:>7} "
+                      f"{result['pages'] / result['seconds']:>10.1f} {result['peak_rss_mb']:>8.1f}MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Success rate and parse time of the model response extractor over a fixture corpus.
+
+Usage: python benchmarks/bench_response_parser.py
+
+Each line of fixtures/model_responses.jsonl holds a raw model response and
+the chatResponse and expression LaTeX it should produce. A fixture counts as
+a success only if both match exactly; a parser that returns the raw text with
+no commands, or LaTeX with a corrupted escape, fails it. The previous
+find/rfind + json.loads + double-every-backslash approach is included as the
+baseline.
+"""
+import contextlib
+import io
+import json
+import sys
+import time
+from pathlib import Path
+
+root = Path(__file__).parent
+sys.path.insert(0, str(root.parent / 'api'))
+from response_parser import extract_json, strip_code_fences
+
+REPEATS = 500
+
+
+def legacy_parse(response_text):
+    """The parsing block /api/chat used before extract_json"""
+    if '```json' in response_text:
+        json_start = response_text.find('```json') + 7
+        json_end = response_text.find('```', json_start)
+        response_text = response_text[json_start:json_end].strip()
+    elif '```' in response_text:
+        json_start = response_text.find('```') + 3
+        json_end = response_text.find('```', json_start)
+        response_text = response_text[json_start:json_end].strip()
+
+    if not response_text.startswith('{'):
+        if '{' not in response_text:
+            return response_text, []
+        json_start = response_text.find('{')
+        json_end = response_text.rfind('}') + 1
+        if json_end <= json_start:
+            return response_text, []
+        response_text = response_text[json_start:json_end]
+
+    try:
+        parsed = json.loads(response_text)
+    except json.JSONDecodeError:
+        try:
+            parsed = json.loads(response_text.replace('\\', '\\\\'))
+        except json.JSONDecodeError:
+            return response_text, []
+    return parsed.get('chatResponse', ''), parsed.get('graphCommands', [])
+
+
+def extractor_parse(response_text):
+    parsed, _ = extract_json(response_text)
+    if parsed is None:
+        return strip_code_fences(response_text), []
+    return parsed.get('chatResponse', ''), parsed.get('graphCommands') or []
+
+
+def expression_latex(commands):
+    return [
+        command.get('params', {}).get('latex') for command in commands
+        if isinstance(command, dict) and command.get('command') == 'setExpression'
+    ]
+
+
+def run(parse, fixtures):
+    successes = 0
+    failures = []
+    timings = []
+    for fixture in fixtures:
+        chat_response, commands = parse(fixture['raw'])
+        if chat_response == fixture['chatResponse'] and expression_latex(commands) == fixture['latex']:
+            successes += 1
+        else:
+            failures.append(fixture['name'])
+
+        start = time.perf_counter()
+        for _ in range(REPEATS):
+            parse(fixture['raw'])
+        timings.append((time.perf_counter() - start) / REPEATS * 1e6)
+    return successes, failures, timings
+
+
+def main():
+    with open(root / 'fixtures' / 'model_responses.jsonl', encoding='utf-8') as f:
+        fixtures = [json.loads(line) for line in f if line.strip()]
+    print(f"{len(fixtures)} fixtures, {REPEATS} parses each\n")
+
+    for name, parse in (('legacy', legacy_parse), ('extract_json', extractor_parse)):
+        with contextlib.redirect_stdout(io.StringIO()):
+            successes, failures, timings = run(parse, fixtures)
+        mean = sum(timings) / len(timings)
+        print(f"{name:>12}: {successes}/{len(fixtures)} correct ({successes / len(fixtures):.0%}), "
+              f"mean {mean:.1f} µs/parse, max {max(timings):.1f} µs")
+        for failure in failures:
+            print(f"{'':>14}failed: {failure}")
+
+
+if __name__ == '__main__':
+    main()
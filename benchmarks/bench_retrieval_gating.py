@@ -0,0 +1,64 @@
+"""How often the local intent check skips RAG retrieval, and what it costs.
+
+Usage: python benchmarks/bench_retrieval_gating.py
+
+Runs needs_retrieval() over the prompts in TEST_PROMPTS.md plus typical
+follow-up edits, printing which ones would skip the query embedding call
+and the per-message cost of the check. Then, over a synthetic document
+embedded with the fake backend, shows how many of the top 3 chunks survive
+each RAG_MAX_DISTANCE for on-topic and off-topic questions.
+"""
+import re
+import sys
+import time
+from pathlib import Path
+
+root = Path(__file__).parent.parent
+sys.path.insert(0, str(root / 'api'))
+from model_backend import FakeBackend
+from retrieval import needs_retrieval, relevant_hits
+from vector_index import SessionIndex
+
+REPEATS = 2000
+FOLLOW_UPS = ['make it red', 'zoom out', 'hide the parabola', 'change the color to green', 'undo that',
+              'now plot its derivative', 'shade the area between them', 'what is the vertex of this parabola?',
+              'explain what the document says about limits', 'use the example from chapter 2']
+DOCUMENT = [
+    f"Theorem {n}. The derivative of x^{n} is {n}x^{n - 1} by the power rule, and integrating gives x^{n + 1}/{n + 1}."
+    for n in range(1, 41)
+]
+QUESTIONS = {
+    'on topic': ['what does the power rule say about the derivative of x^5?', 'how do you integrate x^3?'],
+    'off topic': ['tell me a joke about bananas', 'who won the football match yesterday?']
+}
+
+
+def main():
+    text = (root / 'TEST_PROMPTS.md').read_text(encoding='utf-8')
+    prompts = re.findall(r'^\s*\d+\.\s+"([^"]+)"', text, re.MULTILINE) + FOLLOW_UPS
+    skipped = [prompt for prompt in prompts if not needs_retrieval(prompt)]
+    start = time.perf_counter()
+    for _ in range(REPEATS // len(prompts) + 1):
+        for prompt in prompts:
+            needs_retrieval(prompt)
+    per_call = (time.perf_counter() - start) / ((REPEATS // len(prompts) + 1) * len(prompts)) * 1e6
+    print(f"Intent gate: {len(skipped)} of {len(prompts)} messages skip retrieval, {per_call:.1f} µs per check")
+    for prompt in skipped:
+        print(f"  skip: {prompt}")
+
+    backend = FakeBackend(embed_latency=0, embed_per_item=0)
+    index = SessionIndex()
+    index.add(backend.embed_content('fake', DOCUMENT, 'retrieval_document')['embedding'],
+              [{'text': text, 'page': 1} for text in DOCUMENT], 'doc', 'notes.pdf')
+    print("\nChunks kept of top 3 by RAG_MAX_DISTANCE (fake bag-of-words embeddings)")
+    for label, questions in QUESTIONS.items():
+        queries = backend.embed_content('fake', questions, 'retrieval_query')['embedding']
+        results = [index.search(question, query, 3) for question, query in zip(questions, queries)]
+        for max_distance in (0.5, 1.0, 1.5, float('inf')):
+            # BM25 matches are ignored here; only the vector distance cutoff is measured
+            kept = sum(len(relevant_hits(hits, max_distance, float('inf'))) for hits in results)
+            print(f"  {label:<10} max distance {max_distance:<4}: {kept} of {3 * len(questions)} chunks")
+
+
+if __name__ == '__main__':
+    main()
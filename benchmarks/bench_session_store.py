@@ -0,0 +1,135 @@
+"""The SQLite + memory-mapped session backend against the in-memory store.
+
+Usage: python benchmarks/bench_session_store.py [--sessions 20] [--chunks 1000] [--dimension 768] [--writers 4]
+
+For both backends: time to ingest sessions in groups, to open a session
+from a worker that did not index it (a fresh store instance standing in for
+another gunicorn worker; the memory backend can only reload its own
+spilled copy), to get an open session and to search it. Then several
+processes append to one shared session at once, and every stored row is
+checked against the chunk it belongs to.
+"""
+import argparse
+import hashlib
+import multiprocessing
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'api'))
+import numpy as np
+from session_store import SessionStore
+from shared_session_store import SQLiteSessionStore
+from vector_index import all_vectors, normalize
+
+GROUP_SIZE = 200
+MAX_BYTES = 4 * 1024 ** 3
+
+
+def vector_for(text, dimension):
+    """Deterministic embedding stand-in, so any process can recompute the vector of a chunk"""
+    seed = int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+    return np.random.default_rng(seed).standard_normal(dimension).astype('float32')
+
+
+def make_store(backend, directory):
+    if backend == 'sqlite':
+        return SQLiteSessionStore(directory, MAX_BYTES)
+    return SessionStore(directory, MAX_BYTES)
+
+
+def ingest(store, session_id, chunk_count, dimension, prefix=''):
+    for start in range(0, chunk_count, GROUP_SIZE):
+        chunks = [{'text': f"{prefix}{session_id} chunk {i} about theorem {i % 97}.{i % 13}", 'page': i // 4 + 1}
+                  for i in range(start, min(start + GROUP_SIZE, chunk_count))]
+        vectors = np.stack([vector_for(chunk['text'], dimension) for chunk in chunks])
+        store.add(session_id, vectors, chunks, f"{prefix}{session_id}.pdf", f"{prefix}{session_id}.pdf")
+
+
+def median_ms(function, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def compare(backend, args):
+    with tempfile.TemporaryDirectory() as directory:
+        store = make_store(backend, directory)
+        sessions = [f"session_{n}" for n in range(args.sessions)]
+        start = time.perf_counter()
+        for session_id in sessions:
+            ingest(store, session_id, args.chunks, args.dimension)
+        ingest_seconds = time.perf_counter() - start
+
+        get_ms = median_ms(lambda: store.get(sessions[0]), 200)
+        query = normalize(vector_for('a question', args.dimension))
+        index = store.get(sessions[0])
+        search_ms = median_ms(lambda: index.search('theorem 12.5', query, 3), 200)
+        resident = sum(store.resident_bytes().values()) / 1024 / 1024
+
+        # Another worker opening the session: a fresh SQLite store, or for memory a reload of the spilled copy
+        if backend == 'sqlite':
+            other = make_store(backend, directory)
+        else:
+            store.max_bytes = 0
+            store._enforce_limits()
+            other = store
+        start = time.perf_counter()
+        opened = other.get(sessions[-1])
+        open_ms = (time.perf_counter() - start) * 1000
+
+    visible = 'yes' if backend == 'sqlite' else 'no (own spill only)'
+    print(f"  {backend:<6} ingest {args.sessions * args.chunks / ingest_seconds:8.0f} chunks/s  "
+          f"get {get_ms:6.3f} ms  search p50 {search_ms:6.3f} ms  open {open_ms:7.1f} ms "
+          f"({len(opened.chunks)} chunks)  resident {resident:6.1f} MB  other workers see it: {visible}")
+
+
+def writer(directory, number, chunk_count, dimension):
+    ingest(SQLiteSessionStore(directory, MAX_BYTES), 'shared', chunk_count, dimension, prefix=f"w{number}-")
+
+
+def concurrent_writers(args):
+    per_writer = args.chunks
+    with tempfile.TemporaryDirectory() as directory:
+        SQLiteSessionStore(directory, MAX_BYTES)
+        processes = [multiprocessing.Process(target=writer, args=(directory, n, per_writer, args.dimension))
+                     for n in range(args.writers)]
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        seconds = time.perf_counter() - start
+
+        index = SQLiteSessionStore(directory, MAX_BYTES).get('shared')
+        vectors = all_vectors(index.index)
+        corrupt = sum(
+            not np.allclose(vectors[i], normalize(vector_for(chunk['text'], args.dimension))[0], atol=1e-6)
+            for i, chunk in enumerate(index.chunks)
+        )
+        print(f"\n{args.writers} processes appending {per_writer} chunks each to one session: {seconds:.2f} s, "
+              f"{len(index.chunks)} of {args.writers * per_writer} rows stored, {corrupt} mismatched, "
+              f"documents {sorted(doc['chunks'] for doc in index.documents.values())}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sessions', type=int, default=20)
+    parser.add_argument('--chunks', type=int, default=1000)
+    parser.add_argument('--dimension', type=int, default=768)
+    parser.add_argument('--writers', type=int, default=4)
+    args = parser.parse_args()
+
+    print(f"{args.sessions} sessions x {args.chunks} chunks x {args.dimension} dimensions, groups of {GROUP_SIZE}")
+    for backend in ('memory', 'sqlite'):
+        compare(backend, args)
+    concurrent_writers(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""Upstream calls for a classroom burst, with and without coalescing of identical in-flight calls.
+
+Usage: python benchmarks/bench_single_flight.py [--students 40] [--spread-ms 200] [--latency-ms 500]
+
+Runs the app in-process on the fake model backend. Every student sends the
+same prompt on an empty canvas from their own session, all within
+--spread-ms, through /api/chat, /api/chat/stream and the ASGI /api/chat;
+then every student uploads the same handout PDF within the same window.
+Each burst runs with coalescing off and on, and reports the upstream chat
+or embedding calls made, p50/p99 latency and the origin/coalesced counts.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+from bench_async_chat import asgi_chat
+
+
+def configure(args):
+    os.environ.update({
+        'MODEL_BACKEND': 'fake',
+        'FAKE_MODEL_LATENCY_MS': str(args.latency_ms),
+        'FAKE_EMBED_LATENCY_MS': '200',
+        'VERBOSE_LOGGING': '0',
+        'RESPONSE_CACHE_DB': '',
+        'EMBEDDING_CACHE_DIR': tempfile.mkdtemp(),
+        'SESSION_SPILL_DIR': tempfile.mkdtemp(),
+        'INGEST_WORKERS': str(args.students)
+    })
+    sys.path.insert(0, str(Path(__file__).parent.parent / 'api'))
+
+
+def make_handout(path, label):
+    import fitz
+
+    doc = fitz.open()
+    for p in range(30):
+        page = doc.new_page()
+        text = "\n\n".join(f"{label} exercise {p + 1}.{k}: differentiate f(x) = x^{k} + {p} and sketch f'(x)."
+                           for k in range(1, 12))
+        page.insert_textbox(fitz.Rect(40, 40, 560, 820), text, fontsize=8)
+    doc.save(path)
+    return Path(path).read_bytes()
+
+
+def burst(students, spread, request):
+    """Run request(n) for every student, each starting at a random moment in the window"""
+    offsets = sorted(random.Random(0).uniform(0, spread) for _ in range(students))
+    start = time.perf_counter()
+
+    def one(n):
+        time.sleep(max(0.0, start + offsets[n] - time.perf_counter()))
+        began = time.perf_counter()
+        request(n)
+        return time.perf_counter() - began
+
+    with ThreadPoolExecutor(max_workers=students) as pool:
+        return list(pool.map(one, range(students)))
+
+
+async def async_burst(students, spread, request):
+    offsets = sorted(random.Random(0).uniform(0, spread) for _ in range(students))
+
+    async def one(n):
+        await asyncio.sleep(offsets[n])
+        began = time.perf_counter()
+        await request(n)
+        return time.perf_counter() - began
+
+    return await asyncio.gather(*(one(n) for n in range(students)))
+
+
+def upload_and_wait(client, session_id, pdf_bytes, label):
+    job = client.post('/api/upload_pdf', data={'sessionId': session_id, 'pdf': (io.BytesIO(pdf_bytes), f'{label}.pdf')},
+                      content_type='multipart/form-data').get_json()
+    while job.get('status') not in ('done', 'failed'):
+        time.sleep(0.02)
+        job = client.get(f"/api/upload_status/{job['jobId']}").get_json()
+
+
+def report(name, latencies, calls, flights):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    counts = f"  origin {flights['originated']}, coalesced {flights['coalesced']}" if flights else ''
+    print(f"  {name:<20} upstream calls {calls:4d}  p50 {statistics.median(latencies) * 1000:6.0f} ms  "
+          f"p99 {p99 * 1000:6.0f} ms{counts}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--students', type=int, default=40)
+    parser.add_argument('--spread-ms', type=int, default=200)
+    parser.add_argument('--latency-ms', type=int, default=500)
+    args = parser.parse_args()
+    configure(args)
+    spread = args.spread_ms / 1000
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import index
+        import asgi
+    client = index.app.test_client()
+    backend = index.backend
+    flight_groups = [(index.chat_calls, index.chat_streams, index.embedding_calls), (asgi.chat_calls, asgi.chat_streams)]
+    print(f"{args.students} students within {args.spread_ms} ms, model latency {args.latency_ms} ms")
+
+    for enabled in (False, True):
+        for group in flight_groups:
+            for flights in group:
+                flights.enabled = enabled
+                flights.originated = flights.coalesced = 0
+        print(f"\ncoalescing {'on' if enabled else 'off'}")
+        label = 'on' if enabled else 'off'
+        body = lambda n, endpoint: {'message': f'what is a derivative? ({endpoint} {label})',
+                                    'sessionId': f'{endpoint}-{label}-{n}', 'currentExpressions': []}
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            before = backend.calls
+            latencies = burst(args.students, spread, lambda n: client.post('/api/chat', json=body(n, 'chat')).get_json())
+        report('/api/chat', latencies, backend.calls - before, index.chat_calls.stats())
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            before = backend.calls
+            latencies = burst(args.students, spread,
+                              lambda n: client.post('/api/chat/stream', json=body(n, 'stream')).get_data())
+        report('/api/chat/stream', latencies, backend.calls - before, index.chat_streams.stats())
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            before = backend.calls
+            latencies = asyncio.run(async_burst(args.students, spread, lambda n: asgi_chat(asgi.app, body(n, 'asgi'))))
+        report('ASGI /api/chat', latencies, backend.calls - before, asgi.chat_calls.stats())
+
+        with tempfile.TemporaryDirectory() as directory:
+            pdf_bytes = make_handout(str(Path(directory) / 'handout.pdf'), f'handout-{label}')
+            with contextlib.redirect_stdout(io.StringIO()):
+                before = backend.embed_calls
+                latencies = burst(args.students, spread,
+                                  lambda n: upload_and_wait(client, f'upload-{label}-{n}', pdf_bytes, 'handout'))
+            report('same PDF upload', latencies, backend.embed_calls - before, index.embedding_calls.stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Recall and latency of the per-session vector index types against the flat baseline.
+
+Usage: python benchmarks/bench_vector_index.py [--sizes 2000,20000,60000] [--dimension 768] [--queries 200]
+
+For each corpus size, builds flat, HNSW and IVF inner-product indexes over
+the same clustered unit vectors (stand-ins for chunk embeddings) and
+reports build time, memory, per-query latency and recall@3 against exact
+flat search. Then times ingesting documents group by group, comparing
+SessionIndex.add() with the old approach of rebuilding a flat index from
+every vector so far after each group.
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'api'))
+import numpy as np
+import faiss
+from vector_index import SessionIndex, build_index, index_kind, normalize
+
+TOP_K = 3
+GROUP_SIZE = 400
+
+
+def corpus(size, dimension, rng, latent=48):
+    """Unit vectors around size // 50 topic centres in a low-dimensional latent space, projected up.
+
+    Real text embeddings have a far lower intrinsic dimension than their length;
+    isotropic noise in all dimensions would make every neighbour nearly equidistant.
+    """
+    projection = rng.standard_normal((latent, dimension)).astype('float32')
+    centres = rng.standard_normal((max(1, size // 50), latent)).astype('float32')
+    points = centres[rng.integers(0, len(centres), size)] + 0.5 * rng.standard_normal((size, latent)).astype('float32')
+    return normalize(points @ projection + 0.5 * rng.standard_normal((size, dimension)).astype('float32'))
+
+
+def queries(vectors, count, rng):
+    """Perturbed copies of random corpus vectors, so every query has real neighbours"""
+    picks = vectors[rng.integers(0, len(vectors), count)]
+    return normalize(picks + 0.3 * rng.standard_normal(picks.shape).astype('float32'))
+
+
+def recall(found, truth):
+    return statistics.mean(len(set(f) & set(t)) / len(t) for f, t in zip(found, truth))
+
+
+def time_queries(index, query_vectors):
+    latencies = []
+    found = []
+    for query in query_vectors:
+        start = time.perf_counter()
+        _, indices = index.search(query[None, :], TOP_K)
+        latencies.append(time.perf_counter() - start)
+        found.append(list(indices[0]))
+    return found, statistics.median(latencies) * 1000
+
+
+def index_mb(index):
+    return len(faiss.serialize_index(index)) / 1024 / 1024
+
+
+def compare_kinds(size, dimension, query_count, rng):
+    vectors = corpus(size, dimension, rng)
+    query_vectors = queries(vectors, query_count, rng)
+    print(f"\n{size} vectors x {dimension} (automatic choice: {index_kind(size)})")
+    truth = None
+    for kind in ('flat', 'hnsw', 'ivf'):
+        start = time.perf_counter()
+        index = build_index(kind, vectors)
+        built = time.perf_counter() - start
+        found, median_ms = time_queries(index, query_vectors)
+        if truth is None:
+            truth = found
+        print(f"  {kind:<5} build {built:7.2f} s  {index_mb(index):7.1f} MB  query p50 {median_ms:7.3f} ms  "
+              f"recall@{TOP_K} {recall(found, truth):.3f}")
+
+
+def compare_ingestion(size, dimension, rng):
+    vectors = corpus(size, dimension, rng)
+    groups = range(0, size, GROUP_SIZE)
+
+    # Old pipeline: a fresh IndexFlatL2 over everything embedded so far after every group
+    start = time.perf_counter()
+    for end in groups:
+        rebuilt = faiss.IndexFlatL2(dimension)
+        rebuilt.add(vectors[:end + GROUP_SIZE])
+    rebuild_seconds = time.perf_counter() - start
+
+    session_index = SessionIndex()
+    start = time.perf_counter()
+    for end in groups:
+        chunk_group = vectors[end:end + GROUP_SIZE]
+        session_index.add(chunk_group, [{'text': '', 'page': 1}] * len(chunk_group), 'doc', 'bench.pdf')
+    add_seconds = time.perf_counter() - start
+    print(f"Ingesting {size} chunks in groups of {GROUP_SIZE}: rebuild per group {rebuild_seconds:.2f} s, "
+          f"incremental add {add_seconds:.2f} s (ended as {session_index.kind})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default='2000,20000,60000')
+    parser.add_argument('--dimension', type=int, default=768)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+
+    for size in (int(size) for size in args.sizes.split(',')):
+        compare_kinds(size, args.dimension, args.queries, rng)
+    print()
+    for size in (8000, 20000):
+        compare_ingestion(size, args.dimension, rng)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""Load test /api/chat and /api/upload_pdf against the local fake model backend.
+
+Usage: python benchmarks/load_test.py [--requests N] [--concurrency 1,4,16] [--warm-caches]
+
+Starts the app in a subprocess with MODEL_BACKEND=fake, drives it over HTTP
+with a thread pool at each concurrency level, and reports p50/p95/p99
+latency, requests/sec and the server's resident memory. No Gemini key or
+quota is needed. Fake latencies can be tuned with the FAKE_* variables
+described in api/model_backend.py, e.g. FAKE_MODEL_LATENCY_MS=800.
+
+Uploads are timed twice: the POST itself, and until the ingestion job
+reports done. By default the embedding and document caches are disabled so
+every upload runs the full pipeline; --warm-caches keeps them on.
+"""
+import argparse
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+root = Path(__file__).parent.parent
+sys.path.insert(0, str(Path(__file__).parent))
+from bench_pdf_extraction import make_corpus
+
+FAST_PATH_PROMPTS = ['plot y = 2x + 1', 'graph sin(x) in red', 'clear the graph', 'zoom to -5..5',
+                     'plot x^2, x^3 and x^4', 'draw cos(x) dashed']
+MODEL_PROMPTS = ['explain what a derivative is', 'why does the parabola open upward?',
+                 'what is the relationship between sine and cosine?', 'show me a tangent line to x^2 at x = 1',
+                 'how do I find the area under a curve?', 'explain limits intuitively']
+
+
+def load_test_prompts():
+    text = (root / 'TEST_PROMPTS.md').read_text(encoding='utf-8')
+    return re.findall(r'^\s*\d+\.\s+"([^"]+)"', text, re.MULTILINE)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, warm_caches, cache_dir):
+    env = dict(os.environ, MODEL_BACKEND='fake', VERBOSE_LOGGING='0', RESPONSE_CACHE_DB='',
+               EMBEDDING_CACHE_DIR=cache_dir, SESSION_SPILL_DIR=str(Path(cache_dir) / 'sessions'))
+    if not warm_caches:
+        env.update(EMBEDDING_CACHE_MAX_MB='0', DOCUMENT_CACHE_MAX_MB='0')
+    code = (
+        "import sys; sys.path.insert(0, 'api')\n"
+        "from werkzeug.serving import make_server\n"
+        "from index import app\n"
+        f"make_server('127.0.0.1', {port}, app, threaded=True).serve_forever()\n"
+    )
+    server = subprocess.Popen([sys.executable, '-c', code], cwd=root, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics', timeout=1).read()
+            return server
+        except (urllib.error.URLError, ConnectionError):
+            if server.poll() is not None:
+                raise RuntimeError('server exited during startup')
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError('server did not start')
+
+
+def server_memory_mb(pid):
+    """(current RSS, peak RSS) of the server process in MB, from /proc (Linux only)"""
+    try:
+        status = Path(f'/proc/{pid}/status').read_text()
+    except OSError:
+        return None, None
+    fields = dict(line.split(':', 1) for line in status.splitlines() if ':' in line)
+    return int(fields['VmRSS'].split()[0]) / 1024, int(fields['VmHWM'].split()[0]) / 1024
+
+
+def post_json(base, path, body):
+    request = urllib.request.Request(base + path, data=json.dumps(body).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=120) as response:
+        return json.loads(response.read())
+
+
+def post_pdf(base, pdf_bytes, session_id):
+    boundary = uuid.uuid4().hex
+    body = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="sessionId"\r\n\r\n{session_id}\r\n'
+        f'--{boundary}\r\nContent-Disposition: form-data; name="pdf"; filename="load.pdf"\r\n'
+        f'Content-Type: application/pdf\r\n\r\n'
+    ).encode('utf-8') + pdf_bytes + f'\r\n--{boundary}--\r\n'.encode('utf-8')
+    request = urllib.request.Request(base + '/api/upload_pdf', data=body,
+                                     headers={'Content-Type': f'multipart/form-data; boundary={boundary}'})
+    with urllib.request.urlopen(request, timeout=120) as response:
+        return json.loads(response.read())
+
+
+def chat_once(base, prompt, index):
+    body = {'message': prompt, 'sessionId': f'load_{index}', 'history': [], 'currentExpressions': []}
+    start = time.perf_counter()
+    post_json(base, '/api/chat', body)
+    return time.perf_counter() - start
+
+
+def upload_once(base, pdf_bytes, index):
+    """Return (seconds for the POST, seconds until the ingestion job is done)"""
+    start = time.perf_counter()
+    result = post_pdf(base, pdf_bytes, f'upload_{index}_{uuid.uuid4().hex[:6]}')
+    posted = time.perf_counter() - start
+    while result.get('status') not in ('done', 'failed'):
+        time.sleep(0.05)
+        with urllib.request.urlopen(f"{base}/api/upload_status/{result['jobId']}", timeout=30) as response:
+            result = json.loads(response.read())
+    if result['status'] == 'failed':
+        raise RuntimeError(result.get('error'))
+    return posted, time.perf_counter() - start
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def run_level(concurrency, jobs):
+    """Run the callables in jobs with the given concurrency; returns (results, errors, seconds)"""
+    results = []
+    errors = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(job) for job in jobs]:
+            try:
+                results.append(future.result())
+            except Exception:
+                errors += 1
+    return results, errors, time.perf_counter() - start
+
+
+def report(label, concurrency, latencies, errors, elapsed, server_pid):
+    rss, peak = server_memory_mb(server_pid)
+    memory = f"rss {rss:.0f} MB, peak {peak:.0f} MB" if rss is not None else "rss n/a"
+    if not latencies:
+        print(f"  {label:<28} c={concurrency:<3} all {errors} requests failed")
+        return
+    ms = [value * 1000 for value in latencies]
+    print(f"  {label:<28} c={concurrency:<3} p50 {percentile(ms, 50):7.0f} ms  p95 {percentile(ms, 95):7.0f} ms  "
+          f"p99 {percentile(ms, 99):7.0f} ms  {len(latencies) / elapsed:7.1f} req/s  "
+          f"errors {errors}  {memory}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--requests', type=int, default=48, help='chat requests per mix and concurrency level')
+    parser.add_argument('--uploads', type=int, default=4, help='uploads per PDF and concurrency level')
+    parser.add_argument('--concurrency', default='1,4,16')
+    parser.add_argument('--warm-caches', action='store_true')
+    args = parser.parse_args()
+    levels = [int(level) for level in args.concurrency.split(',')]
+
+    backend = {key: value for key, value in os.environ.items() if key.startswith('FAKE_')}
+    print(f"Fake backend settings: {backend or 'defaults'}\n")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        port = free_port()
+        server = start_server(port, args.warm_caches, workdir)
+        base = f'http://127.0.0.1:{port}'
+        try:
+            mixes = {
+                'fast path': FAST_PATH_PROMPTS,
+                # Numbered so every request misses the response cache and reaches the model
+                'model (uncached)': [f'{prompt} (#{n})' for n in range(args.requests * len(levels)) for prompt in MODEL_PROMPTS],
+                'TEST_PROMPTS.md mix': load_test_prompts()
+            }
+            print("POST /api/chat")
+            for name, prompts in mixes.items():
+                for level, concurrency in enumerate(levels):
+                    # Each level continues through the prompt list where the previous one stopped
+                    offset = level * args.requests
+                    jobs = [
+                        (lambda prompt=prompts[(offset + i) % len(prompts)], i=i: chat_once(base, prompt, i))
+                        for i in range(args.requests)
+                    ]
+                    latencies, errors, elapsed = run_level(concurrency, jobs)
+                    report(name, concurrency, latencies, errors, elapsed, server.pid)
+
+            print("\nPOST /api/upload_pdf (request / until ingestion is done)")
+            for pdf_path in make_corpus(workdir):
+                pdf_bytes = Path(pdf_path).read_bytes()
+                for concurrency in levels:
+                    jobs = [(lambda i=i: upload_once(base, pdf_bytes, i)) for i in range(args.uploads)]
+                    results, errors, elapsed = run_level(concurrency, jobs)
+                    name = Path(pdf_path).stem
+                    report(f'{name} (request)', concurrency, [posted for posted, _ in results], errors, elapsed, server.pid)
+                    report(f'{name} (ingested)', concurrency, [done for _, done in results], errors, elapsed, server.pid)
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
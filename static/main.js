@@ -2,6 +2,7 @@
 let calculator;
 let sessionId = generateSessionId();
 let conversationHistory = [];
+let syncedGraphHash = null; // graph hash the server last confirmed for this session
 
 // Initialize Desmos Calculator
 function initializeCalculator() {
@@ -33,6 +34,20 @@ function generateSessionId() {
     return 'session_' + Date.now() + '_' + Math.random().toString(36).substr(2, 9);
 }
 
+// Order-independent FNV-1a hash of id + latex; must match graph_hash() in api/graph_state.py
+function graphHash(expressions) {
+    const entries = expressions
+        .map(expr => [String(expr.id), expr.latex || ''])
+        .sort((a, b) => (a[0] < b[0] ? -1 : a[0] > b[0] ? 1 : (a[1] < b[1] ? -1 : a[1] > b[1] ? 1 : 0)));
+    let h = 0x811c9dc5;
+    entries.forEach(([id, latex]) => {
+        for (const ch of `${id}\x1f${latex}\x1e`) {
+            h = Math.imul(h ^ ch.codePointAt(0), 0x01000193) >>> 0;
+        }
+    });
+    return `${expressions.length}-${h.toString(16).padStart(8, '0')}`;
+}
+
 // Simple Markdown to HTML converter
 function markdownToHtml(text) {
     // Escape HTML to prevent XSS
@@ -164,6 +179,11 @@ function executeGraphCommands(commands) {
                     calculator.setExpression(cmd.params);
                     break;
                     
+                case 'setExpressions':
+                    // Batched by the server; applied as a single state update
+                    calculator.setExpressions(cmd.params.expressions);
+                    break;
+                    
                 case 'removeExpression':
                     calculator.removeExpression(cmd.params);
                     break;
@@ -193,6 +213,32 @@ function executeGraphCommands(commands) {
     });
 }
 
+// Read a newline-delimited JSON response body, calling onEvent for each complete line
+async function readNdjsonStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        
+        lines.forEach(line => {
+            if (line.trim()) {
+                onEvent(JSON.parse(line));
+            }
+        });
+    }
+    
+    if (buffer.trim()) {
+        onEvent(JSON.parse(buffer));
+    }
+}
+
 // Send message to backend
 async function sendMessage() {
     const chatInput = document.getElementById('chat-input');
@@ -222,7 +268,9 @@ async function sendMessage() {
                 color: expr.color
             }));
         
-        const response = await fetch('/api/chat', {
+        const localGraphHash = graphHash(currentExpressions);
+        
+        const postChat = includeExpressions => fetch('/api/chat/stream', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
@@ -231,34 +279,66 @@ async function sendMessage() {
                 message: message,
                 sessionId: sessionId,
                 history: conversationHistory.slice(-10), // Send last 10 messages
-                currentExpressions: currentExpressions // Send current graph state
+                // Lets a server worker tell whether another worker answered turns it has not seen
+                replyCount: conversationHistory.filter(entry => entry.role === 'assistant').length,
+                graphHash: localGraphHash,
+                // The server already has the graph if nothing changed since its last response
+                currentExpressions: includeExpressions ? currentExpressions : undefined
             })
         });
         
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
+        let response = await postChat(localGraphHash !== syncedGraphHash);
+        if (response.status === 409) {
+            // Server lost or disagrees with its copy of the graph; send the full list
+            response = await postChat(true);
         }
         
-        const data = await response.json();
-        
-        console.log('=== AI RESPONSE ===');
-        console.log('Chat response:', data.chatResponse?.substring(0, 100) + '...');
-        console.log('Graph commands count:', data.graphCommands?.length || 0);
-        console.log('===================');
-        
-        // Display AI response
-        if (data.chatResponse) {
-            addMessage(data.chatResponse, 'ai');
-            conversationHistory.push({ role: 'assistant', content: data.chatResponse });
+        if (response.status === 503) {
+            // The AI service is at its rate limit; the server says when to try again
+            const busy = await response.json();
+            addErrorMessage(busy.chatResponse);
+            return;
         }
         
-        // Execute graph commands
-        if (data.graphCommands && data.graphCommands.length > 0) {
-            executeGraphCommands(data.graphCommands);
-        } else {
-            console.log('No graph commands to execute');
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
         }
         
+        let commandCount = 0;
+        
+        // Handle each NDJSON event as soon as it arrives
+        await readNdjsonStream(response, event => {
+            switch (event.type) {
+                case 'chatResponse':
+                    // Display AI response
+                    if (event.chatResponse) {
+                        addMessage(event.chatResponse, 'ai');
+                        conversationHistory.push({ role: 'assistant', content: event.chatResponse });
+                    }
+                    break;
+                    
+                case 'graphCommand':
+                    // Execute each graph command the moment it is complete
+                    commandCount++;
+                    executeGraphCommands([event.graphCommand]);
+                    break;
+                    
+                case 'error':
+                    addErrorMessage(event.error);
+                    break;
+                    
+                case 'done':
+                    syncedGraphHash = event.graphHash || null;
+                    console.log('=== AI RESPONSE ===');
+                    console.log('Graph commands count:', commandCount);
+                    console.log('===================');
+                    break;
+                    
+                default:
+                    console.warn('Unknown stream event:', event);
+            }
+        });
+        
     } catch (error) {
         console.error('Error sending message:', error);
         addErrorMessage('Sorry, something went wrong. Please try again.');
@@ -268,6 +348,35 @@ async function sendMessage() {
     }
 }
 
+// Poll a PDF ingestion job until it is done or failed, showing progress as it goes
+async function pollUploadStatus(jobId, fileName) {
+    const uploadStatus = document.getElementById('upload-status');
+    let announcedPartial = false;
+    
+    while (true) {
+        const response = await fetch(`/api/upload_status/${jobId}`);
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        
+        const job = await response.json();
+        if (job.status === 'done' || job.status === 'failed') {
+            return job;
+        }
+        
+        const pages = job.pagesTotal ? `${job.pagesParsed}/${job.pagesTotal} pages` : 'starting';
+        uploadStatus.textContent = `Processing ${fileName}: ${pages}, ${job.chunksEmbedded} chunks indexed`;
+        
+        // The session can already answer questions from the chunks indexed so far
+        if (job.queryable && !announcedPartial) {
+            announcedPartial = true;
+            addMessage(`The first sections of "${fileName}" are ready - you can start asking questions while the rest is processed.`, 'ai');
+        }
+        
+        await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+}
+
 // Handle PDF upload
 async function handlePdfUpload(file) {
     const uploadStatus = document.getElementById('upload-status');
@@ -289,19 +398,26 @@ async function handlePdfUpload(file) {
         
         const data = await response.json();
         
-        if (data.success) {
-            uploadStatus.textContent = `✓ ${file.name} uploaded`;
-            uploadStatus.style.color = '#059669';
-            addMessage(`PDF "${file.name}" has been uploaded and processed. You can now ask questions about its content!`, 'ai');
-            
-            // Clear status after 3 seconds
-            setTimeout(() => {
-                uploadStatus.textContent = '';
-            }, 3000);
-        } else {
+        if (!data.success) {
             throw new Error(data.error || 'Upload failed');
         }
         
+        // Processing runs in the background; poll until the job finishes
+        const job = data.status === 'done' ? data : await pollUploadStatus(data.jobId, file.name);
+        
+        if (job.status !== 'done') {
+            throw new Error(job.error || 'Processing failed');
+        }
+        
+        uploadStatus.textContent = `✓ ${file.name} uploaded`;
+        uploadStatus.style.color = '#059669';
+        addMessage(`PDF "${file.name}" has been uploaded and processed. You can now ask questions about its content!`, 'ai');
+        
+        // Clear status after 3 seconds
+        setTimeout(() => {
+            uploadStatus.textContent = '';
+        }, 3000);
+        
     } catch (error) {
         console.error('Error uploading PDF:', error);
         uploadStatus.textContent = '✗ Upload failed';
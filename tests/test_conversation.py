@@ -0,0 +1,14 @@
+from conversation import Conversation, estimate_tokens
+
+
+def test_first_turn_with_system_instruction_saves_nothing():
+    system_prompt = 'You are a graphing assistant. ' * 40
+    conversation = Conversation([], system_tokens=estimate_tokens(system_prompt))
+    turn = conversation.prepare('plot y=x^2', [], 'The graph is empty.')
+    # Rebuilding the context for the first turn sends the same system instruction and message
+    rebuild_tokens = estimate_tokens(system_prompt) + estimate_tokens(turn.message)
+
+    stats = conversation.record_stats(turn, rebuild_tokens)
+
+    assert stats['sentTokens'] == rebuild_tokens
+    assert stats['savedTokens'] == 0
@@ -0,0 +1,29 @@
+from fast_path import parse_local_command
+
+CANVAS = [
+    {'id': 'parabola', 'latex': 'y=x^2', 'color': '#2563eb'},
+    {'id': 'sinx', 'latex': 'y=\\sin(x)', 'color': '#dc2626'}
+]
+
+
+def commands(message, canvas=CANVAS):
+    response = parse_local_command(message, canvas)
+    return response and response['graphCommands']
+
+
+def test_bare_remove_or_delete_falls_through_to_the_model():
+    for message in ('remove', 'delete', 'erase', 'remove it', 'delete that'):
+        assert commands(message) is None, message
+
+
+def test_clear_without_an_object_still_clears():
+    for message in ('clear', 'wipe', 'clear the graph', 'delete everything', 'remove all expressions'):
+        assert commands(message) == [{'command': 'clearExpressions', 'params': {}}], message
+
+
+def test_hide_hides_instead_of_removing():
+    assert commands('hide the parabola') == [{'command': 'setExpression', 'params': {'id': 'parabola', 'hidden': True}}]
+
+
+def test_remove_named_expression():
+    assert commands('remove the parabola') == [{'command': 'removeExpression', 'params': {'id': 'parabola'}}]
@@ -0,0 +1,32 @@
+import pytest
+
+from retrieval import needs_retrieval
+
+
+@pytest.mark.parametrize('message', [
+    'plot y=x^2',
+    'graph sin(x) in red',
+    'draw y = 2x + 1 with a dashed line',
+    'zoom out',
+    'zoom to -5..5',
+    'undo',
+    'clear the graph',
+])
+def test_self_contained_graph_actions_skip_retrieval(message):
+    assert not needs_retrieval(message)
+
+
+@pytest.mark.parametrize('message', [
+    'now plot its derivative',
+    'shade the area between them',
+    'make it red',
+    'plot that',
+    'graph the function',
+    'draw the curve from the handout',
+    'plot the function from chapter 2',
+    'add the tangent line at x=2 from the example',
+    'what is the vertex of this parabola?',
+    'explain what the document says about limits',
+])
+def test_graph_actions_that_refer_to_context_keep_retrieval(message):
+    assert needs_retrieval(message)